@@ -0,0 +1,66 @@
+"""
+冷启动基准测试
+在全新的子进程中测量 import chenmo.cli 的耗时，并检查导入没有副作用
+
+用法: python benchmarks/bench_import.py [--runs 20] [--max-ms 80]
+超过 --max-ms（中位数）或导入时创建了 ~/.chenmo 时以非零状态退出，可用作 CI 门禁
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# 子进程中执行：只计导入本身的耗时
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{'ms': elapsed * 1000, 'modules': sorted(sys.modules)}}))
+"""
+
+# 不应在导入时加载的模块
+HEAVY_MODULES = ['requests', 'yaml', 'openai', 'ollama', 'numpy', 'zstandard', 'asyncio']
+
+
+def measure(module: str, home: str) -> dict:
+    env = dict(os.environ, HOME=home, PYTHONPATH=str(ROOT))
+    output = subprocess.run([sys.executable, '-c', PROBE.format(module=module)], env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='冷启动基准测试')
+    parser.add_argument('--runs', type=int, default=20, help='子进程次数')
+    parser.add_argument('--max-ms', type=float, default=None, help='中位数上限（毫秒）')
+    parser.add_argument('--module', default='chenmo.cli', help='要导入的模块')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        results = [measure(args.module, home) for _ in range(args.runs)]
+        created = (Path(home) / '.chenmo').exists()
+
+    times = sorted(result['ms'] for result in results)
+    median = statistics.median(times)
+    heavy = [name for name in HEAVY_MODULES if name in results[0]['modules']]
+    print(f"import {args.module}: median {median:.1f} ms, min {times[0]:.1f} ms, max {times[-1]:.1f} ms "
+          f"({args.runs} runs)")
+    print(f"heavy modules loaded: {', '.join(heavy) or 'none'}")
+    print(f"~/.chenmo created at import: {'yes' if created else 'no'}")
+
+    failed = created or bool(heavy)
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"median {median:.1f} ms exceeds limit {args.max_ms:.1f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
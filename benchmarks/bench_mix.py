@@ -0,0 +1,68 @@
+"""
+批量混合基准测试
+比较逐个调用 x(...)（每次重新加载源、单独创建作品）与 mix_many 一次生成 N 个混合实体的吞吐量
+
+用法: python benchmarks/bench_mix.py [--hybrids 2000] [--sources 50] [--backend file]
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from chenmo.core import ChenmoEngine
+from chenmo.operations import Operations
+from chenmo import mixing
+
+
+def make_sources(ops: Operations, count: int):
+    """生成源人物池"""
+    ops.register('pool')
+    with ops.storage.batch():
+        for n in range(count):
+            ops.storage.save_work_data('pool', f"source_{n}", 'p', {
+                "height": 1.5 + (n % 10) / 10,
+                "strength": float(n % 7),
+                "traits": [f"trait_{n % 23}", f"trait_{n % 17}"],
+                "physics": {"gravity": (n % 5) / 4, "aura": f"aura_{n % 3}"},
+                "tone": f"tone_{n % 4}",
+            })
+    return [('pool', f"source_{n}") for n in range(count)]
+
+
+def report(label: str, hybrids: int, elapsed: float):
+    print(f"{label:<32} {elapsed:8.2f}s  {hybrids / elapsed:10.0f} hybrids/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量混合基准测试')
+    parser.add_argument('--hybrids', type=int, default=2000, help='混合实体数量')
+    parser.add_argument('--sources', type=int, default=50, help='源实体数量')
+    parser.add_argument('--backend', default='file', choices=['file', 'sqlite'], help='存储后端')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    weights = [[rng.random() for _ in range(args.sources)] for _ in range(args.hybrids)]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        ops = Operations(ChenmoEngine(home_dir=temp_dir, backend=args.backend))
+        sources = make_sources(ops, args.sources)
+        print(f"{args.hybrids} 个混合 x {args.sources} 个源，numpy: {'是' if mixing.np is not None else '否'}")
+
+        # 逐个调用 x：每个混合实体一个作品（旧用法）
+        loop_count = min(args.hybrids, 200)
+        started = time.perf_counter()
+        for n in range(loop_count):
+            ops.mix('pool', sources=sources, weights=weights[n], target_type='p', toas=f"loop_{n}")
+        report(f"x(...) x{loop_count}", loop_count, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        print('  ' + ops.mix_many('pool', sources=sources, weights=weights, target_type='p', toas='bulk'))
+        report(f"mix_many x{args.hybrids}", args.hybrids, time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+.narr 打包基准测试
+比较单线程 zipfile（旧实现）与并行流式打包在 stored / deflated / zstd 下的吞吐量
+
+用法: python benchmarks/bench_package.py [--entities 100000] [--workers N]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from chenmo.packaging import write_package, directory_entries, iter_package
+
+
+class _CountingSink:
+    """只统计字节数的输出流（模拟管道/套接字）"""
+
+    def __init__(self):
+        self.size = 0
+        self.chunks = []
+
+    def write(self, data):
+        self.size += len(data)
+        self.chunks.append(data)
+
+
+def make_work(root: Path, entities: int):
+    """生成包含指定数量实体的作品目录"""
+    dirs = ['novies', 'cores', 'personas', 'tech']
+    for entity_dir in dirs:
+        (root / entity_dir).mkdir(parents=True)
+    (root / 'manifest.json').write_text(json.dumps({"name": "bench", "version": "1.0"}), encoding='utf-8')
+    for n in range(entities):
+        data = {
+            "description": f"entity {n} of the benchmark universe",
+            "traits": [f"trait_{n % 97}", f"trait_{n % 89}", "潘多拉呼吸能力"],
+            "constraints": [f"constraint_{n % 13}"],
+        }
+        path = root / dirs[n % 4] / f"entity_{n}.json"
+        path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding='utf-8')
+
+
+def bench_zipfile(root: Path) -> dict:
+    """旧实现：单线程 zipfile + ZIP_DEFLATED"""
+    started = time.perf_counter()
+    sink = tempfile.TemporaryFile()
+    bytes_in = 0
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = Path(dirpath) / filename
+                bytes_in += path.stat().st_size
+                zipf.write(path, path.relative_to(root))
+    size = sink.tell()
+    sink.close()
+    elapsed = time.perf_counter() - started
+    return {'bytes_in': bytes_in, 'bytes_out': size, 'seconds': elapsed, 'mb_per_sec': bytes_in / 1e6 / elapsed}
+
+
+def report(label: str, stats: dict):
+    print(f"{label:<28} {stats['seconds']:8.2f}s  {stats['mb_per_sec']:8.1f} MB/s  "
+          f"{stats['bytes_out'] / 1e6:8.1f} MB out")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='.narr 打包基准测试')
+    parser.add_argument('--entities', type=int, default=100000, help='实体数量')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='并行压缩进程数')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / 'bench'
+        print(f"生成 {args.entities} 个实体 ...")
+        make_work(root, args.entities)
+        entries = directory_entries(root)
+
+        report('zipfile deflated (旧实现)', bench_zipfile(root))
+
+        for compression in ['stored', 'deflated', 'zstd']:
+            for workers in sorted({1, args.workers}):
+                sink = _CountingSink()
+                try:
+                    stats = write_package(sink, entries, compression=compression, workers=workers)
+                except ImportError as e:
+                    print(f"{compression:<28} 跳过: {e}")
+                    break
+                report(f"{compression} x{workers}", stats)
+
+            if compression == 'deflated':
+                import io
+                started = time.perf_counter()
+                count = sum(1 for _ in iter_package(io.BytesIO(b''.join(sink.chunks))))
+                elapsed = time.perf_counter() - started
+                print(f"{'stream read deflated':<28} {elapsed:8.2f}s  {count / elapsed:8.0f} entries/s")
+
+
+if __name__ == '__main__':
+    main()
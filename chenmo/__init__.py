@@ -3,37 +3,75 @@
 Deploy, Register, Mix, Inspect, Reason, Import, Search, Generate, Update, and Output Structured Fictional Universes
 """
 
-import os
-import json
-from pathlib import Path
-
-# 创建主类和操作接口
-from .core import ChenmoEngine
-from .operations import Operations
-from .llm_interface import LLMInterface
-from .storage import StorageManager
-
-# 初始化引擎
-engine = ChenmoEngine()
-ops = Operations(engine)
-storage = StorageManager()
-
-# DSL 操作接口 - 使用代理来支持点操作符语法
-d = ops.deploy_proxy()  # 部署
-u = ops.update_proxy()  # 更新
-l = ops.register_proxy()  # 注册
-x = ops.mix_proxy()  # 混合
-f = ops.fabricate_proxy()  # 实例化
-c = ops.core_extract_proxy()  # 内核提取
-p = ops.persona_extract_proxy()  # 人物提取
-m = ops.mirror_proxy()  # 镜像
-t = ops.transmute_proxy()  # 转义
-r = ops.run_proxy()  # 推演
-i = ops.inspect_proxy()  # 查看
-s = ops.search_proxy()  # 搜索
-
-# LLM 接口
-llm = LLMInterface
+import threading
+
+# 全局引擎与操作接口在首次使用时才创建：import chenmo 不读写 ~/.chenmo，也不加载存储后端
+_ops = None
+_init_lock = threading.Lock()
+
+# DSL 操作接口与 Operations 方法的对应关系
+_OPERATIONS = {
+    'd': 'deploy',  # 部署
+    'u': 'update',  # 更新
+    'l': 'register',  # 注册
+    'x': 'mix',  # 混合
+    'xm': 'mix_many',  # 批量混合
+    'f': 'fabricate',  # 实例化
+    'c': 'core_extract',  # 内核提取
+    'p': 'persona_extract',  # 人物提取
+    'm': 'mirror',  # 镜像
+    't': 'transmute',  # 转义
+    'r': 'run',  # 推演
+    'i': 'inspect',  # 查看
+    's': 'search',  # 搜索
+}
+
+
+def _get_ops():
+    """全局操作接口（首次调用时创建引擎）"""
+    global _ops
+    if _ops is None:
+        with _init_lock:
+            if _ops is None:
+                from .core import ChenmoEngine
+                from .operations import Operations
+                _ops = Operations(ChenmoEngine())
+    return _ops
+
+
+class _LazyOperation:
+    """调用时才绑定到全局操作接口的方法"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        return getattr(_get_ops(), self.name)(*args, **kwargs)
+
+
+def __getattr__(name):
+    # DSL 操作接口 - 使用代理来支持点操作符语法；首次访问时创建并缓存
+    if name in _OPERATIONS:
+        from .operations import OperationProxy
+        value = OperationProxy(_LazyOperation(_OPERATIONS[name]))
+    elif name == 'ops':
+        value = _get_ops()
+    elif name == 'engine':
+        value = _get_ops().engine
+    elif name == 'llm':
+        # LLM 接口
+        from .llm_interface import LLMInterface
+        value = LLMInterface
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def get_storage():
+    """全局存储管理器（chenmo.storage 是同名子模块，因此以函数提供）"""
+    return _get_ops().storage
+
 
 # 输出接口
 def print_func(content, to=None, format="narrative", merge="strict"):
@@ -46,15 +84,15 @@ def print_func(content, to=None, format="narrative", merge="strict"):
 # CLI 快速引用接口
 def frm(identifier):
     """设置当前工作标识符"""
-    engine.set_current_work(identifier)
+    _get_ops().engine.set_current_work(identifier)
     return identifier
 
 def inport(entity, as_alias=None):
     """导入实体"""
-    return engine.import_entity(entity, as_alias)
+    return _get_ops().engine.import_entity(entity, as_alias)
 
 # 导出主要接口
-__all__ = ['d', 'u', 'l', 'x', 'f', 'c', 'p', 'm', 't', 'r', 'i', 's', 'llm', 'print', 'frm', 'inport']
+__all__ = ['d', 'u', 'l', 'x', 'xm', 'f', 'c', 'p', 'm', 't', 'r', 'i', 's', 'llm', 'print', 'frm', 'inport', 'get_storage']
 
 # 设置别名
-print = print_func
\ No newline at end of file
+print = print_func
@@ -0,0 +1,622 @@
+"""
+存储后端模块
+实体的实际存放方式：目录布局（默认）或单文件 SQLite 数据库
+"""
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Iterator, Tuple, Union
+from .objects import copy_writable
+from .utils import atomic_write, atomic_write_json, fsync_dir
+
+
+# 实体类型与目录的对应关系
+ENTITY_TYPE_DIRS = {
+    'c': 'cores',
+    'p': 'personas',
+    't': 'tech',
+    'm': 'personas',  # 镜像也存储在personas中
+    'novies': 'novies',
+}
+
+# 作品目录中的实体子目录
+ENTITY_DIRS = ['novies', 'cores', 'personas', 'tech']
+
+
+def entity_dir_name(entity_type: str) -> str:
+    """实体类型对应的目录名，未知类型默认为 novies"""
+    return ENTITY_TYPE_DIRS.get(entity_type, 'novies')
+
+
+class FileBackend:
+    """目录布局后端：每个实体一个 JSON 文件"""
+
+    name = 'file'
+
+    def __init__(self, engine):
+        self.engine = engine
+        # 写入均经由临时文件 + fsync + os.replace；目录 fsync 默认关闭
+        self.fsync = os.getenv('CHENMO_FSYNC', '1') != '0'
+        self.dir_fsync = os.getenv('CHENMO_DIR_FSYNC', '0') == '1'
+
+    def work_exists(self, work_name: str) -> bool:
+        """作品是否存在"""
+        return self.engine.get_work_path(work_name).exists()
+
+    def create_work(self, work_name: str, manifest: Dict[str, Any]) -> Path:
+        """创建作品目录结构"""
+        work_path = self.engine.get_work_path(work_name)
+
+        # 以 mkdir 的原子性检查命名冲突，并发创建同名作品时只有一方成功
+        work_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            work_path.mkdir()
+        except FileExistsError:
+            raise ValueError(f"Namespace collision: {work_name} already exists")
+
+        # 创建目录结构
+        for entity_dir in ENTITY_DIRS:
+            (work_path / entity_dir).mkdir(exist_ok=True)
+        if self.dir_fsync:
+            fsync_dir(work_path.parent)
+
+        self.save_file(work_name, 'manifest.json', manifest)
+        return work_path
+
+    def delete_work(self, work_name: str, keep_dir: bool = False):
+        """删除作品（作品即目录本身，keep_dir=True 时不做任何操作）"""
+        if keep_dir:
+            return
+        work_path = self.engine.get_work_path(work_name)
+        if work_path.exists():
+            shutil.rmtree(work_path)
+
+    def list_works(self) -> List[str]:
+        """列出全部作品标识符"""
+        works = []
+        for prefix, base_dir in (('', self.engine.works_dir), ('temps.', self.engine.temps_dir)):
+            if base_dir.exists():
+                # 以 . 开头的是导入中的暂存目录
+                works.extend(f"{prefix}{path.name}" for path in base_dir.iterdir()
+                             if path.is_dir() and not path.name.startswith('.'))
+        return works
+
+    def entity_path(self, work_name: str, entity_dir: str, sub_name: str) -> Path:
+        """实体文件路径"""
+        return self.engine.get_work_path(work_name) / entity_dir / f"{sub_name}.json"
+
+    def save(self, work_name: str, entity_type: str, sub_name: str, data: Dict[str, Any]) -> Path:
+        """保存实体"""
+        file_path = self.entity_path(work_name, entity_dir_name(entity_type), sub_name)
+        file_path.parent.mkdir(exist_ok=True)
+        atomic_write_json(file_path, data, fsync=self.fsync, dir_fsync=self.dir_fsync)
+        return file_path
+
+    def read(self, work_name: str, entity_dir: str, sub_name: str) -> Optional[Dict[str, Any]]:
+        """按目录读取实体"""
+        file_path = self.entity_path(work_name, entity_dir, sub_name)
+        if not file_path.exists():
+            return None
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def load(self, work_name: str, entity_type: str, sub_name: str) -> Optional[Dict[str, Any]]:
+        """加载实体"""
+        return self.read(work_name, entity_dir_name(entity_type), sub_name)
+
+    def exists(self, work_name: str, entity_type: str, sub_name: str) -> bool:
+        """实体是否存在"""
+        return self.entity_path(work_name, entity_dir_name(entity_type), sub_name).exists()
+
+    def location(self, work_name: str, entity_dir: str, sub_name: str) -> str:
+        """实体位置描述"""
+        return str(self.entity_path(work_name, entity_dir, sub_name))
+
+    def stamp(self, work_name: str, entity_dir: str, sub_name: str) -> Optional[tuple]:
+        """实体版本戳（仅 stat，不读取内容）；实体不存在时返回 None"""
+        try:
+            stat = os.stat(self.entity_path(work_name, entity_dir, sub_name))
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def iter_entries(self, work_name: Optional[str] = None) -> Iterator[Tuple[str, str, str, str]]:
+        """逐个产出 (作品, 目录, 实体名, 位置)，边遍历边产出"""
+        works = [work_name] if work_name else self.list_works()
+        for work in works:
+            work_path = self.engine.get_work_path(work)
+            for entity_dir in ENTITY_DIRS:
+                dir_path = work_path / entity_dir
+                if not dir_path.is_dir():
+                    continue
+                with os.scandir(dir_path) as entries:
+                    for entry in entries:
+                        if entry.name.endswith('.json'):
+                            yield work, entity_dir, entry.name[:-len('.json')], entry.path
+
+    def commit_batch(self, new_works: Dict[str, Dict[str, Any]],
+                     entities: List[Tuple[str, str, str, Dict[str, Any]]]) -> List[Path]:
+        """一次性提交一批写入
+
+        先把全部写入内容记入日志文件并 fsync（即提交点），再逐个以临时文件加 os.replace
+        的方式落盘（逐个写入时不 fsync），全部写完后统一 fsync 这些文件及其目录，
+        之后才删除日志。落盘过程中出错会恢复原有内容；进程在删除日志之前崩溃时，
+        下次启动由 recover() 重放日志。
+        """
+        for work_name in new_works:
+            if self.work_exists(work_name):
+                raise ValueError(f"Namespace collision: {work_name} already exists")
+
+        work_roots = []
+        dirs = []
+        writes = []
+        for work_name, manifest in new_works.items():
+            work_path = self.engine.get_work_path(work_name)
+            work_roots.append(str(work_path))
+            dirs.extend(str(work_path / entity_dir) for entity_dir in ENTITY_DIRS)
+            writes.append([str(work_path / 'manifest.json'), _dumps(manifest)])
+
+        locations = []
+        for work_name, entity_type, sub_name, data in entities:
+            file_path = self.entity_path(work_name, entity_dir_name(entity_type), sub_name)
+            if str(file_path.parent) not in dirs:
+                dirs.append(str(file_path.parent))
+            writes.append([str(file_path), _dumps(data)])
+            locations.append(file_path)
+
+        touched = sorted(set(new_works) | {entity[0] for entity in entities})
+        journal = {'works': touched, 'work_roots': work_roots, 'dirs': dirs, 'writes': writes}
+        journal_path = self._write_journal(journal)
+        try:
+            self._apply_journal(journal, rollback=True)
+        except Exception:
+            journal_path.unlink()
+            raise
+        # 日志是已报告提交的唯一持久副本，落盘的文件持久化之后才能删除
+        self._sync_journal_targets(journal)
+        journal_path.unlink()
+        return locations
+
+    def recover(self):
+        """重放上次崩溃时已提交但未落盘完成的批量写入"""
+        journal_dir = self.engine.home_dir / 'journal'
+        if not journal_dir.exists():
+            return
+        for journal_path in sorted(journal_dir.glob('batch-*.json')):
+            try:
+                with open(journal_path, 'r', encoding='utf-8') as f:
+                    journal = json.load(f)
+            except FileNotFoundError:
+                continue
+            # 持有相关作品的锁，避免重放其他进程正在提交的批次
+            with self.engine.locks.lock(*journal['works']):
+                if not journal_path.exists():
+                    continue
+                self._apply_journal(journal, rollback=False)
+                self._sync_journal_targets(journal)
+                journal_path.unlink()
+                for work_name in journal['works']:
+                    self.engine.reindex_work(work_name)
+
+    def _write_journal(self, journal: Dict[str, Any]) -> Path:
+        import uuid
+
+        journal_dir = self.engine.home_dir / 'journal'
+        journal_dir.mkdir(parents=True, exist_ok=True)
+        journal_path = journal_dir / f"batch-{os.getpid()}-{uuid.uuid4().hex}.json"
+        atomic_write(journal_path, json.dumps(journal, ensure_ascii=False), fsync=True, dir_fsync=self.dir_fsync)
+        return journal_path
+
+    def _sync_journal_targets(self, journal: Dict[str, Any]):
+        """fsync 日志中写入的文件、新建的目录及其上级目录（CHENMO_FSYNC=0 时跳过）"""
+        if not self.fsync:
+            return
+        dirs = set()
+        for path, _ in journal['writes']:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            dirs.add(os.path.dirname(path))
+        for dir_path in list(journal['dirs']) + list(journal['work_roots']):
+            dirs.add(dir_path)
+            dirs.add(os.path.dirname(dir_path))
+        for dir_path in sorted(dirs):
+            fsync_dir(dir_path)
+
+    def _apply_journal(self, journal: Dict[str, Any], rollback: bool):
+        created_roots = [Path(root) for root in journal['work_roots'] if not Path(root).exists()]
+        applied = []
+        try:
+            for dir_path in journal['dirs']:
+                Path(dir_path).mkdir(parents=True, exist_ok=True)
+            for path, text in journal['writes']:
+                path = Path(path)
+                previous = path.read_bytes() if rollback and path.exists() else None
+                # 日志已 fsync，逐个文件不再 fsync
+                atomic_write(path, text, fsync=False)
+                applied.append((path, previous))
+        except Exception:
+            if not rollback:
+                raise
+            # 恢复已写入的文件，删除本批新建的作品目录
+            for path, previous in reversed(applied):
+                if previous is None:
+                    path.unlink()
+                else:
+                    atomic_write(path, previous, fsync=False)
+            for root in created_roots:
+                if root.exists():
+                    shutil.rmtree(root)
+            raise
+
+    def save_file(self, work_name: str, filename: str, data: Dict[str, Any]):
+        """保存作品级元数据文件（manifest.json、lineage.json 等）"""
+        atomic_write_json(self.engine.get_work_path(work_name) / filename, data,
+                          fsync=self.fsync, dir_fsync=self.dir_fsync)
+
+    def load_file(self, work_name: str, filename: str) -> Optional[Dict[str, Any]]:
+        """读取作品级元数据文件"""
+        file_path = self.engine.get_work_path(work_name) / filename
+        if not file_path.exists():
+            return None
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def copy_work(self, source_work: str, target_work: str):
+        """复制整个作品（链接到对象存储中的同一内容，不复制数据）"""
+        target_path = self.engine.get_work_path(target_work)
+        if target_path.exists():
+            raise ValueError(f"Namespace collision: {target_work} already exists")
+        self.engine.objects.clone(self.engine.get_work_path(source_work), target_path, source_work)
+
+    def export_work(self, work_name: str, dest_dir: Union[str, Path]):
+        """导出为目录布局"""
+        # 导出的是独立副本，不带对象的只读权限
+        shutil.copytree(self.engine.get_work_path(work_name), dest_dir, dirs_exist_ok=True,
+                        copy_function=copy_writable)
+
+    def import_work(self, work_name: str, src_dir: Union[str, Path]):
+        """从目录布局导入（内容存入对象存储，与已有作品去重；不加锁，由调用方持有源与目标作品的锁）"""
+        target_path = self.engine.get_work_path(work_name)
+        if target_path.exists():
+            raise ValueError(f"Namespace collision: {work_name} already exists")
+
+        # 来源本身是本地作品时按链接克隆，无需重新计算未变文件的哈希
+        src_dir = Path(src_dir).expanduser().resolve()
+        source_work = self.engine.local_work_name(src_dir)
+        if source_work is not None and (src_dir / 'manifest.json').exists():
+            self.engine.objects.clone(src_dir, target_path, source_work)
+            return
+        self.engine.objects.ingest(src_dir, target_path)
+
+
+class SQLiteBackend:
+    """单文件 SQLite 后端：全部作品存放在一个数据库中，按 (作品, 目录, 实体名) 建立主键索引
+
+    实体与作品级 JSON 文件（manifest.json、lineage.json）存放在数据库中；
+    events/ 等辅助数据仍写入作品目录。
+    """
+
+    name = 'sqlite'
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS works (
+        name TEXT PRIMARY KEY
+    );
+    CREATE TABLE IF NOT EXISTS work_files (
+        work TEXT NOT NULL,
+        name TEXT NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (work, name)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS entities (
+        work TEXT NOT NULL,
+        dir TEXT NOT NULL,
+        name TEXT NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (work, dir, name)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS versions (
+        work TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, engine, db_path: Union[str, Path]):
+        self.engine = engine
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+        self._conns = []
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """延迟打开数据库（sqlite3 连接不能跨线程使用，每个线程各开一个）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self._SCHEMA)
+            self._local.conn = conn
+            self._conns.append(conn)
+        return conn
+
+    def close(self):
+        """关闭数据库"""
+        for conn in self._conns:
+            conn.close()
+        self._conns = []
+        self._local = threading.local()
+
+    def work_exists(self, work_name: str) -> bool:
+        """作品是否存在"""
+        row = self.conn.execute("SELECT 1 FROM works WHERE name = ?", (work_name,)).fetchone()
+        return row is not None
+
+    def create_work(self, work_name: str, manifest: Dict[str, Any]) -> Path:
+        """创建作品记录"""
+        try:
+            with self.conn:
+                self.conn.execute("INSERT INTO works (name) VALUES (?)", (work_name,))
+                self._put_file(work_name, 'manifest.json', manifest)
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Namespace collision: {work_name} already exists")
+        return self.engine.get_work_path(work_name)
+
+    def delete_work(self, work_name: str, keep_dir: bool = False):
+        """删除作品记录与辅助目录（keep_dir=True 时只删除数据库中的记录）"""
+        with self.conn:
+            self.conn.execute("DELETE FROM entities WHERE work = ?", (work_name,))
+            self.conn.execute("DELETE FROM work_files WHERE work = ?", (work_name,))
+            self.conn.execute("DELETE FROM works WHERE name = ?", (work_name,))
+            # 计数器保留：同名作品重建后版本戳也不会与旧缓存重合
+            self._bump(work_name)
+        work_path = self.engine.get_work_path(work_name)
+        if not keep_dir and work_path.exists():
+            shutil.rmtree(work_path)
+
+    def list_works(self) -> List[str]:
+        """列出全部作品标识符"""
+        return [row[0] for row in self.conn.execute("SELECT name FROM works ORDER BY name")]
+
+    def save(self, work_name: str, entity_type: str, sub_name: str, data: Dict[str, Any]) -> str:
+        """保存实体"""
+        entity_dir = entity_dir_name(entity_type)
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO works (name) VALUES (?)", (work_name,))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entities (work, dir, name, data) VALUES (?, ?, ?, ?)",
+                (work_name, entity_dir, sub_name, json.dumps(data, ensure_ascii=False))
+            )
+            self._bump(work_name)
+        return self.location(work_name, entity_dir, sub_name)
+
+    def read(self, work_name: str, entity_dir: str, sub_name: str) -> Optional[Dict[str, Any]]:
+        """按目录读取实体"""
+        row = self.conn.execute(
+            "SELECT data FROM entities WHERE work = ? AND dir = ? AND name = ?",
+            (work_name, entity_dir, sub_name)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def load(self, work_name: str, entity_type: str, sub_name: str) -> Optional[Dict[str, Any]]:
+        """加载实体"""
+        return self.read(work_name, entity_dir_name(entity_type), sub_name)
+
+    def exists(self, work_name: str, entity_type: str, sub_name: str) -> bool:
+        """实体是否存在"""
+        row = self.conn.execute(
+            "SELECT 1 FROM entities WHERE work = ? AND dir = ? AND name = ?",
+            (work_name, entity_dir_name(entity_type), sub_name)
+        ).fetchone()
+        return row is not None
+
+    def location(self, work_name: str, entity_dir: str, sub_name: str) -> str:
+        """实体位置描述"""
+        return f"sqlite://{self.db_path}#{work_name}/{entity_dir}/{sub_name}"
+
+    def stamp(self, work_name: str, entity_dir: str, sub_name: str) -> tuple:
+        """版本戳：作品的写入计数器（存放在数据库中，与连接和线程无关，任何连接写入实体时递增）"""
+        row = self.conn.execute("SELECT version FROM versions WHERE work = ?", (work_name,)).fetchone()
+        return ('sqlite', row[0] if row else 0)
+
+    def iter_entries(self, work_name: Optional[str] = None) -> Iterator[Tuple[str, str, str, str]]:
+        """逐个产出 (作品, 目录, 实体名, 位置)"""
+        if work_name:
+            rows = self.conn.execute(
+                "SELECT work, dir, name FROM entities WHERE work = ? ORDER BY dir, name", (work_name,)
+            )
+        else:
+            rows = self.conn.execute("SELECT work, dir, name FROM entities ORDER BY work, dir, name")
+        for work, entity_dir, name in rows:
+            yield work, entity_dir, name, self.location(work, entity_dir, name)
+
+    def commit_batch(self, new_works: Dict[str, Dict[str, Any]],
+                     entities: List[Tuple[str, str, str, Dict[str, Any]]]) -> List[str]:
+        """在单个事务中提交一批写入"""
+        try:
+            with self.conn:
+                for work_name, manifest in new_works.items():
+                    self.conn.execute("INSERT INTO works (name) VALUES (?)", (work_name,))
+                    self._put_file(work_name, 'manifest.json', manifest)
+                rows = []
+                for work_name, entity_type, sub_name, data in entities:
+                    self.conn.execute("INSERT OR IGNORE INTO works (name) VALUES (?)", (work_name,))
+                    rows.append((work_name, entity_dir_name(entity_type), sub_name, json.dumps(data, ensure_ascii=False)))
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO entities (work, dir, name, data) VALUES (?, ?, ?, ?)", rows
+                )
+                for work_name in {row[0] for row in rows}:
+                    self._bump(work_name)
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Namespace collision: {', '.join(new_works)} already exists")
+        return [self.location(row[0], row[1], row[2]) for row in rows]
+
+    def recover(self):
+        """SQLite 自带事务恢复，无需处理"""
+        pass
+
+    def save_file(self, work_name: str, filename: str, data: Dict[str, Any]):
+        """保存作品级元数据文件"""
+        with self.conn:
+            self._put_file(work_name, filename, data)
+
+    def load_file(self, work_name: str, filename: str) -> Optional[Dict[str, Any]]:
+        """读取作品级元数据文件"""
+        row = self.conn.execute(
+            "SELECT data FROM work_files WHERE work = ? AND name = ?", (work_name, filename)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def copy_work(self, source_work: str, target_work: str):
+        """复制整个作品（仅复制数据库行与辅助目录）"""
+        if not self.work_exists(source_work):
+            raise ValueError(f"Source work {source_work} does not exist")
+        try:
+            with self.conn:
+                self.conn.execute("INSERT INTO works (name) VALUES (?)", (target_work,))
+                self.conn.execute(
+                    "INSERT INTO entities (work, dir, name, data) "
+                    "SELECT ?, dir, name, data FROM entities WHERE work = ?",
+                    (target_work, source_work)
+                )
+                self.conn.execute(
+                    "INSERT INTO work_files (work, name, data) "
+                    "SELECT ?, name, data FROM work_files WHERE work = ?",
+                    (target_work, source_work)
+                )
+                self._bump(target_work)
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Namespace collision: {target_work} already exists")
+
+        source_path = self.engine.get_work_path(source_work)
+        if source_path.exists():
+            shutil.copytree(source_path, self.engine.get_work_path(target_work), dirs_exist_ok=True)
+
+    def export_work(self, work_name: str, dest_dir: Union[str, Path]):
+        """导出为目录布局"""
+        dest_dir = Path(dest_dir)
+        aux_path = self.engine.get_work_path(work_name)
+        if aux_path.exists():
+            shutil.copytree(aux_path, dest_dir, dirs_exist_ok=True)
+
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        for entity_dir in ENTITY_DIRS:
+            (dest_dir / entity_dir).mkdir(exist_ok=True)
+
+        for filename, data in self.conn.execute(
+            "SELECT name, data FROM work_files WHERE work = ?", (work_name,)
+        ):
+            _write_json(dest_dir / filename, json.loads(data))
+        for entity_dir, name, data in self.conn.execute(
+            "SELECT dir, name, data FROM entities WHERE work = ?", (work_name,)
+        ):
+            _write_json(dest_dir / entity_dir / f"{name}.json", json.loads(data))
+
+    def import_work(self, work_name: str, src_dir: Union[str, Path]):
+        """从目录布局导入：实体与根目录 JSON 写入数据库，其余文件保留在作品目录"""
+        src_dir = Path(src_dir)
+        entity_rows = []
+        file_rows = []
+        aux_items = []
+        for item in src_dir.iterdir():
+            if item.is_dir() and item.name in ENTITY_DIRS:
+                for entity_file in item.glob('*.json'):
+                    with open(entity_file, 'r', encoding='utf-8') as f:
+                        entity_rows.append((work_name, item.name, entity_file.stem, f.read()))
+            elif item.is_file() and item.suffix == '.json':
+                with open(item, 'r', encoding='utf-8') as f:
+                    file_rows.append((work_name, item.name, f.read()))
+            else:
+                aux_items.append(item)
+
+        try:
+            with self.conn:
+                self.conn.execute("INSERT INTO works (name) VALUES (?)", (work_name,))
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO entities (work, dir, name, data) VALUES (?, ?, ?, ?)", entity_rows
+                )
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO work_files (work, name, data) VALUES (?, ?, ?)", file_rows
+                )
+                self._bump(work_name)
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Namespace collision: {work_name} already exists")
+
+        aux_path = self.engine.get_work_path(work_name)
+        for item in aux_items:
+            aux_path.mkdir(parents=True, exist_ok=True)
+            if item.is_dir():
+                shutil.copytree(item, aux_path / item.name, dirs_exist_ok=True)
+            else:
+                shutil.copy2(item, aux_path / item.name)
+
+    def _bump(self, work_name: str):
+        # 在调用方的事务中递增作品的写入计数器
+        self.conn.execute("INSERT OR IGNORE INTO versions (work, version) VALUES (?, 0)", (work_name,))
+        self.conn.execute("UPDATE versions SET version = version + 1 WHERE work = ?", (work_name,))
+
+    def _put_file(self, work_name: str, filename: str, data: Dict[str, Any]):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO work_files (work, name, data) VALUES (?, ?, ?)",
+            (work_name, filename, json.dumps(data, ensure_ascii=False))
+        )
+
+
+def _dumps(data: Dict[str, Any]) -> str:
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
+def _write_json(path: Path, data: Dict[str, Any]):
+    atomic_write_json(path, data, fsync=False)
+
+
+def create_backend(engine, name: str):
+    """按名称创建存储后端"""
+    if name == 'file':
+        return FileBackend(engine)
+    elif name == 'sqlite':
+        return SQLiteBackend(engine, engine.home_dir / 'chenmo.db')
+    else:
+        raise ValueError(f"Unsupported storage backend: {name}")
+
+
+def migrate_works(source, target, works: Optional[List[str]] = None) -> List[str]:
+    """在两个后端之间迁移作品（经由目录布局中转）
+
+    两个后端共用同一主目录时（cm migrate），works/<作品> 既是文件后端的作品目录，又是
+    SQLite 后端的辅助目录：导出后先把该目录移到一旁再导入，成功后删除旧目录并从来源后端
+    移除该作品，迁移即为移动，旧的逐实体文件不会残留；导入失败时原样恢复。
+    """
+    import tempfile
+    import uuid
+
+    migrated = []
+    for work_name in works or source.list_works():
+        with tempfile.TemporaryDirectory() as temp_dir:
+            staging = Path(temp_dir) / 'work'
+            source.export_work(work_name, staging)
+            work_path = target.engine.get_work_path(work_name)
+            shared = source.engine.get_work_path(work_name) == work_path
+            aside = None
+            if shared and work_path.exists():
+                aside = work_path.with_name(f".{work_path.name}.{uuid.uuid4().hex}.migrating")
+                os.rename(work_path, aside)
+            try:
+                target.import_work(work_name, staging)
+            except BaseException:
+                if aside is not None:
+                    shutil.rmtree(work_path, ignore_errors=True)
+                    os.rename(aside, work_path)
+                raise
+            if shared:
+                source.delete_work(work_name, keep_dir=True)
+                if aside is not None:
+                    shutil.rmtree(aside)
+        migrated.append(work_name)
+    return migrated
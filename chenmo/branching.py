@@ -0,0 +1,130 @@
+"""
+分支模块
+把作品的内存快照分叉为多个假设分支，在进程池中并行推演，只持久化选中的分支
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Sequence
+from .backends import entity_dir_name
+from .rules import WorldState, compile_condition
+
+
+# 分支数少于此值时在当前进程中推演（进程池的启动开销更大）
+MIN_PARALLEL_BRANCHES = 16
+
+# 工作进程中的快照（fork 时直接继承父进程内存，写时复制，不经序列化）
+_SNAPSHOT = None
+
+
+class WorkSnapshot:
+    """作品的内存快照：全部实体、事件 outcome 的累计状态、事件计数与快照时的事件序号"""
+
+    def __init__(self, work_name: str, entities: Dict[tuple, Dict[str, Any]],
+                 state: Dict[str, Any], counts: Dict[str, int], last_seq: int):
+        self.work_name = work_name
+        self.entities = entities
+        self.state = state
+        self.counts = counts
+        self.last_seq = last_seq
+
+    @classmethod
+    def capture(cls, engine, work_name: str) -> 'WorkSnapshot':
+        """读取作品当前的实体与事件历史"""
+        if not engine.work_exists(work_name):
+            raise ValueError(f"Work {work_name} does not exist")
+        with engine.locks.lock(work_name):
+            entities = {
+                (entity_dir, name): engine.backend.read(work_name, entity_dir, name)
+                for _, entity_dir, name, _ in engine.backend.iter_entries(work_name)
+            }
+            current = engine.snapshots(work_name).state_at()
+            return cls(work_name, entities, current['state'], current['counts'], current['seq'])
+
+    def world(self) -> WorldState:
+        """分支的世界状态：实体与快照共享，只读引用；累计状态为独立副本"""
+        return WorldState(loader=lambda entity_type, name: self.entities.get((entity_dir_name(entity_type), name)),
+                          state=self.state, counts=self.counts)
+
+
+class Branch:
+    """一个假设分支的推演结果"""
+
+    def __init__(self, index: int, runs: List[Dict[str, Any]], events: List[Dict[str, Any]], state: Dict[str, Any]):
+        self.index = index
+        self.runs = runs
+        self.events = events
+        self.state = state
+
+    def __repr__(self):
+        return f"Branch({self.index}, events={len(self.events)})"
+
+
+def run_branch(snapshot: WorkSnapshot, index: int, runs: List[Dict[str, Any]], triggered_by: str) -> Branch:
+    """在快照上依次执行 run 序列（when/then/outcome），与 Operations.run 的语义一致"""
+    world = snapshot.world()
+    events = []
+    for run in runs:
+        when = run.get('when', None)
+        if when is None:
+            condition_met = True
+        elif isinstance(when, str):
+            condition_met = compile_condition(when)(world)
+        else:
+            condition_met = bool(when)
+        if condition_met:
+            record = {"event": run.get('then', ''), "outcome": run.get('outcome', {}), "triggered_by": triggered_by}
+            world.apply(record)
+            events.append(record)
+    return Branch(index, runs, events, world.state)
+
+
+def _init_worker(snapshot: WorkSnapshot):
+    global _SNAPSHOT
+    _SNAPSHOT = snapshot
+
+
+def _run_chunk(chunk: List[tuple], triggered_by: str) -> List[Branch]:
+    return [run_branch(_SNAPSHOT, index, runs, triggered_by) for index, runs in chunk]
+
+
+def explore(snapshot: WorkSnapshot, variants: Sequence[List[Dict[str, Any]]], triggered_by: str,
+            workers: Optional[int] = None) -> List[Branch]:
+    """对每个变体（run 参数列表）分叉一个分支并推演，按变体顺序返回结果"""
+    workers = workers or os.cpu_count() or 1
+    indexed = list(enumerate(variants))
+    if workers <= 1 or len(indexed) < MIN_PARALLEL_BRANCHES:
+        return [run_branch(snapshot, index, runs, triggered_by) for index, runs in indexed]
+
+    # 快照经 initializer 交给工作进程：fork 时直接继承，其他启动方式下每个进程只序列化一次
+    context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+    size = max(1, len(indexed) // (workers * 4))
+    chunks = [indexed[start:start + size] for start in range(0, len(indexed), size)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(snapshot,)) as executor:
+        results = executor.map(_run_chunk, chunks, [triggered_by] * len(chunks))
+        return [branch for chunk in results for branch in chunk]
+
+
+def keep_branch(engine, snapshot: WorkSnapshot, branch: Branch, toas: str, rcd: str = '') -> str:
+    """把分支持久化为新作品：以链接方式复制源作品，追加分支事件，并写入 lineage.json"""
+    source_work = snapshot.work_name
+    with engine.locks.lock(source_work, toas):
+        if engine.work_exists(toas):
+            raise ValueError(f"Namespace collision: {toas} already exists")
+        if engine.event_log(source_work).last_seq() != snapshot.last_seq:
+            raise ValueError(f"Work {source_work} changed since the branches were forked")
+
+        engine.copy_work(source_work, toas)
+        if branch.events:
+            engine.event_log(toas).append_many(branch.events)
+            engine.snapshots(toas).update()
+        engine.save_work_file(toas, 'lineage.json', {
+            "original_source": source_work,
+            "transmutation_reason": rcd or f"branch {branch.index}",
+            "transmutation_date": datetime.now(timezone.utc).isoformat(),
+            "branch": branch.index,
+            "forked_at_seq": snapshot.last_seq,
+        })
+    return toas
@@ -0,0 +1,77 @@
+"""
+缓存模块
+已解析实体的有界 LRU 缓存
+"""
+import copy
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, Hashable
+
+
+class EntityCache:
+    """有界 LRU 实体缓存
+
+    以 (作品, 目录, 实体名) 为键。每个条目记录加载时的版本戳（文件的 mtime/大小，
+    或 SQLite 后端作品的写入计数器），读取时版本戳不一致即视为失效。
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str, str], stamp: Hashable) -> Optional[Dict[str, Any]]:
+        """读取缓存，返回副本；未命中或版本戳不一致时返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != stamp:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            data = entry[1]
+        return copy.deepcopy(data)
+
+    def put(self, key: Tuple[str, str, str], data: Dict[str, Any], stamp: Hashable):
+        """写入缓存（保存副本，调用方之后的修改不会影响缓存）"""
+        if self.maxsize <= 0:
+            return
+        data = copy.deepcopy(data)
+        with self._lock:
+            self._entries[key] = (stamp, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Tuple[str, str, str]):
+        """使单个条目失效"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_work(self, work_name: str):
+        """使某个作品的全部条目失效"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == work_name]:
+                del self._entries[key]
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """命中、未命中与淘汰计数"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
@@ -5,8 +5,18 @@
 import argparse
 import sys
 import json
-from . import d, u, l, x, f, c, p, m, t, r, i, s, llm, print, frm, inport
-from .utils import list_all_works, clean_temp_files
+from . import d, u, l, x, f, c, p, m, t, r, i, s, print, frm, inport
+from .utils import clean_temp_files
+
+
+def _prompt_resolution(entry):
+    """交互式合并：逐个询问冲突文件的处理方式"""
+    keys = f"（冲突键: {', '.join(entry['keys'])}）" if entry['keys'] else ''
+    choices = {'t': 'theirs', 'o': 'ours', 'p': 'patch'}
+    while True:
+        answer = input(f"冲突 {entry['path']}{keys} 采用 [t]来源 / [o]保留本地 / [p]逐字段合并: ").strip().lower()
+        if answer[:1] in choices:
+            return choices[answer[:1]]
 
 
 def main():
@@ -27,7 +37,8 @@ def main():
     update_parser.add_argument('--from', dest='from_path', help='源路径')
     update_parser.add_argument('--lo', help='本地起源')
     update_parser.add_argument('--toas', help='新作品名')
-    update_parser.add_argument('--merge', choices=['overlay', 'patch', 'strict'], default='overlay', help='合并策略')
+    update_parser.add_argument('--merge', choices=['overlay', 'patch', 'strict', 'interactive'], default='overlay', help='合并策略')
+    update_parser.add_argument('--dry-run', action='store_true', help='只输出合并计划，不写入')
     
     # register command
     register_parser = subparsers.add_parser('register', aliases=['l'], help='注册新作品')
@@ -42,14 +53,35 @@ def main():
     search_parser.add_argument('keyword', help='搜索关键词')
     search_parser.add_argument('--work', help='限制搜索范围到特定作品')
     search_parser.add_argument('--type', choices=['p', 'c', 't', 'm', 'all'], help='实体类型')
+    search_parser.add_argument('--content', action='store_true', help='按实体内容全文检索')
+    search_parser.add_argument('--limit', type=int, default=20, help='每页结果数（全文检索）')
+    search_parser.add_argument('--offset', type=int, default=0, help='结果偏移量（全文检索）')
     
     # llm command
     llm_parser = subparsers.add_parser('llm', help='LLM生成接口')
     llm_parser.add_argument('--type', choices=['openai', 'ollama', 'custom'], default='openai', help='LLM类型')
     llm_parser.add_argument('--model', default='gpt-4o', help='模型名称')
     llm_parser.add_argument('--mode', choices=['narrative', 'world'], default='narrative', help='生成模式')
+    llm_parser.add_argument('--no-cache', action='store_true', help='不读写响应缓存')
+    llm_parser.add_argument('--no-stream', action='store_true', help='等待完整回复后再输出')
+    llm_parser.add_argument('--to', help='输出到文件')
+    llm_parser.add_argument('--work', help='检索该作品的相关实体注入提示')
+    llm_parser.add_argument('--context-k', type=int, default=5, help='注入的实体数上限')
+    llm_parser.add_argument('--context-tokens', type=int, default=1024, help='注入上下文的 token 预算')
     llm_parser.add_argument('prompt', nargs='?', help='提示词')
     
+    # generate command
+    generate_parser = subparsers.add_parser('generate', help='world 模式批量生成实体并写入作品')
+    generate_parser.add_argument('work_name', help='目标作品名称')
+    generate_parser.add_argument('--prompts', default='-', help='提示词文件，每行一个（- 为标准输入）')
+    generate_parser.add_argument('--type', choices=['openai', 'ollama'], default='openai', help='LLM类型')
+    generate_parser.add_argument('--model', default='gpt-4o', help='模型名称')
+    generate_parser.add_argument('--apiurl', help='模型服务地址')
+    generate_parser.add_argument('--concurrency', type=int, default=8, help='同时在途的请求数')
+    generate_parser.add_argument('--batch-size', type=int, default=64, help='每批写入的最大实体数')
+    generate_parser.add_argument('--merge', choices=['strict', 'overlay', 'patch'], default='strict', help='合并策略')
+    generate_parser.add_argument('--no-cache', action='store_true', help='不读写响应缓存')
+    
     # frm/inport command
     frm_parser = subparsers.add_parser('frm', help='快速引用接口')
     frm_parser.add_argument('identifier', help='作品标识符')
@@ -63,6 +95,29 @@ def main():
     # clean command
     clean_parser = subparsers.add_parser('clean', help='清理临时文件')
     
+    # migrate command
+    migrate_parser = subparsers.add_parser('migrate', help='在存储后端之间迁移作品')
+    migrate_parser.add_argument('--to', dest='target', choices=['file', 'sqlite'], required=True, help='目标后端')
+    migrate_parser.add_argument('--work', nargs='*', help='仅迁移指定作品')
+    
+    # reindex command
+    reindex_parser = subparsers.add_parser('reindex', help='重建搜索索引')
+    reindex_parser.add_argument('--work', help='仅重新索引指定作品')
+    
+    # gc command
+    gc_parser = subparsers.add_parser('gc', help='回收不再被引用的对象')
+    
+    # pack/unpack command
+    pack_parser = subparsers.add_parser('pack', help='导出作品为 .narr 包')
+    pack_parser.add_argument('work_name', help='作品名称')
+    pack_parser.add_argument('package', help='包文件路径（- 表示标准输出）')
+    pack_parser.add_argument('--compression', choices=['stored', 'deflated', 'zstd'], default='deflated', help='压缩方式')
+    pack_parser.add_argument('--workers', type=int, help='并行压缩进程数')
+    
+    unpack_parser = subparsers.add_parser('unpack', help='从 .narr 包导入作品')
+    unpack_parser.add_argument('package', help='包文件路径（- 表示标准输入）')
+    unpack_parser.add_argument('work_name', help='本地命名')
+    
     # print command
     print_parser = subparsers.add_parser('print', help='输出内容')
     print_parser.add_argument('content', nargs='?', help='内容')
@@ -82,9 +137,13 @@ def main():
         print(result)
         
     elif args.command in ['update', 'u']:
-        result = u(args.work_name, from_path=getattr(args, 'from_path', None),
-                   lo=args.lo, toas=args.toas, merge=args.merge)
-        print(result)
+        options = {'from': args.from_path, 'lo': args.lo, 'merge': args.merge, 'dry_run': args.dry_run}
+        if args.toas:
+            options['toas'] = args.toas
+        if args.merge == 'interactive':
+            options['resolve'] = _prompt_resolution
+        result = u(args.work_name, **options)
+        print(result.describe() if args.dry_run else result)
         
     elif args.command in ['register', 'l']:
         result = l(args.work_name, 
@@ -95,18 +154,49 @@ def main():
         print(result)
         
     elif args.command in ['search', 's']:
-        result = s(args.keyword, work_filter=args.work)
-        for item in result:
-            print(f"Work: {item['work']}, Name: {item['name']}, Type: {item['type']}")
+        if args.content:
+            result = s(args.keyword, work_filter=args.work, type_filter=args.type,
+                       mode='content', limit=args.limit, offset=args.offset)
+            for item in result:
+                print(f"Work: {item.work}, Name: {item.name}, Type: {item.type}, Score: {item.score:.3f}")
+        else:
+            # 边扫描边输出，不等待全部结果
+            for item in s(args.keyword, work_filter=args.work, type_filter=args.type, stream=True):
+                print(f"Work: {item.work}, Name: {item.name}, Type: {item.type}")
+                sys.stdout.flush()
         
     elif args.command == 'llm':
         if not args.prompt:
             print("错误: 需要提供提示词")
             return
-            
-        llm_instance = llm(type=args.type, model=args.model, mode=args.mode)
-        generated = llm_instance.generate(args.prompt)
-        print(generated)
+        
+        from . import llm
+        llm_instance = llm(type=args.type, model=args.model, mode=args.mode, cache=not args.no_cache,
+                           work=args.work, context_k=args.context_k, context_tokens=args.context_tokens)
+        if args.no_stream:
+            generated = llm_instance.generate(args.prompt)
+        else:
+            # 边生成边输出；world 模式下增量校验
+            generated = llm_instance.stream(args.prompt)
+        print(generated, to=args.to, format=args.mode)
+        
+    elif args.command == 'generate':
+        from . import llm, ops
+        from .pipeline import WorldPipeline, format_report
+        llm_instance = llm(type=args.type, model=args.model, apiurl=args.apiurl, mode='world',
+                           concurrency=args.concurrency)
+        pipeline = WorldPipeline(ops.storage, llm_instance, args.work_name, merge=args.merge,
+                                 batch_size=args.batch_size, cache=not args.no_cache)
+        source = sys.stdin if args.prompts == '-' else open(args.prompts, 'r', encoding='utf-8')
+        try:
+            # 逐行读取，提示词流不必一次性载入
+            report = pipeline.run(line.strip() for line in source if line.strip())
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        print(format_report(report))
+        for failure in report['failures']:
+            print(f"  failed [{failure['stage']}] {failure['prompt']}: {failure['error']}")
         
     elif args.command == 'frm':
         if args.action == 'inport':
@@ -115,14 +205,55 @@ def main():
             print(import_result)
         
     elif args.command == 'list':
-        works = list_all_works()
+        from . import engine
         print("所有作品:")
-        for work_type, work_name in works:
+        for work_name in engine.list_works():
+            work_type = 'temporary' if work_name.startswith('temps.') else 'persistent'
             print(f"  [{work_type}] {work_name}")
     
+    elif args.command == 'migrate':
+        from . import engine
+        from .backends import create_backend, migrate_works
+        target = create_backend(engine, args.target)
+        migrated = migrate_works(engine.backend, target, args.work)
+        print(f"已迁移 {len(migrated)} 个作品到 {args.target} 后端（设置 CHENMO_BACKEND={args.target} 后生效）")
+    
     elif args.command == 'clean':
-        clean_temp_files()
-        print("临时文件已清理")
+        from . import engine
+        removed = clean_temp_files(engine)
+        print(f"临时文件已清理（{removed} 个临时作品）")
+    
+    elif args.command == 'reindex':
+        from . import engine
+        if args.work:
+            engine.reindex_work(args.work)
+        else:
+            engine.rebuild_index()
+        print("搜索索引已重建")
+    
+    elif args.command == 'gc':
+        from . import engine
+        result = engine.objects.gc()
+        print(f"已回收 {result['removed']} 个对象，释放 {result['bytes']} 字节")
+    
+    elif args.command == 'pack':
+        from . import engine
+        from .storage import StorageManager
+        storage = StorageManager()
+        storage.initialize_with_engine(engine)
+        package = sys.stdout.buffer if args.package == '-' else args.package
+        if not storage.export_work_as_package(args.work_name, package, compression=args.compression, workers=args.workers):
+            sys.exit(f"错误: 作品 {args.work_name} 不存在")
+        if args.package != '-':
+            print(f"已导出 {args.work_name} 到 {args.package}")
+    
+    elif args.command == 'unpack':
+        from . import engine
+        from .storage import StorageManager
+        storage = StorageManager()
+        storage.initialize_with_engine(engine)
+        storage.import_package(sys.stdin.buffer if args.package == '-' else args.package, args.work_name)
+        print(f"已导入 {args.work_name}")
     
     elif args.command == 'print':
         if not args.content:
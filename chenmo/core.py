@@ -3,18 +3,20 @@
 """
 import os
 import json
-import yaml
 from pathlib import Path
-from typing import Dict, List, Any, Optional, Union
-import requests
-import tempfile
+from typing import Dict, List, Any, Optional, Sequence, Union, Iterator
+from .backends import create_backend, entity_dir_name
+from .cache import EntityCache
+from .locking import WorkLocks
+from .objects import ObjectStore
+from .utils import data_version
 
 
 class ChenmoEngine:
     """可编程元叙事引擎核心类"""
     
-    def __init__(self):
-        self.home_dir = Path.home() / '.chenmo'
+    def __init__(self, home_dir: Optional[Union[str, Path]] = None, backend: Optional[str] = None):
+        self.home_dir = Path(home_dir) if home_dir else Path.home() / '.chenmo'
         self.works_dir = self.home_dir / 'works'
         self.temps_dir = self.home_dir / 'temps' / 'works'
         
@@ -28,6 +30,35 @@ class ChenmoEngine:
         # 缓存已加载的作品
         self.loaded_works = {}
         
+        # 搜索索引（首次使用时打开）
+        self._index = None
+        
+        # 按作品划分的进程间写锁
+        self.locks = WorkLocks(self.home_dir / 'locks')
+        
+        # 按内容寻址的对象存储（派生作品以硬链接共享内容）
+        self.objects = ObjectStore(self.home_dir / 'objects')
+        
+        # 存储后端：file（目录布局，默认）或 sqlite（单文件数据库）
+        self.backend = create_backend(self, backend or os.getenv('CHENMO_BACKEND', 'file'))
+        
+        # 已解析实体的 LRU 缓存
+        self.cache = EntityCache(int(os.getenv('CHENMO_CACHE_SIZE', '1024')))
+        
+        # 各作品的事件日志（首次使用时打开）
+        self._event_logs = {}
+        
+        # 重放上次中断的批量写入
+        self.backend.recover()
+    
+    @property
+    def index(self):
+        """持久化搜索索引"""
+        if self._index is None:
+            from .index import SearchIndex
+            self._index = SearchIndex(self.home_dir / 'index')
+        return self._index
+        
     def set_current_work(self, identifier):
         """设置当前工作标识符"""
         self.current_work = identifier
@@ -49,13 +80,8 @@ class ChenmoEngine:
         parts = entity.split('.')
         if len(parts) >= 2:
             work_name = parts[0]
-            # 检查 works 目录
-            work_path = self.works_dir / work_name
-            if work_path.exists():
-                return True
-            # 检查 temps 目录
-            temp_work_path = self.temps_dir / work_name
-            if temp_work_path.exists():
+            # 检查持久作品与临时作品
+            if self.work_exists(work_name) or self.work_exists(f"temps.{work_name}"):
                 return True
         return False
     
@@ -82,153 +108,226 @@ class ChenmoEngine:
         else:
             return self.works_dir / work_name
     
-    def create_work_structure(self, work_name: str) -> Path:
-        """创建作品结构"""
-        work_path = self.get_work_path(work_name)
-        
-        # 检查是否已存在
-        if work_path.exists():
-            raise ValueError(f"Namespace collision: {work_name} already exists")
-        
-        # 创建目录结构
-        work_path.mkdir(parents=True, exist_ok=True)
-        (work_path / 'novies').mkdir(exist_ok=True)
-        (work_path / 'cores').mkdir(exist_ok=True)
-        (work_path / 'personas').mkdir(exist_ok=True)
-        (work_path / 'tech').mkdir(exist_ok=True)
-        
-        # 创建 manifest.json
-        manifest = {
+    def work_exists(self, work_name: str) -> bool:
+        """检查作品是否存在"""
+        return self.backend.work_exists(work_name)
+    
+    def list_works(self) -> List[str]:
+        """列出全部作品标识符"""
+        return self.backend.list_works()
+    
+    def new_manifest(self, work_name: str) -> Dict[str, Any]:
+        """新作品的 manifest.json 内容"""
+        return {
             "name": work_name,
             "version": "1.0",
             "canonical_source": work_name
         }
-        with open(work_path / 'manifest.json', 'w', encoding='utf-8') as f:
-            json.dump(manifest, f, ensure_ascii=False, indent=2)
-        
-        return work_path
+    
+    def create_work_structure(self, work_name: str) -> Path:
+        """创建作品结构"""
+        # 检查命名冲突并创建目录结构与 manifest.json（由存储后端完成）
+        with self.locks.lock(work_name):
+            return self.backend.create_work(work_name, self.new_manifest(work_name))
+    
+    def delete_work(self, work_name: str):
+        """删除作品"""
+        self.close_event_log(work_name)
+        self.backend.delete_work(work_name)
+        self.reindex_work(work_name)
     
     def save_entity(self, work_name: str, sub_name: str, entity_type: str, data: Dict[str, Any]):
         """保存实体"""
-        work_path = self.get_work_path(work_name)
-        
-        # 确定保存目录
-        if entity_type == 'c':  # core
-            target_dir = work_path / 'cores'
-        elif entity_type == 'p':  # persona
-            target_dir = work_path / 'personas'
-        elif entity_type == 't':  # tech
-            target_dir = work_path / 'tech'
-        elif entity_type == 'novies':  # novies
-            target_dir = work_path / 'novies'
-        else:
-            target_dir = work_path / 'novies'  # 默认
+        entity_dir = entity_dir_name(entity_type)
+        location = self.backend.save(work_name, entity_type, sub_name, data)
+        
+        # 缓存直写，后续读取无需访问磁盘
+        self.cache.put((work_name, entity_dir, sub_name), data, self.backend.stamp(work_name, entity_dir, sub_name))
+        
+        # 增量更新搜索索引
+        self.index.update_entity(work_name, entity_dir, sub_name, str(location), data)
         
-        target_dir.mkdir(exist_ok=True)
+        return location
+    
+    def save_batch(self, new_works: Dict[str, Dict[str, Any]], entities: List[tuple]) -> List[Any]:
+        """一次性提交一批作品创建与实体写入
+        
+        entities 为 (作品, 类型, 实体名, 数据) 列表；要么全部写入，要么全部不写入。
+        """
+        touched = set(new_works) | {entity[0] for entity in entities}
+        with self.locks.lock(*touched):
+            locations = self.backend.commit_batch(new_works, entities)
         
-        # 保存文件
-        file_path = target_dir / f"{sub_name}.json"
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        index_entries = []
+        for (work_name, entity_type, sub_name, data), location in zip(entities, locations):
+            entity_dir = entity_dir_name(entity_type)
+            self.cache.put((work_name, entity_dir, sub_name), data, self.backend.stamp(work_name, entity_dir, sub_name))
+            index_entries.append((work_name, entity_dir, sub_name, str(location), data))
+        self.index.update_entities(index_entries)
         
-        return file_path
+        return locations
     
     def load_entity(self, work_name: str, sub_name: str, entity_type: str) -> Optional[Dict[str, Any]]:
-        """加载实体"""
-        work_path = self.get_work_path(work_name)
-        
-        # 确定加载目录
-        if entity_type == 'c':  # core
-            target_dir = work_path / 'cores'
-        elif entity_type == 'p':  # persona
-            target_dir = work_path / 'personas'
-        elif entity_type == 't':  # tech
-            target_dir = work_path / 'tech'
-        elif entity_type == 'm':  # mirror
-            target_dir = work_path / 'personas'  # 镜像也存储在personas中
-        else:
-            target_dir = work_path / 'novies'  # 默认
+        """加载实体（优先读取 LRU 缓存，版本戳变化时重新加载）"""
+        entity_dir = entity_dir_name(entity_type)
+        key = (work_name, entity_dir, sub_name)
         
-        file_path = target_dir / f"{sub_name}.json"
-        if file_path.exists():
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+        stamp = self.backend.stamp(work_name, entity_dir, sub_name)
+        if stamp is None:
+            self.cache.invalidate(key)
+            return None
+        
+        data = self.cache.get(key, stamp)
+        if data is None:
+            data = self.backend.read(work_name, entity_dir, sub_name)
+            if data is not None:
+                self.cache.put(key, data, stamp)
+        return data
+    
+    def load_entities(self, keys: List[tuple], workers: Optional[int] = None) -> List[Optional[Dict[str, Any]]]:
+        """批量加载实体，keys 为 (作品, 实体名, 类型) 列表；重复的键只加载一次
+        
+        文件后端在线程池中并行读取；SQLite 连接不能跨线程共享，按顺序读取。
+        """
+        unique = list(dict.fromkeys(keys))
+        if self.backend.name == 'file' and len(unique) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=workers or min(32, len(unique))) as executor:
+                loaded = dict(zip(unique, executor.map(lambda key: self.load_entity(*key), unique)))
+        else:
+            loaded = {key: self.load_entity(*key) for key in unique}
+        return [loaded[key] for key in keys]
+    
+    def entity_version(self, work_name: str, sub_name: str, entity_type: str) -> Optional[str]:
+        """实体的内容版本号（用于乐观并发检查；实体不存在时为 None）"""
+        return data_version(self.load_entity(work_name, sub_name, entity_type))
+    
+    def event_log(self, work_name: str):
+        """作品的追加式事件日志（存放于作品目录的 events/ 下）
+
+        首次打开时把旧版逐事件文件（event_*.json）导入日志。
+        """
+        event_log = self._event_logs.get(work_name)
+        if event_log is None:
+            from .eventlog import EventLog, EVENTS_DIR
+            event_log = EventLog(self.get_work_path(work_name) / EVENTS_DIR,
+                                 lock=lambda: self.locks.lock(work_name))
+            if event_log.has_legacy():
+                event_log.import_legacy()
+            self._event_logs[work_name] = event_log
+            # 进程退出前完成批量 fsync
+            import atexit
+            atexit.register(event_log.close)
+        return event_log
+    
+    def close_event_log(self, work_name: str):
+        """关闭作品已打开的事件日志（作品目录将被删除或替换时调用）"""
+        event_log = self._event_logs.pop(work_name, None)
+        if event_log is not None:
+            event_log.close()
+    
+    def snapshots(self, work_name: str):
+        """作品事件日志的状态快照（存放于 events/snapshots/ 下）"""
+        from .snapshots import StateSnapshots
+        return StateSnapshots(self.event_log(work_name))
+    
+    def save_work_file(self, work_name: str, filename: str, data: Dict[str, Any]):
+        """保存作品级元数据文件（manifest.json、lineage.json 等）"""
+        self.backend.save_file(work_name, filename, data)
+    
+    def load_work_file(self, work_name: str, filename: str) -> Optional[Dict[str, Any]]:
+        """读取作品级元数据文件"""
+        return self.backend.load_file(work_name, filename)
+    
+    def copy_work(self, source_work: str, target_work: str):
+        """复制整个作品"""
+        self.backend.copy_work(source_work, target_work)
+        self.reindex_work(target_work)
+    
+    def export_work(self, work_name: str, dest_dir: Union[str, Path]):
+        """将作品导出为目录布局"""
+        if not self.work_exists(work_name):
+            raise ValueError(f"Work {work_name} does not exist")
+        self.backend.export_work(work_name, dest_dir)
+    
+    def import_work(self, work_name: str, src_dir: Union[str, Path]):
+        """从目录布局导入作品（src_dir 是本地作品时，调用方需同时持有它与目标作品的锁）"""
+        self.backend.import_work(work_name, src_dir)
+        self.reindex_work(work_name)
+    
+    def local_work_name(self, path: Union[str, Path]) -> Optional[str]:
+        """路径指向本地作品（works/ 或 temps/works/ 下）时返回其标识符，否则返回 None"""
+        path = Path(path).expanduser().resolve()
+        for prefix, base_dir in (('', self.works_dir), ('temps.', self.temps_dir)):
+            if path.parent == base_dir.resolve() and self.work_exists(f"{prefix}{path.name}"):
+                return f"{prefix}{path.name}"
         return None
     
+    def _iter_index_entries(self, work_name: Optional[str] = None) -> Iterator[tuple]:
+        """为索引逐个读取实体"""
+        for work, entity_dir, name, location in self.backend.iter_entries(work_name):
+            try:
+                data = self.backend.read(work, entity_dir, name) or {}
+            except (OSError, ValueError):
+                # 如果JSON解析失败，仍然记录基本信息
+                data = {}
+            yield work, entity_dir, name, location, data
+    
+    def reindex_work(self, work_name: str):
+        """重新索引单个作品（用于整目录复制、解包等批量变更之后）"""
+        self.cache.invalidate_work(work_name)
+        if self.work_exists(work_name):
+            self.index.index_work(work_name, self._iter_index_entries(work_name))
+        else:
+            self.index.remove_work(work_name)
+    
+    def rebuild_index(self):
+        """从存储后端全量重建搜索索引"""
+        self.index.rebuild(self._iter_index_entries())
+    
     def search_entities(self, keyword: str, work_filter: Optional[str] = None, type_filter: Optional[str] = None) -> List[Dict[str, Any]]:
         """搜索实体"""
-        results = []
+        # 首次搜索时从现有目录构建索引，之后由写入路径增量维护
+        if not self.index.is_built():
+            self.rebuild_index()
         
-        # 搜索 works 目录
-        for work_path in self.works_dir.iterdir():
-            if work_path.is_dir():
-                work_name = work_path.name
-                if work_filter and work_name != work_filter:
-                    continue
-                
-                # 搜索不同类型的实体
-                for entity_type in ['novies', 'cores', 'personas', 'tech']:
-                    entity_dir = work_path / entity_type
-                    if entity_dir.exists():
-                        for entity_file in entity_dir.iterdir():
-                            if entity_file.suffix == '.json':
-                                entity_name = entity_file.stem
-                                if keyword.lower() in entity_name.lower() or keyword.lower() in work_name.lower():
-                                    if not type_filter or type_filter == entity_type[0] or type_filter == 'all':
-                                        with open(entity_file, 'r', encoding='utf-8') as f:
-                                            try:
-                                                data = json.load(f)
-                                                results.append({
-                                                    'work': work_name,
-                                                    'name': entity_name,
-                                                    'type': entity_type[0],
-                                                    'path': str(entity_file),
-                                                    'data': data
-                                                })
-                                            except:
-                                                # 如果JSON解析失败，仍然记录基本信息
-                                                results.append({
-                                                    'work': work_name,
-                                                    'name': entity_name,
-                                                    'type': entity_type[0],
-                                                    'path': str(entity_file),
-                                                    'data': {}
-                                                })
-        
-        # 搜索 temps 目录
-        for work_path in self.temps_dir.iterdir():
-            if work_path.is_dir():
-                work_name = work_path.name
-                if work_filter and work_name != work_filter:
+        return self.index.search(keyword, work_filter, type_filter)
+    
+    def iter_entities(self, keyword: str = '', work_filter: Optional[str] = None, type_filter: Optional[str] = None,
+                      use_index: bool = True) -> Iterator[Any]:
+        """逐个产出匹配的实体
+        
+        产出轻量的 EntityHit，data 在首次访问时才加载。索引可用时直接流式读取索引，
+        否则边遍历目录边产出，不会等待整棵目录树读取完毕。
+        """
+        from .index import EntityHit
+        
+        if use_index and self.index.is_built():
+            yield from self.index.iter_names(keyword, work_filter, type_filter, loader=self._load_hit)
+            return
+        
+        keyword = keyword.lower()
+        for work_name in self.list_works():
+            bare_name = work_name.replace('temps.', '', 1) if work_name.startswith('temps.') else work_name
+            if work_filter and work_filter not in (work_name, bare_name):
+                continue
+            for work, entity_dir, entity_name, location in self.backend.iter_entries(work_name):
+                if type_filter and type_filter != 'all' and type_filter != entity_dir[0]:
                     continue
-                
-                # 搜索不同类型的实体
-                for entity_type in ['novies', 'cores', 'personas', 'tech']:
-                    entity_dir = work_path / entity_type
-                    if entity_dir.exists():
-                        for entity_file in entity_dir.iterdir():
-                            if entity_file.suffix == '.json':
-                                entity_name = entity_file.stem
-                                if keyword.lower() in entity_name.lower() or keyword.lower() in work_name.lower():
-                                    if not type_filter or type_filter == entity_type[0] or type_filter == 'all':
-                                        with open(entity_file, 'r', encoding='utf-8') as f:
-                                            try:
-                                                data = json.load(f)
-                                                results.append({
-                                                    'work': f'temps.{work_name}',
-                                                    'name': entity_name,
-                                                    'type': entity_type[0],
-                                                    'path': str(entity_file),
-                                                    'data': data
-                                                })
-                                            except:
-                                                # 如果JSON解析失败，仍然记录基本信息
-                                                results.append({
-                                                    'work': f'temps.{work_name}',
-                                                    'name': entity_name,
-                                                    'type': entity_type[0],
-                                                    'path': str(entity_file),
-                                                    'data': {}
-                                                })
-        
-        return results
\ No newline at end of file
+                if keyword in entity_name.lower() or keyword in bare_name.lower():
+                    yield EntityHit(work, entity_name, entity_dir[0], location, loader=self._load_hit)
+    
+    def search_content(self, query: str, work_filter: Optional[str] = None,
+                       type_filter: Union[str, Sequence[str], None] = None,
+                       limit: int = 20, offset: int = 0) -> List[Any]:
+        """按实体内容全文检索（BM25 排序，分页，结果数据按需加载）"""
+        if not self.index.is_built():
+            self.rebuild_index()
+        
+        return self.index.search_content(query, work_filter, type_filter, limit, offset, loader=self._load_hit)
+    
+    def _load_hit(self, hit) -> Optional[Dict[str, Any]]:
+        """加载搜索结果对应的完整实体"""
+        # 搜索结果的类型取自目录首字母，novies 目录对应 'n'
+        entity_type = 'novies' if hit.type == 'n' else hit.type
+        return self.load_entity(hit.work, hit.name, entity_type)
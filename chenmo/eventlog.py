@@ -0,0 +1,347 @@
+"""
+事件日志模块
+作品事件的追加式日志：JSON Lines 分段存储，按大小轮转，带单调序号与分段索引
+"""
+import json
+import os
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Iterable, Iterator, Callable, ContextManager
+from .utils import atomic_write
+
+
+# 作品目录下的事件日志目录
+EVENTS_DIR = 'events'
+
+SEGMENT_PREFIX = 'segment_'
+SEGMENT_SUFFIX = '.jsonl'
+INDEX_SUFFIX = '.idx.json'
+
+# 旧版逐事件文件：event_<Unix 秒>_<实体名>.json
+LEGACY_PATTERN = 'event_*.json'
+
+# 每隔多少条记录在分段索引中记录一次偏移量
+SPARSE_INTERVAL = 64
+
+
+class EventLog:
+    """作品事件日志
+
+    事件写入 events/segment_<首序号>.jsonl，每行一条记录。每个分段旁有一个
+    .idx.json 索引，记录序号与时间范围、triggered_by 计数以及稀疏偏移量，
+    读取时据此跳过无关分段，并在分段内直接定位到时间范围的起点。
+
+    每次追加都会立即写入操作系统，fsync 则按条数或时间间隔批量执行。
+    多个进程写同一日志时须传入 lock（返回上下文管理器的可调用对象），
+    追加在锁内进行，并先同步其他进程已写入的记录，保证序号连续不重复。
+    """
+
+    def __init__(self, events_dir: Path, max_segment_bytes: int = 4 * 1024 * 1024,
+                 sync_every: int = 64, sync_interval: float = 1.0,
+                 lock: Optional[Callable[[], ContextManager]] = None):
+        self.events_dir = Path(events_dir)
+        self._lock = lock or nullcontext
+        self.max_segment_bytes = max_segment_bytes
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+
+        self._fd = None
+        self._segment_path = None
+        self._segment_index = None
+        self._last_seq = None
+        self._last_ts = 0.0
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    # ---- 写入 ----
+
+    def append(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """追加一条事件，返回带序号与时间戳的记录"""
+        with self._lock():
+            return self._append(event)
+
+    def append_many(self, events: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """在一次加锁内追加多条事件，结束时统一 fsync"""
+        with self._lock():
+            records = [self._append(event) for event in events]
+            self.flush()
+            return records
+
+    def _append(self, event: Dict[str, Any], ts: Optional[float] = None) -> Dict[str, Any]:
+        self._open_for_append()
+        self._catch_up()
+
+        # 时间戳保持单调不减，保证按时间的二分定位有效
+        ts = max(time.time() if ts is None else ts, self._last_ts)
+        record = {'seq': self._last_seq + 1, 'ts': ts}
+        record.update(event)
+        record['timestamp'] = datetime.fromtimestamp(ts, timezone.utc).isoformat()
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+        if self._segment_index['bytes'] and self._segment_index['bytes'] + len(line) > self.max_segment_bytes:
+            self._rotate(record['seq'])
+
+        offset = self._segment_index['bytes']
+        os.write(self._fd, line)
+        self._last_seq = record['seq']
+        self._last_ts = ts
+        self._record_in_index(self._segment_index, record, offset, len(line))
+
+        self._pending += 1
+        if self._pending >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+            self.flush()
+        return record
+
+    def flush(self):
+        """fsync 当前分段并写出分段索引"""
+        if self._fd is None:
+            return
+        if self._pending:
+            os.fsync(self._fd)
+            self._write_index(self._segment_path, self._segment_index)
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        """刷新并关闭日志"""
+        if self._fd is not None:
+            self.flush()
+            os.close(self._fd)
+            self._fd = None
+
+    def last_seq(self) -> int:
+        """最新事件序号（空日志为 0）"""
+        if self._last_seq is not None:
+            return self._last_seq
+        segments = self._segments()
+        if not segments:
+            return 0
+        index = self._load_index(segments[-1])
+        return index['last_seq']
+
+    # ---- 读取 ----
+
+    def scan(self, since: Optional[float] = None, until: Optional[float] = None,
+             triggered_by: Optional[str] = None, after_seq: int = 0) -> Iterator[Dict[str, Any]]:
+        """按时间范围、触发实体或序号逐条读取事件"""
+        for segment in self._segments():
+            index = self._load_index(segment)
+            if not index['count']:
+                continue
+            if index['last_seq'] <= after_seq:
+                continue
+            if since is not None and index['max_ts'] < since:
+                continue
+            if until is not None and index['min_ts'] > until:
+                # 时间戳单调，后续分段更晚
+                break
+            if triggered_by is not None and triggered_by not in index['triggered_by']:
+                continue
+
+            with open(segment, 'rb') as f:
+                f.seek(self._seek_offset(index, since, after_seq))
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # 尾部未写完的记录
+                        break
+                    record = json.loads(line)
+                    if record['seq'] <= after_seq:
+                        continue
+                    if since is not None and record['ts'] < since:
+                        continue
+                    if until is not None and record['ts'] > until:
+                        return
+                    if triggered_by is not None and record.get('triggered_by') != triggered_by:
+                        continue
+                    yield record
+
+    def records(self) -> Iterator[Dict[str, Any]]:
+        """全部记录；尚未导入的旧版日志（只有 event_*.json）按文件名顺序编号"""
+        if self._segments():
+            yield from self.scan()
+            return
+        for seq, (ts, event) in enumerate(self._legacy_events(), 1):
+            yield dict(event, seq=seq, ts=ts)
+
+    def has_legacy(self) -> bool:
+        """是否存在旧版逐事件文件"""
+        return self.events_dir.exists() and any(self.events_dir.glob(LEGACY_PATTERN))
+
+    def import_legacy(self, remove: bool = True) -> int:
+        """把旧版逐事件文件（event_*.json）按文件名顺序导入日志，时间取自文件名"""
+        with self._lock():
+            legacy_files = sorted(self.events_dir.glob(LEGACY_PATTERN))
+            for ts, event in self._legacy_events(legacy_files):
+                self._append(event, ts)
+            self.flush()
+            if remove:
+                for legacy_file in legacy_files:
+                    legacy_file.unlink()
+            return len(legacy_files)
+
+    def replay(self, source: 'EventLog', origin: str) -> List[Dict[str, Any]]:
+        """把另一日志的记录按原顺序追加到本日志末尾，重新编号
+
+        追加的记录带 merged_from（来源标识与来源序号），再次从同一来源合并时只追加新增的记录。
+        已有记录与快照都不受影响。
+        """
+        with self._lock():
+            merged = 0
+            for record in self.scan():
+                if record.get('merged_from', {}).get('origin') == origin:
+                    merged = max(merged, record['merged_from']['seq'])
+            events = []
+            for record in source.records():
+                if record['seq'] <= merged:
+                    continue
+                event = {key: value for key, value in record.items() if key not in ('seq', 'ts', 'timestamp')}
+                event['merged_from'] = {'origin': origin, 'seq': record['seq']}
+                events.append(event)
+            records = [self._append(event) for event in events]
+            self.flush()
+            return records
+
+    # ---- 内部实现 ----
+
+    def _legacy_events(self, legacy_files: Optional[List[Path]] = None) -> Iterator[tuple]:
+        """逐个产出旧版事件文件的 (时间戳, 事件)"""
+        if legacy_files is None:
+            legacy_files = sorted(self.events_dir.glob(LEGACY_PATTERN)) if self.events_dir.exists() else []
+        for legacy_file in legacy_files:
+            with open(legacy_file, 'r', encoding='utf-8') as f:
+                event = json.load(f)
+            # 旧版的 timestamp 字段是占位符，真实时间在文件名中
+            event.pop('timestamp', None)
+            try:
+                ts = float(legacy_file.stem.split('_')[1])
+            except (IndexError, ValueError):
+                ts = legacy_file.stat().st_mtime
+            yield ts, event
+
+    def _segments(self) -> List[Path]:
+        if not self.events_dir.exists():
+            return []
+        return sorted(self.events_dir.glob(f'{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}'))
+
+    def _open_for_append(self):
+        if self._fd is not None:
+            return
+        self.events_dir.mkdir(parents=True, exist_ok=True)
+        segments = self._segments()
+        if segments:
+            segment = segments[-1]
+            self._unshare(segment)
+            index = self._load_index(segment)
+            # 截掉崩溃时未写完的尾部记录
+            if segment.stat().st_size > index['bytes']:
+                os.truncate(segment, index['bytes'])
+            self._last_seq = index['last_seq']
+            self._last_ts = index['max_ts']
+        else:
+            segment = self.events_dir / f'{SEGMENT_PREFIX}{1:012d}{SEGMENT_SUFFIX}'
+            index = self._empty_index(1)
+            self._last_seq = 0
+        self._segment_path = segment
+        self._segment_index = index
+        self._fd = os.open(segment, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _catch_up(self):
+        """其他进程追加或轮转过分段时，重新打开以读取最新序号"""
+        stat = os.fstat(self._fd)
+        if stat.st_nlink > 1:
+            # 分段被派生作品以硬链接共享（见 objects.py），先断开链接再追加
+            self.close()
+            self._open_for_append()
+            return
+        size = stat.st_size
+        rotated = (self.events_dir / f'{SEGMENT_PREFIX}{self._last_seq + 1:012d}{SEGMENT_SUFFIX}').exists()
+        if size != self._segment_index['bytes'] or (rotated and self._last_seq + 1 != self._segment_index['first_seq']):
+            self.close()
+            self._open_for_append()
+
+    @staticmethod
+    def _unshare(segment: Path):
+        """分段与其他作品共享同一 inode 时复制一份独占副本"""
+        if segment.stat().st_nlink > 1:
+            atomic_write(segment, segment.read_bytes())
+
+    def _rotate(self, first_seq: int):
+        self.flush()
+        self._write_index(self._segment_path, self._segment_index)
+        os.close(self._fd)
+        self._segment_path = self.events_dir / f'{SEGMENT_PREFIX}{first_seq:012d}{SEGMENT_SUFFIX}'
+        self._segment_index = self._empty_index(first_seq)
+        self._fd = os.open(self._segment_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    @staticmethod
+    def _empty_index(first_seq: int) -> Dict[str, Any]:
+        return {
+            'first_seq': first_seq,
+            'last_seq': first_seq - 1,
+            'min_ts': None,
+            'max_ts': 0.0,
+            'count': 0,
+            'bytes': 0,
+            'triggered_by': {},
+            'sparse': [],
+        }
+
+    @staticmethod
+    def _record_in_index(index: Dict[str, Any], record: Dict[str, Any], offset: int, length: int):
+        if index['count'] % SPARSE_INTERVAL == 0:
+            index['sparse'].append([record['seq'], record['ts'], offset])
+        index['last_seq'] = record['seq']
+        if index['min_ts'] is None:
+            index['min_ts'] = record['ts']
+        index['max_ts'] = record['ts']
+        index['count'] += 1
+        index['bytes'] = offset + length
+        source = record.get('triggered_by')
+        if source is not None:
+            index['triggered_by'][source] = index['triggered_by'].get(source, 0) + 1
+
+    def _index_path(self, segment: Path) -> Path:
+        return segment.with_name(segment.name[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX)
+
+    def _write_index(self, segment: Path, index: Dict[str, Any]):
+        # 索引可由分段内容重建，无需 fsync
+        atomic_write(self._index_path(segment), json.dumps(index, ensure_ascii=False), fsync=False)
+
+    def _load_index(self, segment: Path) -> Dict[str, Any]:
+        """读取分段索引，并补齐索引之后追加（尚未 fsync）的记录"""
+        first_seq = int(segment.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+        index_path = self._index_path(segment)
+        index = None
+        if index_path.exists():
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+            except ValueError:
+                index = None
+        if index is None:
+            index = self._empty_index(first_seq)
+
+        size = segment.stat().st_size
+        if size > index['bytes']:
+            with open(segment, 'rb') as f:
+                f.seek(index['bytes'])
+                offset = index['bytes']
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    self._record_in_index(index, json.loads(line), offset, len(line))
+                    offset += len(line)
+        return index
+
+    @staticmethod
+    def _seek_offset(index: Dict[str, Any], since: Optional[float], after_seq: int) -> int:
+        """利用稀疏偏移量跳到第一条可能匹配的记录附近"""
+        offset = 0
+        for seq, ts, sparse_offset in index['sparse']:
+            # 该点之前的记录要么序号已读过，要么早于起始时间，才能跳过
+            if seq > after_seq + 1 and (since is None or ts >= since):
+                break
+            offset = sparse_offset
+        return offset
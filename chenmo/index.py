@@ -0,0 +1,347 @@
+"""
+搜索索引模块
+在 ~/.chenmo/index/ 下维护持久化倒排索引，避免每次搜索都遍历作品目录
+"""
+import json
+import math
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Iterable, Iterator, Callable
+
+
+# 参与搜索的实体目录
+ENTITY_DIRS = ['novies', 'cores', 'personas', 'tech']
+
+# 参与分词的内容字段
+INDEXED_FIELDS = ['description', 'traits', 'axioms', 'constraints', 'fate_variant']
+
+# 分词规则或索引字段变化时递增，旧索引会被自动重建
+INDEX_VERSION = '2'
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_TOKEN_RE = re.compile(f'[{_CJK}]+|[^\\W_{_CJK}]+', re.UNICODE)
+_CJK_RE = re.compile(f'[{_CJK}]')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    work TEXT NOT NULL,
+    work_lc TEXT NOT NULL,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    name_lc TEXT NOT NULL,
+    path TEXT NOT NULL,
+    length INTEGER NOT NULL DEFAULT 0,
+    data TEXT,
+    UNIQUE (work, dir, name)
+);
+CREATE TABLE IF NOT EXISTS postings (
+    token TEXT NOT NULL,
+    doc_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (token, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+"""
+
+
+def tokenize(text: str) -> List[str]:
+    """分词：拉丁文字按词切分（含下划线分隔），中日韩文字按二元组切分"""
+    tokens = []
+    for run in _TOKEN_RE.findall(text):
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run.lower())
+    return tokens
+
+
+def extract_text(data: Dict[str, Any]) -> str:
+    """提取实体中参与索引的文本"""
+    parts = []
+
+    def collect(value):
+        if isinstance(value, str):
+            parts.append(value)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                collect(item)
+
+    if isinstance(data, dict):
+        for field in INDEXED_FIELDS:
+            collect(data.get(field))
+        # world 格式的实体把描述放在 metadata 中
+        metadata = data.get('metadata')
+        if isinstance(metadata, dict):
+            collect(metadata.get('description'))
+
+    return ' '.join(parts)
+
+
+def _bare_work_name(work: str) -> str:
+    """去掉临时作品前缀，与目录名保持一致"""
+    if work.startswith('temps.'):
+        return work.replace('temps.', '', 1)
+    return work
+
+
+class EntityHit:
+    """轻量搜索结果，完整数据在首次访问 data 时才加载"""
+    
+    __slots__ = ('work', 'name', 'type', 'path', 'score', '_loader', '_data')
+    
+    def __init__(self, work: str, name: str, type: str, path: str, score: Optional[float] = None,
+                 loader: Optional[Callable[['EntityHit'], Optional[Dict[str, Any]]]] = None):
+        self.work = work
+        self.name = name
+        self.type = type
+        self.path = path
+        self.score = score
+        self._loader = loader
+        self._data = None
+    
+    @property
+    def data(self) -> Dict[str, Any]:
+        """按需加载实体数据"""
+        if self._data is None:
+            loaded = self._loader(self) if self._loader else None
+            self._data = loaded if loaded is not None else {}
+        return self._data
+    
+    def __getitem__(self, key: str):
+        # 兼容字典形式的访问：item['work']
+        if key not in ('work', 'name', 'type', 'path', 'score', 'data'):
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def to_dict(self, with_data: bool = False) -> Dict[str, Any]:
+        """转换为字典"""
+        result = {'work': self.work, 'name': self.name, 'type': self.type, 'path': self.path}
+        if self.score is not None:
+            result['score'] = self.score
+        if with_data:
+            result['data'] = self.data
+        return result
+    
+    def __repr__(self):
+        return f"EntityHit({self.work}.{self.name}, type={self.type!r}, score={self.score})"
+
+
+class SearchIndex:
+    """持久化倒排索引"""
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = Path(index_dir)
+        self.db_path = self.index_dir / 'index.db'
+        self._local = threading.local()
+        self._conns = []
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """延迟打开索引数据库（sqlite3 连接不能跨线程使用，每个线程各开一个）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            self._conns.append(conn)
+        return conn
+
+    def close(self):
+        """关闭索引数据库"""
+        for conn in self._conns:
+            conn.close()
+        self._conns = []
+        self._local = threading.local()
+
+    def is_built(self) -> bool:
+        """索引是否已按当前版本完成构建"""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'built'").fetchone()
+        return row is not None and row[0] == INDEX_VERSION
+
+    def update_entity(self, work: str, entity_dir: str, name: str, path: str, data: Dict[str, Any]):
+        """增量更新单个实体的索引"""
+        with self.conn:
+            self._write_entity(work, entity_dir, name, path, data)
+
+    def update_entities(self, entries: Iterable[tuple]):
+        """在一个事务中更新多个实体的索引"""
+        with self.conn:
+            for entry in entries:
+                self._write_entity(*entry)
+
+    def remove_work(self, work: str):
+        """从索引中移除整个作品"""
+        with self.conn:
+            self._delete_work(work)
+
+    def index_work(self, work: str, entries: Iterable[tuple]):
+        """重新索引整个作品
+
+        entries 逐个给出 (作品, 目录, 实体名, 位置, 数据)
+        """
+        with self.conn:
+            self._delete_work(work)
+            for entry in entries:
+                self._write_entity(*entry)
+
+    def rebuild(self, entries: Iterable[tuple]):
+        """全量重建索引"""
+        with self.conn:
+            self.conn.execute("DELETE FROM postings")
+            self.conn.execute("DELETE FROM docs")
+            for entry in entries:
+                self._write_entity(*entry)
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built', ?)", (INDEX_VERSION,))
+
+    def search(self, keyword: str, work_filter: Optional[str] = None, type_filter: Optional[str] = None) -> List[Dict[str, Any]]:
+        """按实体名或作品名匹配关键词"""
+        results = []
+        for work, entity_dir, name, path, data in self._query_names(keyword, work_filter, type_filter, with_data=True):
+            try:
+                parsed = json.loads(data) if data is not None else {}
+            except ValueError:
+                parsed = {}
+            results.append({
+                'work': work,
+                'name': name,
+                'type': entity_dir[0],
+                'path': path,
+                'data': parsed
+            })
+        return results
+
+    def iter_names(self, keyword: str, work_filter: Optional[str] = None, type_filter: Optional[str] = None,
+                   loader: Optional[Callable[[EntityHit], Optional[Dict[str, Any]]]] = None) -> Iterator[EntityHit]:
+        """按名称匹配逐条产出轻量结果，不读取实体数据"""
+        for work, entity_dir, name, path in self._query_names(keyword, work_filter, type_filter):
+            yield EntityHit(work, name, entity_dir[0], path, loader=loader)
+    
+    def search_content(self, query: str, work_filter: Optional[str] = None, type_filter: Optional[str] = None,
+                       limit: int = 20, offset: int = 0,
+                       loader: Optional[Callable[[EntityHit], Optional[Dict[str, Any]]]] = None) -> List[EntityHit]:
+        """按实体内容全文检索，使用 BM25 排序并分页返回轻量结果（type_filter 可为多个类型）"""
+        query_tokens = set(tokenize(query))
+        if not query_tokens:
+            return []
+        
+        total_docs, avg_length = self.conn.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+        if not total_docs:
+            return []
+        avg_length = avg_length or 1.0
+        
+        filter_sql = ""
+        filter_params = []
+        if work_filter:
+            filter_sql += " AND (d.work = ? OR d.work = ?)"
+            filter_params += [work_filter, f"temps.{work_filter}"]
+        if type_filter and type_filter != 'all':
+            types = [type_filter] if isinstance(type_filter, str) else list(type_filter)
+            filter_sql += f" AND substr(d.dir, 1, 1) IN ({', '.join('?' * len(types))})"
+            filter_params += types
+        
+        scores = {}
+        for token in query_tokens:
+            df = self.conn.execute("SELECT COUNT(*) FROM postings WHERE token = ?", (token,)).fetchone()[0]
+            if not df:
+                continue
+            idf = math.log((total_docs - df + 0.5) / (df + 0.5) + 1.0)
+            rows = self.conn.execute(
+                "SELECT p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.id = p.doc_id "
+                "WHERE p.token = ?" + filter_sql,
+                [token] + filter_params
+            )
+            for doc_id, tf, length in rows:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[offset:offset + limit]
+        hits = []
+        for doc_id, score in ranked:
+            work, entity_dir, name, path = self.conn.execute(
+                "SELECT work, dir, name, path FROM docs WHERE id = ?", (doc_id,)
+            ).fetchone()
+            hits.append(EntityHit(work, name, entity_dir[0], path, score=round(score, 6), loader=loader))
+        return hits
+    
+    def lookup_token(self, token: str) -> List[Dict[str, Any]]:
+        """查询包含某个词的实体位置"""
+        rows = self.conn.execute(
+            "SELECT d.work, d.dir, d.name, d.path, p.tf FROM postings p JOIN docs d ON d.id = p.doc_id "
+            "WHERE p.token = ? ORDER BY d.work, d.dir, d.name",
+            (token.lower(),)
+        )
+        return [
+            {'work': work, 'name': name, 'type': entity_dir[0], 'path': path, 'tf': tf}
+            for work, entity_dir, name, path, tf in rows
+        ]
+
+    def _query_names(self, keyword: str, work_filter: Optional[str], type_filter: Optional[str],
+                     with_data: bool = False) -> Iterable[tuple]:
+        """名称子串匹配查询"""
+        keyword = keyword.lower()
+        columns = "work, dir, name, path, data" if with_data else "work, dir, name, path"
+        sql = (f"SELECT {columns} FROM docs "
+               "WHERE (instr(name_lc, ?) > 0 OR instr(work_lc, ?) > 0)")
+        params = [keyword, keyword]
+        if work_filter:
+            sql += " AND (work = ? OR work = ?)"
+            params += [work_filter, f"temps.{work_filter}"]
+        if type_filter and type_filter != 'all':
+            sql += " AND substr(dir, 1, 1) = ?"
+            params.append(type_filter)
+        # 与目录遍历保持一致：持久作品在前，临时作品在后
+        sql += " ORDER BY work LIKE 'temps.%', work, dir, name"
+        return self.conn.execute(sql, params)
+
+    def _delete_work(self, work: str):
+        self.conn.execute(
+            "DELETE FROM postings WHERE doc_id IN (SELECT id FROM docs WHERE work = ?)", (work,)
+        )
+        self.conn.execute("DELETE FROM docs WHERE work = ?", (work,))
+
+    def _write_entity(self, work: str, entity_dir: str, name: str, path: str, data: Dict[str, Any]):
+        row = self.conn.execute(
+            "SELECT id FROM docs WHERE work = ? AND dir = ? AND name = ?",
+            (work, entity_dir, name)
+        ).fetchone()
+        if row:
+            self.conn.execute("DELETE FROM postings WHERE doc_id = ?", (row[0],))
+
+        tokens = tokenize(extract_text(data))
+        payload = json.dumps(data, ensure_ascii=False)
+        if row:
+            doc_id = row[0]
+            self.conn.execute(
+                "UPDATE docs SET path = ?, length = ?, data = ? WHERE id = ?",
+                (path, len(tokens), payload, doc_id)
+            )
+        else:
+            cursor = self.conn.execute(
+                "INSERT INTO docs (work, work_lc, dir, name, name_lc, path, length, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (work, _bare_work_name(work).lower(), entity_dir, name, name.lower(), path, len(tokens), payload)
+            )
+            doc_id = cursor.lastrowid
+
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        self.conn.executemany(
+            "INSERT INTO postings (token, doc_id, tf) VALUES (?, ?, ?)",
+            [(token, doc_id, tf) for token, tf in counts.items()]
+        )
@@ -0,0 +1,138 @@
+"""
+LLM 响应缓存模块
+以完整请求的稳定哈希为键，把模型回复持久化在 ~/.chenmo/llm_cache.db 中，
+按 TTL 与总大小淘汰，重复执行相同的生成流程时不再调用模型
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+
+# 默认有效期（秒）与总大小上限（字节）
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+
+def request_key(**request: Any) -> str:
+    """请求的稳定哈希：字段按键排序后序列化为规范 JSON 再取 SHA-256"""
+    canonical = json.dumps(request, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """磁盘响应缓存
+
+    超过 ttl 秒的条目视为过期；写入后总大小超过 max_bytes 时按最近访问时间淘汰最旧的条目。
+    数据库在首次读写时才打开，多个进程可共享同一文件。
+    """
+
+    def __init__(self, path: Optional[Path] = None, ttl: Optional[float] = DEFAULT_TTL,
+                 max_bytes: Optional[int] = DEFAULT_MAX_BYTES):
+        # 缺省位于 ~/.chenmo/llm_cache.db（创建时才解析主目录）
+        self.path = Path(path) if path else Path.home() / '.chenmo' / 'llm_cache.db'
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """延迟打开缓存数据库"""
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # 异步生成会在事件循环线程之外调用，统一由 _lock 串行化
+            self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def close(self):
+        """关闭缓存数据库"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存的回复，不存在或已过期时返回 None"""
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                with self.conn:
+                    self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            with self.conn:
+                self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str):
+        """写入回复，并淘汰过期条目与超出大小上限的最久未访问条目"""
+        now = time.time()
+        size = len(value.encode('utf-8'))
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            if self.ttl is not None:
+                self.evictions += self.conn.execute(
+                    "DELETE FROM responses WHERE created < ?", (now - self.ttl,)
+                ).rowcount
+            if self.max_bytes is not None:
+                self._evict(self.max_bytes)
+
+    def _evict(self, max_bytes: int):
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= max_bytes:
+            return
+        doomed = []
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed, created"):
+            if total <= max_bytes:
+                break
+            doomed.append((key,))
+            total -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self.evictions += len(doomed)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM responses")
+
+    def stats(self) -> Dict[str, Any]:
+        """命中率与缓存占用（命中、未命中与淘汰为本进程内的计数）"""
+        with self._lock:
+            entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': entries,
+                'bytes': size,
+                'max_bytes': self.max_bytes,
+            }
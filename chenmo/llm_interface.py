@@ -4,12 +4,99 @@ LLM 接口模块
 """
 import json
 import os
-from typing import Dict, Any, Optional
+import random
+import time
+from typing import TYPE_CHECKING, Dict, Any, Iterator, List, Optional, Sequence
 from pathlib import Path
 
+# asyncio 只在异步接口中按需导入，不拖慢 CLI 冷启动
+if TYPE_CHECKING:
+    import asyncio
+
+
+# 世界构建模式的系统提示
+WORLD_SYSTEM_PROMPT = """
+            你是一个结构化的虚构世界构建助手。请按照chenmo库的规范生成JSON格式的世界数据。
+            输出必须是有效的JSON，包含以下字段：
+            {
+              "type": "work" | "persona" | "core" | "tech",
+              "name": "实体名",
+              "metadata": {
+                "description": "自然语言描述",
+                "source_prompt": "用户原始提示",
+                "generated_by": "模型名"
+              },
+              "data": {
+                // 结构化字段
+              }
+            }
+            """
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计文本的 token 数（按 UTF-8 字节数 / 4），用于令牌桶限速"""
+    return max(1, len(text.encode('utf-8')) // 4)
+
+
+class TokenBucket:
+    """令牌桶限速器：容量为 capacity，每秒补充 rate 个令牌"""
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = None
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    async def acquire(self, amount: float = 1):
+        """取出 amount 个令牌，不足时等待补充（超过容量的请求按容量计）"""
+        import asyncio
+        
+        # asyncio.Lock 绑定事件循环，每个事件循环各建一个
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock[0] is not loop:
+            self._lock = (loop, asyncio.Lock())
+        amount = min(amount, self.capacity)
+        # 按到达顺序排队，避免大请求被小请求持续插队
+        async with self._lock[1]:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+
+def _is_retryable(error: Exception) -> bool:
+    """限流（429）、服务端错误（5xx）、连接与超时错误可重试"""
+    import asyncio
+    
+    status = getattr(error, 'status_code', None)
+    if isinstance(status, int) and status > 0:
+        return status == 429 or status >= 500
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    name = type(error).__name__
+    return 'Connection' in name or 'Timeout' in name
+
 
 class LLMInterface:
-    """LLM 接口类"""
+    """LLM 接口类
+    
+    除逐条阻塞的 generate() 外，提供 asyncio 接口 agenerate() / generate_many()：
+    以 concurrency 限制同时在途的请求数，以令牌桶按 requests_per_minute 与
+    tokens_per_minute 限速，可重试的错误按带抖动的指数退避重试 max_retries 次。
+    
+    回复缓存在 ~/.chenmo/llm_cache.db 中，以 (type, model, mode, 消息, temperature) 的哈希为键，
+    相同请求不再调用模型；cache=False（或环境变量 CHENMO_LLM_CACHE=0）关闭，各生成方法也可逐次关闭。
+    
+    指定 work（或 retriever）时，每次生成前检索作品中与提示词最相关的 context_k 个内核、人物与科技实体，
+    在 context_tokens 的预算内作为系统消息注入。
+    """
     
     def __init__(self, **kwargs):
         self.type = kwargs.get('type', 'openai')
@@ -17,6 +104,33 @@ class LLMInterface:
         self.apiurl = kwargs.get('apiurl', None)
         self.apikey = kwargs.get('apikey', os.getenv('OPENAI_API_KEY'))
         self.mode = kwargs.get('mode', 'narrative')
+        self.temperature = kwargs.get('temperature', 0.7)
+        
+        # 并发生成的限流与重试设置
+        self.concurrency = kwargs.get('concurrency', 8)
+        self.requests_per_minute = kwargs.get('requests_per_minute', None)
+        self.tokens_per_minute = kwargs.get('tokens_per_minute', None)
+        self.max_retries = kwargs.get('max_retries', 5)
+        self.backoff_base = kwargs.get('backoff_base', 0.5)
+        self.backoff_max = kwargs.get('backoff_max', 30.0)
+        self._request_bucket = TokenBucket(self.requests_per_minute / 60) if self.requests_per_minute else None
+        self._token_bucket = TokenBucket(self.tokens_per_minute / 60) if self.tokens_per_minute else None
+        self._async_client = None
+        
+        # 响应缓存：cache 可为 True/False 或 ResponseCache 实例，数据库在首次使用时打开
+        cache = kwargs.get('cache', os.getenv('CHENMO_LLM_CACHE', '1') not in ('0', 'false', 'no'))
+        if cache is True:
+            from .llm_cache import ResponseCache, DEFAULT_TTL, DEFAULT_MAX_BYTES
+            cache = ResponseCache(kwargs.get('cache_path', None),
+                                  ttl=kwargs.get('cache_ttl', DEFAULT_TTL),
+                                  max_bytes=kwargs.get('cache_max_bytes', DEFAULT_MAX_BYTES))
+        self.cache = cache or None
+        
+        # 作品上下文检索：retriever 为 ContextRetriever 实例；只给 work 时在首次生成时绑定全局引擎
+        self.work = kwargs.get('work', None)
+        self.context_k = kwargs.get('context_k', 5)
+        self.context_tokens = kwargs.get('context_tokens', 1024)
+        self.retriever = kwargs.get('retriever', None)
         
         # 根据类型初始化相应的客户端
         if self.type == 'openai':
@@ -28,124 +142,245 @@ class LLMInterface:
         elif self.type == 'ollama':
             try:
                 import ollama
-                self.client = ollama
+                self.client = ollama.Client(host=self.apiurl) if self.apiurl else ollama
             except ImportError:
                 raise ImportError("Please install ollama: pip install ollama")
         else:
             # 自定义类型，需要用户提供客户端
             self.client = None
     
-    def generate(self, prompt: str) -> str:
-        """生成内容"""
+    def generate(self, prompt: str, cache: bool = True) -> str:
+        """生成内容（cache=False 时跳过响应缓存）"""
         if self.type == 'openai':
-            return self._generate_openai(prompt)
+            generate = self._generate_openai
         elif self.type == 'ollama':
-            return self._generate_ollama(prompt)
+            generate = self._generate_ollama
         else:
             raise ValueError(f"Unsupported LLM type: {self.type}")
+        
+        messages = self._messages(prompt)
+        key = self._cache_key(messages) if cache else None
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        content = generate(messages)
+        self._cache_put(key, content)
+        return content
     
-    def _generate_openai(self, prompt: str) -> str:
-        """使用OpenAI生成内容"""
+    def stream(self, prompt: str, cache: bool = True) -> Iterator[str]:
+        """流式生成：逐块产出增量文本
+        
+        world 模式下增量解析 JSON，校验错误在生成途中即抛出；完整回复结束后写入响应缓存，
+        命中缓存时一次产出全部内容。
+        """
+        if self.type == 'openai':
+            deltas = self._stream_openai
+        elif self.type == 'ollama':
+            deltas = self._stream_ollama
+        else:
+            raise ValueError(f"Unsupported LLM type: {self.type}")
+        return self._stream(self._messages(prompt), deltas, cache)
+    
+    def _stream(self, messages: List[Dict[str, str]], deltas, cache: bool) -> Iterator[str]:
+        key = self._cache_key(messages) if cache else None
+        cached = self._cache_get(key)
+        if cached is not None:
+            yield cached
+            return
+        
+        from .utils import WorldStreamParser
+        parser = WorldStreamParser() if self.mode == 'world' else None
+        parts = []
+        for delta in deltas(messages):
+            if not delta:
+                continue
+            if parser is not None:
+                parser.feed(delta)
+            parts.append(delta)
+            yield delta
+        if parser is not None:
+            parser.close()
+        self._cache_put(key, self._postprocess(''.join(parts)))
+    
+    def _stream_openai(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        response = self.client.chat.completions.create(
+            model=self.model, messages=messages, temperature=self.temperature, stream=True
+        )
+        try:
+            for chunk in response:
+                if chunk.choices:
+                    yield chunk.choices[0].delta.content
+        finally:
+            response.close()
+    
+    def _stream_ollama(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        response = self.client.chat(model=self.model, messages=messages, stream=True)
+        try:
+            for part in response:
+                yield part['message']['content']
+        finally:
+            response.close()
+    
+    # ---- 响应缓存 ----
+    
+    def _cache_key(self, messages: List[Dict[str, str]]) -> Optional[str]:
+        """完整请求（含系统提示与注入的上下文）的稳定哈希（未启用缓存时为 None）"""
+        if self.cache is None:
+            return None
+        from .llm_cache import request_key
+        return request_key(type=self.type, model=self.model, mode=self.mode,
+                           messages=messages, temperature=self.temperature)
+    
+    def _cache_get(self, key: Optional[str]) -> Optional[str]:
+        return self.cache.get(key) if key is not None else None
+    
+    def _cache_put(self, key: Optional[str], content: Optional[str]):
+        if key is not None and isinstance(content, str):
+            self.cache.put(key, content)
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """响应缓存的命中率与占用（未启用缓存时为空字典）"""
+        return self.cache.stats() if self.cache is not None else {}
+    
+    def _messages(self, prompt: str) -> List[Dict[str, str]]:
+        """按生成模式组装对话消息（启用检索时在用户消息前注入作品上下文）"""
         if self.mode == 'narrative':
             # 叙事模式：生成自然语言文本
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7
-            )
-            return response.choices[0].message.content
+            messages = [{"role": "user", "content": prompt}]
         elif self.mode == 'world':
             # 世界构建模式：生成符合chenmo规范的JSON
-            system_prompt = """
-            你是一个结构化的虚构世界构建助手。请按照chenmo库的规范生成JSON格式的世界数据。
-            输出必须是有效的JSON，包含以下字段：
-            {
-              "type": "work" | "persona" | "core" | "tech",
-              "name": "实体名",
-              "metadata": {
-                "description": "自然语言描述",
-                "source_prompt": "用户原始提示",
-                "generated_by": "模型名"
-              },
-              "data": {
-                // 结构化字段
-              }
-            }
-            """
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7
-            )
-            content = response.choices[0].message.content
-            
-            # 尝试解析为JSON
-            try:
-                # 移除可能的markdown包装
-                if content.startswith('```json'):
-                    content = content[7:content.rfind('```')]
-                elif content.startswith('```'):
-                    content = content[3:content.rfind('```')]
-                
-                json.loads(content)  # 验证是否为有效JSON
-                return content
-            except json.JSONDecodeError:
-                # 如果不是有效JSON，尝试修复
-                return self._fix_json_output(content)
+            messages = [
+                {"role": "system", "content": WORLD_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ]
         else:
             raise ValueError(f"Unsupported mode: {self.mode}")
+        
+        context = self._context(prompt)
+        if context:
+            messages.insert(len(messages) - 1, {"role": "system", "content": context})
+        return messages
+    
+    def _context(self, prompt: str) -> str:
+        """与提示词相关的作品实体上下文（未启用检索时为空字符串）"""
+        if self.retriever is None:
+            if self.work is None:
+                return ''
+            from . import engine
+            from .retrieval import ContextRetriever
+            self.retriever = ContextRetriever(engine, self.work, self.context_k, self.context_tokens)
+        return self.retriever.context(prompt)
+    
+    def _postprocess(self, content: str) -> str:
+        """世界构建模式下清理并校验 JSON 输出"""
+        if self.mode != 'world':
+            return content
+        
+        # 尝试解析为JSON
+        try:
+            # 移除可能的markdown包装
+            if content.startswith('```json'):
+                content = content[7:content.rfind('```')]
+            elif content.startswith('```'):
+                content = content[3:content.rfind('```')]
+            
+            json.loads(content)  # 验证是否为有效JSON
+            return content
+        except json.JSONDecodeError:
+            # 如果不是有效JSON，尝试修复
+            return self._fix_json_output(content)
+    
+    def _generate_openai(self, messages: List[Dict[str, str]]) -> str:
+        """使用OpenAI生成内容"""
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature
+        )
+        return self._postprocess(response.choices[0].message.content)
     
-    def _generate_ollama(self, prompt: str) -> str:
+    def _generate_ollama(self, messages: List[Dict[str, str]]) -> str:
         """使用Ollama生成内容"""
-        if self.mode == 'narrative':
-            # 叙事模式：生成自然语言文本
-            response = self.client.chat(model=self.model, messages=[{"role": "user", "content": prompt}])
-            return response['message']['content']
-        elif self.mode == 'world':
-            # 世界构建模式：生成符合chenmo规范的JSON
-            system_prompt = """
-            你是一个结构化的虚构世界构建助手。请按照chenmo库的规范生成JSON格式的世界数据。
-            输出必须是有效的JSON，包含以下字段：
-            {
-              "type": "work" | "persona" | "core" | "tech",
-              "name": "实体名",
-              "metadata": {
-                "description": "自然语言描述",
-                "source_prompt": "用户原始提示",
-                "generated_by": "模型名"
-              },
-              "data": {
-                // 结构化字段
-              }
-            }
-            """
-            response = self.client.chat(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ]
+        response = self.client.chat(model=self.model, messages=messages)
+        return self._postprocess(response['message']['content'])
+    
+    # ---- 异步并发生成 ----
+    
+    def _get_async_client(self):
+        import asyncio
+        
+        # 异步客户端绑定创建时的事件循环，每个事件循环各建一个
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client[0] is not loop:
+            if self.type == 'openai':
+                from openai import AsyncOpenAI
+                # 重试由 agenerate 统一处理
+                client = AsyncOpenAI(api_key=self.apikey, base_url=self.apiurl, max_retries=0)
+            elif self.type == 'ollama':
+                import ollama
+                client = ollama.AsyncClient(host=self.apiurl)
+            else:
+                raise ValueError(f"Unsupported LLM type: {self.type}")
+            self._async_client = (loop, client)
+        return self._async_client[1]
+    
+    async def _arequest(self, messages: List[Dict[str, str]]) -> str:
+        client = self._get_async_client()
+        if self.type == 'openai':
+            response = await client.chat.completions.create(
+                model=self.model, messages=messages, temperature=self.temperature
             )
-            content = response['message']['content']
-            
-            # 尝试解析为JSON
+            return response.choices[0].message.content
+        response = await client.chat(model=self.model, messages=messages)
+        return response['message']['content']
+    
+    async def agenerate(self, prompt: str, semaphore: Optional['asyncio.Semaphore'] = None,
+                        cache: bool = True) -> str:
+        """异步生成内容（限速、可重试错误按带抖动的指数退避重试；命中缓存时不占用限速配额）"""
+        import asyncio
+        
+        messages = self._messages(prompt)
+        key = self._cache_key(messages) if cache else None
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        tokens = estimate_tokens(''.join(message['content'] for message in messages))
+        for attempt in range(self.max_retries + 1):
+            if self._request_bucket is not None:
+                await self._request_bucket.acquire()
+            if self._token_bucket is not None:
+                await self._token_bucket.acquire(tokens)
             try:
-                # 移除可能的markdown包装
-                if content.startswith('```json'):
-                    content = content[7:content.rfind('```')]
-                elif content.startswith('```'):
-                    content = content[3:content.rfind('```')]
-                
-                json.loads(content)  # 验证是否为有效JSON
-                return content
-            except json.JSONDecodeError:
-                # 如果不是有效JSON，尝试修复
-                return self._fix_json_output(content)
-        else:
-            raise ValueError(f"Unsupported mode: {self.mode}")
+                if semaphore is not None:
+                    async with semaphore:
+                        content = await self._arequest(messages)
+                else:
+                    content = await self._arequest(messages)
+            except Exception as e:
+                if attempt == self.max_retries or not _is_retryable(e):
+                    raise
+                # 完全抖动：在 [0, min(上限, 基数 * 2^attempt)] 内随机等待
+                await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+                continue
+            content = self._postprocess(content)
+            self._cache_put(key, content)
+            return content
+    
+    async def agenerate_many(self, prompts: Sequence[str], concurrency: Optional[int] = None,
+                             return_exceptions: bool = False, cache: bool = True) -> List[Any]:
+        """并发生成一批内容，结果按输入顺序返回"""
+        import asyncio
+        
+        semaphore = asyncio.Semaphore(concurrency or self.concurrency)
+        return await asyncio.gather(*(self.agenerate(prompt, semaphore, cache) for prompt in prompts),
+                                    return_exceptions=return_exceptions)
+    
+    def generate_many(self, prompts: Sequence[str], concurrency: Optional[int] = None,
+                      return_exceptions: bool = False, cache: bool = True) -> List[Any]:
+        """agenerate_many 的同步入口"""
+        import asyncio
+        
+        return asyncio.run(self.agenerate_many(prompts, concurrency, return_exceptions, cache))
     
     def _fix_json_output(self, content: str) -> str:
         """尝试修复JSON输出"""
@@ -168,4 +403,4 @@ class LLMInterface:
 
 def create_llm(**kwargs):
     """创建LLM接口实例的便捷函数"""
-    return LLMInterface(**kwargs)
\ No newline at end of file
+    return LLMInterface(**kwargs)
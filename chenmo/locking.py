@@ -0,0 +1,80 @@
+"""
+锁模块
+按作品划分的进程间写锁
+"""
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List
+
+try:
+    import fcntl
+except ImportError:  # 非 POSIX 平台仅提供进程内互斥
+    fcntl = None
+
+
+class WorkLocks:
+    """按作品划分的咨询锁
+
+    每个作品对应 ~/.chenmo/locks/<作品名>.lock，使用 fcntl.flock 在进程间互斥；
+    同一线程内可重入，多个作品按名称排序加锁以避免死锁。读取不加锁
+    （写入均为原子替换）。
+    """
+
+    def __init__(self, lock_dir: Path):
+        self.lock_dir = Path(lock_dir)
+        self._local = threading.local()
+        self._thread_locks = {}
+        self._thread_locks_guard = threading.Lock()
+
+    @contextmanager
+    def lock(self, *work_names: str):
+        """独占锁定一个或多个作品"""
+        held = self._held()
+        acquired = []
+        try:
+            for work_name in sorted(set(work_names)):
+                if work_name in held:
+                    held[work_name][1] += 1
+                else:
+                    held[work_name] = [self._acquire(work_name), 1]
+                acquired.append(work_name)
+            yield
+        finally:
+            for work_name in reversed(acquired):
+                entry = held[work_name]
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del held[work_name]
+                    self._release(work_name, entry[0])
+
+    def _held(self) -> Dict[str, List]:
+        if not hasattr(self._local, 'held'):
+            self._local.held = {}
+        return self._local.held
+
+    def _thread_lock(self, work_name: str) -> threading.Lock:
+        with self._thread_locks_guard:
+            return self._thread_locks.setdefault(work_name, threading.Lock())
+
+    def _acquire(self, work_name: str):
+        # 进程内先用线程锁互斥，再用 flock 在进程间互斥
+        thread_lock = self._thread_lock(work_name)
+        thread_lock.acquire()
+        if fcntl is None:
+            return None
+        try:
+            self.lock_dir.mkdir(parents=True, exist_ok=True)
+            fd = os.open(str(self.lock_dir / f"{work_name}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except BaseException:
+            thread_lock.release()
+            raise
+        return fd
+
+    def _release(self, work_name: str, fd):
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        self._thread_lock(work_name).release()
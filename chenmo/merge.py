@@ -0,0 +1,286 @@
+"""
+合并模块
+基于内容哈希的增量目录合并：先一次性生成合并计划（文件级与 JSON 键级冲突、预计写入量），
+再整体应用或完全不应用；复制在线程池中并行执行
+"""
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, Optional, Callable
+from .objects import ObjectStore, MANIFEST_NAME, copy_writable, hash_file, iter_work_files
+from .utils import atomic_write
+
+
+MERGE_STRATEGIES = ('overlay', 'patch', 'strict', 'interactive')
+
+# interactive 策略下 resolve 回调可返回的处理方式
+RESOLUTIONS = ('theirs', 'ours', 'patch')
+
+
+def merge_json(base: Any, update: Any) -> Any:
+    """按字段递归合并 JSON：字典逐键合并，其余类型以 update 为准"""
+    if isinstance(base, dict) and isinstance(update, dict):
+        result = dict(base)
+        for key, value in update.items():
+            result[key] = merge_json(base[key], value) if key in base else value
+        return result
+    return update
+
+
+def conflicting_keys(base: Any, update: Any, prefix: str = '') -> List[str]:
+    """两侧都存在且取值不同的 JSON 键路径（嵌套键以 . 连接）"""
+    if not (isinstance(base, dict) and isinstance(update, dict)):
+        return [prefix] if base != update else []
+    keys = []
+    for key, value in update.items():
+        if key in base:
+            keys.extend(conflicting_keys(base[key], value, f"{prefix}.{key}" if prefix else key))
+    return keys
+
+
+def _dumps(data: Any) -> bytes:
+    return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def _load_json(path: Path) -> Any:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+
+class MergePlan:
+    """合并计划
+
+    entries 中每一项对应一个文件：path（相对路径）、action（added/modified/unchanged）、
+    conflict（目标中存在内容不同的同名文件）、keys（JSON 键级冲突）、bytes（将写入的字节数）。
+    计划同时记下目标文件在规划时的状态，应用时据此拒绝已过期的计划。
+    """
+
+    def __init__(self, src: Path, dst: Path, strategy: str):
+        self.src = Path(src)
+        self.dst = Path(dst)
+        self.strategy = strategy
+        self.entries = []
+        self.dirs = []
+
+    @property
+    def conflicts(self) -> List[Dict[str, Any]]:
+        """文件级冲突"""
+        return [entry for entry in self.entries if entry['conflict']]
+
+    @property
+    def bytes_to_write(self) -> int:
+        """预计写入的字节数"""
+        return sum(entry['bytes'] for entry in self.entries)
+
+    def summary(self) -> Dict[str, List[str]]:
+        """added/modified/unchanged/conflicted 相对路径列表"""
+        summary = {'added': [], 'modified': [], 'unchanged': [], 'conflicted': []}
+        for entry in self.entries:
+            summary['conflicted' if entry['conflict'] else entry['action']].append(entry['path'])
+        return summary
+
+    def to_dict(self) -> Dict[str, Any]:
+        """可序列化的计划（不含待写入的内容）"""
+        return {
+            'src': str(self.src),
+            'dst': str(self.dst),
+            'strategy': self.strategy,
+            'bytes_to_write': self.bytes_to_write,
+            'entries': [
+                {key: entry[key] for key in ('path', 'action', 'conflict', 'keys', 'bytes')}
+                for entry in self.entries
+            ],
+        }
+
+    def describe(self) -> str:
+        """便于阅读的计划摘要"""
+        summary = self.summary()
+        lines = [
+            f"Merge plan {self.src} -> {self.dst} ({self.strategy}): "
+            + ", ".join(f"{len(summary[key])} {key}" for key in ('added', 'modified', 'unchanged', 'conflicted'))
+            + f", {self.bytes_to_write} bytes to write"
+        ]
+        for entry in self.entries:
+            if entry['action'] == 'unchanged':
+                continue
+            marker = '!' if entry['conflict'] else ('+' if entry['action'] == 'added' else '~')
+            keys = f" [keys: {', '.join(entry['keys'])}]" if entry['keys'] else ''
+            lines.append(f"  {marker} {entry['path']} ({entry['bytes']} bytes){keys}")
+        return '\n'.join(lines)
+
+
+class DirectoryMerger:
+    """增量目录合并
+
+    规划时逐个比较文件：大小不同即视为修改；大小与 mtime 都相同视为未变；否则比较内容哈希
+    （目标作品 objects.json 中记录且登记后未被改动的文件直接使用已知哈希）。
+    应用时先把全部新内容写成目标旁的临时文件，全部成功后再逐个替换；
+    任一文件写入失败则删除临时文件，目标保持原样。
+    """
+
+    def __init__(self, objects: Optional[ObjectStore] = None, workers: Optional[int] = None,
+                 exclude: Iterable[str] = ()):
+        self.objects = objects
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        # 不参与文件级合并的顶层目录（如由事件日志自行合并的 events/）
+        self.exclude = set(exclude)
+
+    def merge(self, src: Path, dst: Path, strategy: str = 'overlay',
+              resolve: Optional[Callable[[Dict[str, Any]], str]] = None) -> Dict[str, List[str]]:
+        """规划并应用合并，返回 added/modified/unchanged/conflicted 相对路径列表"""
+        return self.apply(self.plan(src, dst, strategy), resolve)
+
+    def plan(self, src: Path, dst: Path, strategy: str = 'overlay') -> MergePlan:
+        """一次遍历生成合并计划，不写入任何文件"""
+        if strategy not in MERGE_STRATEGIES:
+            raise ValueError(f"Unknown merge strategy: {strategy}")
+        plan = MergePlan(src, dst, strategy)
+        known = self._known_digests(plan.dst)
+
+        for dirpath, dirnames, _ in os.walk(plan.src):
+            dirnames[:] = sorted(name for name in dirnames if not name.startswith('.')
+                                 and not (dirpath == str(plan.src) and name in self.exclude))
+            plan.dirs.extend(Path(dirpath, name).relative_to(plan.src).as_posix() for name in dirnames)
+
+        pairs = [(rel, path) for rel, path in iter_work_files(plan.src) if rel.split('/', 1)[0] not in self.exclude]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            plan.entries = list(executor.map(lambda pair: self._plan_entry(plan, pair[0], pair[1], known), pairs))
+        return plan
+
+    def apply(self, plan: MergePlan, resolve: Optional[Callable[[Dict[str, Any]], str]] = None) -> Dict[str, List[str]]:
+        """整体应用合并计划：要么全部写入，要么一个文件也不写
+
+        strict 策略存在冲突时抛出 ValueError；interactive 策略对每个冲突调用
+        resolve(entry)，返回 theirs（采用来源）、ours（保留目标）或 patch（逐字段合并），
+        未提供 resolve 时采用来源。目标文件在规划之后被修改过时抛出 ValueError。
+        """
+        if plan.strategy == 'strict' and plan.conflicts:
+            raise ValueError(f"File conflict: {', '.join(entry['path'] for entry in plan.conflicts)}")
+
+        writes = []
+        for entry in plan.entries:
+            if entry['action'] == 'unchanged':
+                continue
+            if entry['conflict'] and plan.strategy == 'interactive':
+                resolution = resolve(entry) if resolve else 'theirs'
+                if resolution not in RESOLUTIONS:
+                    raise ValueError(f"Unknown resolution for {entry['path']}: {resolution}")
+                if resolution == 'ours':
+                    continue
+                if resolution == 'patch':
+                    entry = dict(entry, content=self._patched(plan, entry['path']))
+            writes.append(entry)
+
+        for entry in writes:
+            self._check_fresh(plan, entry)
+
+        for rel in plan.dirs:
+            (plan.dst / rel).mkdir(parents=True, exist_ok=True)
+
+        # 第一阶段：并行写出全部临时文件
+        for entry in writes:
+            target = plan.dst / entry['path']
+            entry['temp'] = target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(lambda entry: self._stage(plan, entry), writes))
+        except BaseException:
+            for entry in writes:
+                if entry['temp'].exists():
+                    entry['temp'].unlink()
+            raise
+
+        # 第二阶段：逐个替换到位
+        for entry in writes:
+            os.replace(entry.pop('temp'), plan.dst / entry['path'])
+        return plan.summary()
+
+    def _known_digests(self, work_path: Path) -> Dict[str, Any]:
+        """目标作品 objects.json 的清单（记录的哈希与登记时的文件状态）"""
+        if self.objects is None or not (work_path / MANIFEST_NAME).exists():
+            return {}
+        return self.objects.load_manifest(work_path)
+
+    def _digest(self, rel: str, path: Path, known: Dict[str, Any]) -> str:
+        digest = known.get('objects', {}).get(rel)
+        if digest is not None and self.objects.is_current(path, known.get('stamps', {}).get(rel)):
+            return digest
+        return hash_file(path)[0]
+
+    def _plan_entry(self, plan: MergePlan, rel: str, src_file: Path, known: Dict[str, Any]) -> Dict[str, Any]:
+        dst_file = plan.dst / rel
+        src_stat = src_file.stat()
+        entry = {'path': rel, 'action': 'modified', 'conflict': False, 'keys': [],
+                 'bytes': src_stat.st_size, 'content': None, 'dst_stat': None}
+        try:
+            dst_stat = dst_file.stat()
+        except FileNotFoundError:
+            entry['action'] = 'added'
+            return entry
+        entry['dst_stat'] = (dst_stat.st_ino, dst_stat.st_size, dst_stat.st_mtime_ns)
+
+        if src_stat.st_size == dst_stat.st_size and (
+            src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+            or hash_file(src_file)[0] == self._digest(rel, dst_file, known)
+        ):
+            entry.update(action='unchanged', bytes=0)
+            return entry
+
+        if rel.endswith('.json'):
+            base, update = _load_json(dst_file), _load_json(src_file)
+            if base is not None and update is not None:
+                entry['keys'] = conflicting_keys(base, update)
+                if plan.strategy == 'patch':
+                    merged = merge_json(base, update)
+                    if merged == base:
+                        entry.update(action='unchanged', bytes=0, keys=[])
+                        return entry
+                    entry['content'] = _dumps(merged)
+                    entry['bytes'] = len(entry['content'])
+        entry['conflict'] = plan.strategy in ('strict', 'interactive')
+        return entry
+
+    @staticmethod
+    def _patched(plan: MergePlan, rel: str) -> bytes:
+        base, update = _load_json(plan.dst / rel), _load_json(plan.src / rel)
+        if base is None or update is None:
+            raise ValueError(f"Cannot patch non-JSON file: {rel}")
+        return _dumps(merge_json(base, update))
+
+    @staticmethod
+    def _check_fresh(plan: MergePlan, entry: Dict[str, Any]):
+        try:
+            stat = (plan.dst / entry['path']).stat()
+            current = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            current = None
+        if current != entry['dst_stat']:
+            raise ValueError(f"Merge plan is stale: {entry['path']} changed since planning")
+
+    @staticmethod
+    def _stage(plan: MergePlan, entry: Dict[str, Any]):
+        # 写临时文件而不是直接改写目标：目标可能与其他作品共享同一对象
+        if entry['content'] is not None:
+            atomic_write(entry['temp'], entry['content'], fsync=False)
+        else:
+            copy_writable(plan.src / entry['path'], entry['temp'])
+
+
+def plan_merge(src: Path, dst: Path, strategy: str = 'overlay',
+               objects: Optional[ObjectStore] = None, workers: Optional[int] = None,
+               exclude: Iterable[str] = ()) -> MergePlan:
+    """生成合并计划（DirectoryMerger.plan 的便捷入口）"""
+    return DirectoryMerger(objects, workers, exclude).plan(src, dst, strategy)
+
+
+def merge_directories(src: Path, dst: Path, strategy: str = 'overlay',
+                      objects: Optional[ObjectStore] = None, workers: Optional[int] = None,
+                      resolve: Optional[Callable[[Dict[str, Any]], str]] = None,
+                      exclude: Iterable[str] = ()) -> Dict[str, List[str]]:
+    """增量合并两个目录（DirectoryMerger 的便捷入口）"""
+    return DirectoryMerger(objects, workers, exclude).merge(src, dst, strategy, resolve)
@@ -0,0 +1,185 @@
+"""
+混合模块
+把多个源实体展开为按字段排列的列，按权重向量化融合（可用时使用 NumPy）
+"""
+import json
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # 无 NumPy 时使用纯 Python 实现
+    np = None
+
+
+# 字段融合策略：mean（数值加权平均）、union（列表按权重频次合并）、vote（按权重投票）
+MIX_STRATEGIES = ('mean', 'union', 'vote')
+
+# 源中缺少该字段
+_MISSING = object()
+
+
+def flatten(data: Dict[str, Any], prefix: Tuple[str, ...] = ()) -> Dict[Tuple[str, ...], Any]:
+    """把嵌套字典展开为 字段路径 -> 叶子值（列表与标量均为叶子）"""
+    flat = {}
+    for key, value in data.items():
+        path = prefix + (key,)
+        if isinstance(value, dict) and value:
+            flat.update(flatten(value, path))
+        else:
+            flat[path] = value
+    return flat
+
+
+def unflatten(flat: Dict[Tuple[str, ...], Any]) -> Dict[str, Any]:
+    """flatten 的逆操作；同一路径在不同源中既是字典又是叶子时，先写入者优先"""
+    result = {}
+    for path, value in flat.items():
+        node = result
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+            if not isinstance(node, dict):
+                break
+        else:
+            if path[-1] not in node:
+                node[path[-1]] = value
+    return result
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _key(value: Any) -> str:
+    # 列表元素与投票候选可能不可哈希（字典、列表），统一以规范化 JSON 作为键
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+def _matmul(left: Sequence[Sequence[float]], right: Sequence[Sequence[float]]):
+    """矩阵乘法：有 NumPy 时向量化计算，否则逐元素累加"""
+    if np is not None:
+        return np.asarray(left, dtype=float) @ np.asarray(right, dtype=float)
+    columns = list(zip(*right)) if right else []
+    return [[sum(a * b for a, b in zip(row, column)) for column in columns] for row in left]
+
+
+class SourceColumns:
+    """按字段排列的源实体
+
+    M 个源展开为：数值字段矩阵（字段 × 源）与存在掩码；列表字段与其他字段的
+    “候选值 × 源”关联矩阵（按字段首尾拼接）。给定 N × M 权重矩阵，
+    所有字段的融合都归结为几次矩阵乘法，源只需展开一次即可生成任意多组混合。
+    """
+
+    def __init__(self, sources: Sequence[Optional[Dict[str, Any]]], strategies: Optional[Dict[str, str]] = None):
+        strategies = strategies or {}
+        flats = [flatten(source) if source else {} for source in sources]
+        self.count = len(flats)
+
+        paths = list(dict.fromkeys(path for flat in flats for path in flat))
+        self.paths = paths
+        self.numeric = []     # [(路径序号)]
+        self.segments = []    # [(路径序号, 策略, 起始列, 候选值列表)]
+        numeric_rows = []
+        mask_rows = []
+        incidence_columns = []
+        presence_rows = []
+
+        for path_index, path in enumerate(paths):
+            column = [flat.get(path, _MISSING) for flat in flats]
+            present = [value is not _MISSING for value in column]
+            presence_rows.append([1.0 if flag else 0.0 for flag in present])
+            values = [value for value in column if value is not _MISSING]
+
+            strategy = strategies.get('.'.join(path))
+            if strategy is None:
+                if all(_is_number(value) for value in values):
+                    strategy = 'mean'
+                elif all(isinstance(value, list) for value in values):
+                    strategy = 'union'
+                else:
+                    strategy = 'vote'
+            if strategy not in MIX_STRATEGIES:
+                raise ValueError(f"Unknown mix strategy for {'.'.join(path)}: {strategy}")
+
+            if strategy == 'mean':
+                if not all(_is_number(value) for value in values):
+                    raise ValueError(f"Field {'.'.join(path)} is not numeric in every source")
+                self.numeric.append(path_index)
+                numeric_rows.append([float(value) if flag else 0.0 for value, flag in zip(column, present)])
+                mask_rows.append(presence_rows[-1])
+                continue
+
+            # 候选值：union 为各源列表中的元素，vote 为各源的整个取值
+            candidates = {}
+            for source_index, value in enumerate(column):
+                if value is _MISSING:
+                    continue
+                items = (value if isinstance(value, list) else [value]) if strategy == 'union' else [value]
+                for item in items:
+                    entry = candidates.setdefault(_key(item), [item, set()])
+                    entry[1].add(source_index)
+            self.segments.append((path_index, strategy, len(incidence_columns), [entry[0] for entry in candidates.values()]))
+            for _, holders in candidates.values():
+                incidence_columns.append([1.0 if index in holders else 0.0 for index in range(self.count)])
+
+        # 转置为 源 × 列，便于与 N × M 权重矩阵相乘
+        self._numeric = [list(row) for row in zip(*numeric_rows)] if numeric_rows else []
+        self._mask = [list(row) for row in zip(*mask_rows)] if mask_rows else []
+        self._incidence = [list(row) for row in zip(*incidence_columns)] if incidence_columns else []
+        self._presence = [list(row) for row in zip(*presence_rows)] if presence_rows else []
+
+    def blend(self, weights: Sequence[float]) -> Dict[str, Any]:
+        """按一组权重融合"""
+        return self.blend_many([weights])[0]
+
+    def blend_many(self, weight_matrix: Sequence[Sequence[float]]) -> List[Dict[str, Any]]:
+        """按 N × M 权重矩阵一次性生成 N 个融合结果"""
+        weight_matrix = [list(map(float, row)) for row in weight_matrix]
+        for row in weight_matrix:
+            if len(row) != self.count:
+                raise ValueError("Number of sources must match number of weights")
+            if any(weight < 0 for weight in row) or sum(row) <= 0:
+                raise ValueError("Weights must be non-negative and not all zero")
+        if not self.paths:
+            return [{} for _ in weight_matrix]
+
+        presence = _matmul(weight_matrix, self._presence)
+        if self.numeric:
+            sums = _matmul(weight_matrix, self._numeric)
+            totals = _matmul(weight_matrix, self._mask)
+        if self.segments:
+            scores = _matmul(weight_matrix, self._incidence)
+
+        results = []
+        for row in range(len(weight_matrix)):
+            flat = {}
+            for column, path_index in enumerate(self.numeric):
+                if totals[row][column] > 0:
+                    flat[self.paths[path_index]] = float(sums[row][column] / totals[row][column])
+            for path_index, strategy, start, candidates in self.segments:
+                # 该行中持有此字段的源权重全为 0 时不输出此字段
+                if presence[row][path_index] <= 0:
+                    continue
+                segment = [float(score) for score in scores[row][start:start + len(candidates)]]
+                if strategy == 'union':
+                    # 按累计权重从高到低排列，权重相同保持首次出现的顺序
+                    order = sorted((index for index, score in enumerate(segment) if score > 0),
+                                   key=lambda index: -segment[index])
+                    flat[self.paths[path_index]] = [candidates[index] for index in order]
+                else:
+                    best = max(range(len(segment)), key=lambda index: segment[index])
+                    flat[self.paths[path_index]] = candidates[best]
+            # 按字段首次出现的顺序输出
+            results.append(unflatten({path: flat[path] for path in self.paths if path in flat}))
+        return results
+
+
+def mix_entities(sources: Sequence[Optional[Dict[str, Any]]], weights: Sequence[float],
+                 strategies: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """按权重融合多个实体
+
+    数值字段取加权平均（只计入含该字段的源），列表字段取并集并按累计权重排序，
+    嵌套字典逐字段递归，其余字段按权重投票。strategies 可按字段路径（a.b）
+    指定 mean/union/vote 覆盖默认规则。
+    """
+    return SourceColumns(sources, strategies).blend(weights)
@@ -0,0 +1,253 @@
+"""
+对象存储模块
+按内容寻址的去重存储：相同内容的文件在各作品之间以硬链接共享
+"""
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
+from .utils import atomic_write
+
+
+# 每个作品根目录下记录 相对路径 -> 内容哈希 的清单
+MANIFEST_NAME = 'objects.json'
+
+# 对象只读：派生作品的链接共享同一 inode，只能以替换文件的方式修改，不能原地改写
+BLOB_MODE = 0o444
+
+
+def hash_file(path: Union[str, Path]) -> Tuple[str, int]:
+    """返回文件内容的 SHA-256 与计算时文件的 inode"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        inode = os.fstat(f.fileno()).st_ino
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest(), inode
+
+
+def iter_work_files(root: Path) -> Iterator[Tuple[str, Path]]:
+    """作品目录下的文件（跳过清单与以 . 开头的临时文件）"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(name for name in dirnames if not name.startswith('.'))
+        for filename in sorted(filenames):
+            if filename.startswith('.'):
+                continue
+            path = Path(dirpath) / filename
+            rel = path.relative_to(root).as_posix()
+            if rel != MANIFEST_NAME:
+                yield rel, path
+
+
+def file_stamp(path: Union[str, Path]) -> List[int]:
+    """文件状态戳：[inode, 大小, mtime（纳秒）]"""
+    stat = os.stat(path)
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+def _link(source: Path, target: Path) -> bool:
+    """硬链接；文件系统不支持时退化为复制（返回 False）"""
+    try:
+        os.link(source, target)
+        return True
+    except (FileExistsError, FileNotFoundError):
+        raise
+    except OSError:
+        copy_writable(source, target)
+        return False
+
+
+def copy_writable(source: Union[str, Path], target: Union[str, Path]) -> Union[str, Path]:
+    """复制文件（保留 mtime）；副本不与对象共享 inode，恢复为可写"""
+    shutil.copy2(source, target)
+    os.chmod(target, 0o644)
+    return target
+
+
+class ObjectStore:
+    """内容寻址对象存储（~/.chenmo/objects/<哈希前两位>/<哈希其余部分>）
+
+    登记作品时把文件内容复制为只读对象，作品自身的文件保持独立、可写；派生作品（转义、
+    部署、分支合并）中的文件是对象的硬链接，只需逐个建立链接，不复制数据。所有写入都以
+    临时文件加 os.replace 完成，替换会断开链接，因此修改派生作品不会影响共享同一对象的
+    其他作品（写时复制）。对象的链接数降为 1（只剩存储自身）时即可由 gc() 回收。
+    """
+
+    def __init__(self, objects_dir: Path):
+        self.objects_dir = Path(objects_dir)
+
+    def blob_path(self, digest: str) -> Path:
+        """对象文件路径"""
+        return self.objects_dir / digest[:2] / digest[2:]
+
+    def put_file(self, path: Path) -> str:
+        """把文件内容存为对象（已存在时不重复存储），返回内容哈希；文件本身不受影响"""
+        digest, _ = hash_file(path)
+        blob = self.blob_path(digest)
+        if blob.exists():
+            return digest
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        temp = blob.with_name(f".{blob.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            shutil.copy2(path, temp)
+            # 以副本的哈希为准：复制期间文件被改写也不会存入内容与哈希不符的对象
+            digest, _ = hash_file(temp)
+            blob = self.blob_path(digest)
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            os.chmod(temp, BLOB_MODE)
+            os.replace(temp, blob)
+        except BaseException:
+            if temp.exists():
+                temp.unlink()
+            raise
+        return digest
+
+    def is_current(self, path: Path, stamp: Optional[List[int]]) -> bool:
+        """文件自登记以来未被改动（inode、大小与 mtime 都与清单记录一致）"""
+        try:
+            return file_stamp(path) == stamp
+        except FileNotFoundError:
+            return False
+
+    def snapshot(self, work_path: Path) -> Dict[str, str]:
+        """登记作品的全部文件，返回并写出 相对路径 -> 哈希 清单（另记登记时的文件状态）
+
+        文件的 inode、大小与 mtime 都未变时直接沿用清单中的哈希。
+        """
+        work_path = Path(work_path)
+        manifest = self.load_manifest(work_path)
+        known = manifest.get('objects', {})
+        known_stamps = manifest.get('stamps', {})
+        objects = {}
+        stamps = {}
+        for rel, path in iter_work_files(work_path):
+            digest = known.get(rel)
+            if digest is not None:
+                if self.is_current(path, known_stamps.get(rel)):
+                    objects[rel] = digest
+                    stamps[rel] = known_stamps[rel]
+                    continue
+                self._discard_modified(path, digest)
+            # 先记录状态再计算哈希：计算期间文件被改动时，下次登记会重新计算
+            stamps[rel] = file_stamp(path)
+            objects[rel] = self.put_file(path)
+        if objects != known or stamps != known_stamps:
+            manifest['objects'] = objects
+            manifest['stamps'] = stamps
+            self._write_manifest(work_path, manifest)
+        return objects
+
+    def _discard_modified(self, path: Path, digest: str):
+        # 派生作品中对象的链接被原地改写：对象内容已与哈希不符，不能再用于去重
+        try:
+            blob = self.blob_path(digest)
+            if os.stat(blob).st_ino == os.stat(path).st_ino:
+                blob.unlink()
+        except FileNotFoundError:
+            pass
+
+    def clone(self, source_path: Path, target_path: Path, source_name: Optional[str] = None):
+        """以链接方式复制作品：O(文件数) 的元数据操作，源作品登记过的内容不再复制"""
+        source_path = Path(source_path)
+        objects = self.snapshot(source_path)
+
+        def populate(staging: Path):
+            for dirpath, dirnames, _ in os.walk(source_path):
+                dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+                for dirname in dirnames:
+                    (staging / Path(dirpath, dirname).relative_to(source_path)).mkdir(parents=True, exist_ok=True)
+            linked = dict(objects)
+            for rel, digest in objects.items():
+                try:
+                    _link(self.blob_path(digest), staging / rel)
+                except FileNotFoundError:
+                    # 对象已被回收：从源文件重新存入
+                    linked[rel] = self.put_file(source_path / rel)
+                    _link(self.blob_path(linked[rel]), staging / rel)
+            stamps = {rel: file_stamp(staging / rel) for rel in linked}
+            return {'source': source_name, 'objects': linked, 'stamps': stamps}
+
+        self._build(target_path, populate)
+
+    def ingest(self, source_dir: Path, target_path: Path):
+        """把外部目录导入为作品：内容已在存储中的文件直接链接，其余文件存入后链接"""
+        source_dir = Path(source_dir)
+
+        def populate(staging: Path):
+            objects = {}
+            stamps = {}
+            for dirpath, dirnames, _ in os.walk(source_dir):
+                for dirname in dirnames:
+                    (staging / Path(dirpath, dirname).relative_to(source_dir)).mkdir(parents=True, exist_ok=True)
+            for rel, path in iter_work_files(source_dir):
+                digest = self.put_file(path)
+                try:
+                    _link(self.blob_path(digest), staging / rel)
+                except FileNotFoundError:
+                    # 对象刚被回收：直接复制，下次 snapshot 时再登记
+                    copy_writable(path, staging / rel)
+                    continue
+                objects[rel] = digest
+                stamps[rel] = file_stamp(staging / rel)
+            return {'source': str(source_dir), 'objects': objects, 'stamps': stamps}
+
+        self._build(target_path, populate)
+
+    def _build(self, target_path: Path, populate):
+        # 在目标旁的暂存目录中建好整个作品后改名就位，失败时不留下半成品
+        target_path = Path(target_path)
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        staging = target_path.with_name(f".{target_path.name}.{uuid.uuid4().hex}")
+        staging.mkdir()
+        try:
+            manifest = populate(staging)
+            self._write_manifest(staging, manifest)
+            os.rename(staging, target_path)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+    def load_manifest(self, work_path: Path) -> Dict[str, Any]:
+        """读取作品的对象清单"""
+        manifest_path = Path(work_path) / MANIFEST_NAME
+        if not manifest_path.exists():
+            return {'objects': {}}
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_manifest(self, work_path: Path, manifest: Dict[str, Any]):
+        atomic_write(Path(work_path) / MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False), fsync=False)
+
+    def gc(self) -> Dict[str, int]:
+        """删除不再被任何作品链接的对象"""
+        removed = 0
+        freed = 0
+        if not self.objects_dir.exists():
+            return {'removed': 0, 'bytes': 0}
+        for prefix_dir in self.objects_dir.iterdir():
+            if not prefix_dir.is_dir():
+                continue
+            for blob in prefix_dir.iterdir():
+                if blob.name.startswith('.'):
+                    # 正在写入的临时文件
+                    continue
+                stat = blob.stat()
+                if stat.st_nlink == 1:
+                    blob.unlink()
+                    removed += 1
+                    freed += stat.st_size
+        return {'removed': removed, 'bytes': freed}
+
+    def stats(self) -> Dict[str, int]:
+        """对象数与占用字节数"""
+        count = 0
+        size = 0
+        if self.objects_dir.exists():
+            for prefix_dir in self.objects_dir.iterdir():
+                for blob in prefix_dir.iterdir():
+                    count += 1
+                    size += blob.stat().st_size
+        return {'objects': count, 'bytes': size}
@@ -3,6 +3,7 @@
 实现各种DSL操作：d, u, l, x, f, c, p, m, t, r, i, s
 """
 import json
+import time
 from typing import Dict, Any, List, Optional, Tuple
 from pathlib import Path
 from .core import ChenmoEngine
@@ -63,6 +64,10 @@ class Operations:
         self.storage = StorageManager()
         self.storage.initialize_with_engine(engine)
     
+    def batch(self):
+        """批量写入会话：with ops.batch(): ... 期间的 l/c/p 等写入在退出时一次性提交"""
+        return self.storage.batch()
+    
     def deploy(self, work_name: str, sub_name: str = "novies", **kwargs):
         """部署操作 - 从源安装设定包到本地持久空间"""
         from_path = kwargs.get('from', None)
@@ -70,113 +75,154 @@ class Operations:
         to_path = kwargs.get('to', str(self.engine.works_dir))
         toas = kwargs.get('toas', work_name)
         
-        # 如果提供了doad，则从官方仓库下载
-        if doad:
-            # 下载包文件
-            package_file = f"/tmp/{doad}.narr"
-            # 这里应该实现从官方仓库下载包的逻辑
-            # 为了演示，我们创建一个模拟包
-            self._create_mock_package(doad, package_file)
-            
-            # 导入包
-            self.storage.import_package(package_file, toas)
-            
-            # 清理临时文件
-            import os
-            os.remove(package_file)
-            
-            return f"Deployed {doad} to {toas}"
-        
-        # 如果提供了from路径，则复制现有结构
-        elif from_path:
-            # 实现从指定路径复制的逻辑
-            source_path = Path(from_path)
-            target_path = self.engine.works_dir / toas
-            
-            if target_path.exists():
-                raise ValueError(f"Namespace collision: {toas} already exists")
+        # 持有目标作品（以及作为来源的本地作品）的锁，命名检查与导入之间不会被其他进程抢先；
+        # 一次按序加锁，避免与反向操作互相等待
+        with self.engine.locks.lock(toas, *self._local_works(from_path)):
+            # 如果提供了doad，则从官方仓库下载
+            if doad:
+                # 这里应该实现从官方仓库下载包的逻辑（直接以流的形式导入，无需临时文件）
+                # 为了演示，我们在内存中创建一个模拟包
+                import io
+                package = io.BytesIO()
+                self._create_mock_package(doad, package)
+                package.seek(0)
+                
+                # 导入包
+                self.storage.import_package(package, toas)
+                
+                return f"Deployed {doad} to {toas}"
             
-            import shutil
-            shutil.copytree(source_path, target_path)
+            # 如果提供了from路径，则复制现有结构
+            elif from_path:
+                # 实现从指定路径复制的逻辑
+                source_path = Path(from_path).expanduser()
+                
+                if self.engine.work_exists(toas):
+                    raise ValueError(f"Namespace collision: {toas} already exists")
+                
+                self.engine.import_work(toas, source_path)
+                
+                return f"Deployed from {from_path} to {toas}"
             
-            return f"Deployed from {from_path} to {toas}"
-        
-        else:
-            # 创建新的作品结构
-            work_path = self.engine.create_work_structure(toas)
-            return f"Created new work structure at {work_path}"
+            else:
+                # 创建新的作品结构
+                work_path = self.engine.create_work_structure(toas)
+                return f"Created new work structure at {work_path}"
     
     def deploy_proxy(self):
         return OperationProxy(self.deploy)
     
     def update(self, work_name: str, sub_name: str = "novies", **kwargs):
-        """更新操作 - 在已有持久作品上增量合并变更"""
+        """更新操作 - 在已有持久作品上增量合并变更
+        
+        dry_run=True 时只返回合并计划（MergePlan），不写入任何文件；
+        merge='interactive' 时对每个冲突调用 resolve(entry)，返回 theirs/ours/patch。
+        """
         from_path = kwargs.get('from', None)
         local_origin = kwargs.get('lo', None)
         to_path = kwargs.get('to', str(self.engine.get_work_path(work_name)))
         toas = kwargs.get('toas', work_name)
         merge_strategy = kwargs.get('merge', 'overlay')
+        dry_run = kwargs.get('dry_run', False)
+        resolve = kwargs.get('resolve', None)
         
         if not from_path:
             raise ValueError("'from' parameter is required for update operation")
         
-        # 如果提供了local origin，进行分支合并
-        if local_origin:
-            # 获取源数据
-            source_path = Path(from_path)
-            target_path = self.engine.works_dir / toas
-            
-            if target_path.exists():
-                raise ValueError(f"Namespace collision: {toas} already exists")
-            
-            # 复制local origin作为基础
-            origin_path = Path(local_origin)
-            import shutil
-            shutil.copytree(origin_path, target_path)
-            
-            # 合并from_path的数据
-            self._merge_directories(source_path, target_path, merge_strategy)
-            
-            return f"Merged {from_path} into {toas} with strategy {merge_strategy}"
-        
-        else:
-            # 原地更新
-            target_path = self.engine.get_work_path(work_name)
-            source_path = Path(from_path)
-            
-            self._merge_directories(source_path, target_path, merge_strategy)
+        from .eventlog import EVENTS_DIR
+        from .merge import plan_merge
+        
+        # 合并期间锁定目标作品与作为来源的本地作品（一次按序加锁）
+        target = toas if local_origin else work_name
+        with self.engine.locks.lock(target, *self._local_works(from_path, local_origin)):
+            # 如果提供了local origin，进行分支合并
+            if local_origin:
+                # 获取源数据
+                source_path = Path(from_path).expanduser()
+                origin_path = Path(local_origin).expanduser()
+                
+                # 以 local origin 为目标规划：新作品即其副本，冲突在复制之前即可发现
+                plan = plan_merge(source_path, origin_path, merge_strategy, objects=self.engine.objects,
+                                  exclude=[EVENTS_DIR])
+                if dry_run:
+                    return plan
+                if merge_strategy == 'strict' and plan.conflicts:
+                    raise ValueError(f"File conflict: {', '.join(entry['path'] for entry in plan.conflicts)}")
+                
+                if self.engine.work_exists(toas):
+                    raise ValueError(f"Namespace collision: {toas} already exists")
+                
+                # 复制local origin作为基础
+                self.engine.import_work(toas, origin_path)
+                
+                # 合并from_path的数据
+                summary = self._merge_into_work(toas, source_path, merge_strategy, resolve)
+                
+                return f"Merged {from_path} into {toas} with strategy {merge_strategy} ({self._format_summary(summary)})"
             
-            return f"Updated {work_name} with strategy {merge_strategy}"
+            else:
+                # 原地更新
+                source_path = Path(from_path).expanduser()
+                
+                summary = self._merge_into_work(work_name, source_path, merge_strategy, resolve, dry_run)
+                if dry_run:
+                    return summary
+                
+                return f"Updated {work_name} with strategy {merge_strategy} ({self._format_summary(summary)})"
     
     def update_proxy(self):
         return OperationProxy(self.update)
     
-    def _merge_directories(self, src: Path, dst: Path, strategy: str):
-        """合并目录"""
-        import shutil
-        
-        for item in src.iterdir():
-            dst_item = dst / item.name
-            
-            if item.is_dir():
-                if dst_item.exists() and dst_item.is_dir():
-                    # 递归合并子目录
-                    self._merge_directories(item, dst_item, strategy)
-                else:
-                    # 复制新目录
-                    shutil.copytree(item, dst_item)
-            else:
-                # 处理文件
-                if dst_item.exists() and strategy != 'overlay':
-                    if strategy == 'strict':
-                        raise ValueError(f"File conflict: {dst_item}")
-                    elif strategy == 'interactive':
-                        # 在实际应用中，这里应该询问用户如何处理冲突
-                        # 现在我们简单地覆盖
-                        pass
-                
-                # 复制文件
-                shutil.copy2(item, dst_item)
+    def _local_works(self, *paths: Optional[str]) -> List[str]:
+        """参数中指向本地作品的路径对应的作品标识符"""
+        names = (self.engine.local_work_name(path) for path in paths if path)
+        return [name for name in names if name is not None]
+    
+    def _merge_into_work(self, work_name: str, src: Path, strategy: str, resolve=None, dry_run: bool = False):
+        """将目录增量合并进作品并刷新索引，返回变更摘要（dry_run 时返回合并计划）
+        
+        events/ 不参与文件级合并：来源的事件记录重新编号后追加到作品日志末尾，
+        已有记录与快照保持不变。
+        """
+        from .eventlog import EventLog, EVENTS_DIR
+        from .merge import DirectoryMerger
+        
+        if self.engine.backend.name == 'file':
+            merger = DirectoryMerger(self.engine.objects, exclude=[EVENTS_DIR])
+            plan = merger.plan(src, self.engine.get_work_path(work_name), strategy)
+            if dry_run:
+                return plan
+            summary = merger.apply(plan, resolve)
+        else:
+            # 非目录后端：导出为目录布局，合并后整体替换
+            import tempfile
+            merger = DirectoryMerger(exclude=[EVENTS_DIR])
+            with tempfile.TemporaryDirectory() as temp_dir:
+                staging = Path(temp_dir) / work_name
+                self.engine.export_work(work_name, staging)
+                plan = merger.plan(src, staging, strategy)
+                if dry_run:
+                    return plan
+                summary = merger.apply(plan, resolve)
+                self.engine.close_event_log(work_name)
+                self.engine.backend.delete_work(work_name)
+                self.engine.backend.import_work(work_name, staging)
+        
+        source_events = Path(src) / EVENTS_DIR
+        if source_events.is_dir():
+            summary['events'] = self.engine.event_log(work_name).replay(EventLog(source_events), str(Path(src).resolve()))
+            if summary['events']:
+                self.engine.snapshots(work_name).update()
+        
+        self.engine.reindex_work(work_name)
+        return summary
+    
+    @staticmethod
+    def _format_summary(summary: Dict[str, List[str]]) -> str:
+        text = ", ".join(f"{len(summary[key])} {key}" for key in ('added', 'modified', 'unchanged', 'conflicted'))
+        if summary.get('events'):
+            text += f", {len(summary['events'])} events merged"
+        return text
     
     def register(self, work_name: str, sub_name: str = "novies", **kwargs):
         """注册操作 - 从零声明新作品、人物、设定或物品"""
@@ -185,34 +231,36 @@ class Operations:
         log_settings = kwargs.get('log_settings', [])
         log_thing = kwargs.get('log_thing', [])
         
-        # 创建作品结构
-        work_path = self.engine.create_work_structure(work_name)
-        
-        # 注册作品描述
-        if log_works:
-            data = {"description": log_works}
-            self.storage.save_work_data(work_name, sub_name, 'novies', data)
-        
-        # 注册人物
-        for person_desc in log_person:
-            person_data = {"description": person_desc}
-            self.storage.save_work_data(work_name, person_desc.replace(' ', '_').lower(), 'p', person_data)
-        
-        # 注册设定
-        for setting_desc in log_settings:
-            if isinstance(setting_desc, str):
-                setting_data = {"description": setting_desc}
-                self.storage.save_work_data(work_name, setting_desc.replace(' ', '_').lower(), 'c', setting_data)
-            else:
-                # 如果是复杂对象，可能是从其他地方引用的
-                # 这里简化处理
-                setting_data = setting_desc
-                self.storage.save_work_data(work_name, "referenced_setting", 'c', setting_data)
-        
-        # 注册物品/科技
-        for thing_desc in log_thing:
-            thing_data = {"description": thing_desc}
-            self.storage.save_work_data(work_name, thing_desc.replace(' ', '_').lower(), 't', thing_data)
+        # 作品结构与全部实体在同一批次中提交，中途失败不会留下半注册的作品
+        with self.engine.locks.lock(work_name), self.storage.batch():
+            # 创建作品结构
+            self.storage.create_work(work_name)
+            
+            # 注册作品描述
+            if log_works:
+                data = {"description": log_works}
+                self.storage.save_work_data(work_name, sub_name, 'novies', data)
+            
+            # 注册人物
+            for person_desc in log_person:
+                person_data = {"description": person_desc}
+                self.storage.save_work_data(work_name, person_desc.replace(' ', '_').lower(), 'p', person_data)
+            
+            # 注册设定
+            for setting_desc in log_settings:
+                if isinstance(setting_desc, str):
+                    setting_data = {"description": setting_desc}
+                    self.storage.save_work_data(work_name, setting_desc.replace(' ', '_').lower(), 'c', setting_data)
+                else:
+                    # 如果是复杂对象，可能是从其他地方引用的
+                    # 这里简化处理
+                    setting_data = setting_desc
+                    self.storage.save_work_data(work_name, "referenced_setting", 'c', setting_data)
+            
+            # 注册物品/科技
+            for thing_desc in log_thing:
+                thing_data = {"description": thing_desc}
+                self.storage.save_work_data(work_name, thing_desc.replace(' ', '_').lower(), 't', thing_data)
         
         return f"Registered new work '{work_name}' with {len(log_person)} persons, {len(log_settings)} settings, {len(log_thing)} things"
     
@@ -225,61 +273,75 @@ class Operations:
         weights = kwargs.get('weights', [])
         target_type = kwargs.get('target_type', 'c')
         toas = kwargs.get('toas', f"mixed_{work_name}_{sub_name}")
+        strategies = kwargs.get('strategies', None)
         
         if len(sources) != len(weights):
             raise ValueError("Number of sources must match number of weights")
         
-        if sum(weights) != 1.0:
-            # 归一化权重
-            total_weight = sum(weights)
-            weights = [w / total_weight for w in weights]
-        
-        # 收集源数据
-        combined_data = {}
-        for (src_work, src_sub), weight in zip(sources, weights):
-            src_data = self.engine.load_entity(src_work, src_sub, target_type)
-            if src_data:
-                # 简单加权合并（实际应用中可能需要更复杂的合并逻辑）
-                for key, value in src_data.items():
-                    if key not in combined_data:
-                        combined_data[key] = []
-                    combined_data[key].append((value, weight))
-        
-        # 创建混合后的内容
-        final_data = {}
-        for key, weighted_values in combined_data.items():
-            # 对于每个键，按权重合并值
-            # 这里简化处理，只取第一个值乘以权重
-            if isinstance(weighted_values[0][0], (int, float)):
-                final_value = sum(v * w for v, w in weighted_values)
-            else:
-                # 对于字符串或其他类型，选择权重最高的
-                max_weight_idx = max(range(len(weighted_values)), key=lambda i: weighted_values[i][1])
-                final_value = weighted_values[max_weight_idx][0]
-            
-            final_data[key] = final_value
+        # 并行加载全部源实体，按字段向量化融合（数值加权平均、列表按权重合并、嵌套字典递归、其余按权重投票）
+        from .mixing import mix_entities
+        
+        source_data = self.engine.load_entities([(src_work, src_sub, target_type) for src_work, src_sub in sources])
+        final_data = mix_entities(source_data, weights, strategies)
         
-        # 保存混合结果
-        result_path = self.engine.create_work_structure(toas)
-        self.storage.save_work_data(toas, "mixed_result", target_type, final_data)
+        # 保存混合结果（锁定目标作品，创建与写入之间不被其他进程打断）
+        with self.engine.locks.lock(toas):
+            result_path = self.engine.create_work_structure(toas)
+            self.storage.save_work_data(toas, "mixed_result", target_type, final_data)
         
         return f"Mixed {len(sources)} sources into new entity '{toas}'"
     
     def mix_proxy(self):
         return OperationProxy(self.mix)
     
+    def mix_many(self, work_name: str, sub_name: str = "novies", **kwargs):
+        """批量混合 - 同一组源按 N × M 权重矩阵一次生成 N 个混合实体"""
+        sources = kwargs.get('sources', [])
+        weights = kwargs.get('weights', [])
+        target_type = kwargs.get('target_type', 'c')
+        toas = kwargs.get('toas', f"mixed_{work_name}_{sub_name}")
+        names = kwargs.get('names', None) or [f"hybrid_{n}" for n in range(len(weights))]
+        strategies = kwargs.get('strategies', None)
+        
+        if len(names) != len(weights):
+            raise ValueError("Number of names must match number of weight rows")
+        if len(set(names)) != len(names):
+            raise ValueError("Hybrid names must be unique")
+        
+        from .mixing import SourceColumns
+        
+        started = time.perf_counter()
+        # 源只加载、展开一次，全部混合结果由一次矩阵运算得到
+        source_data = self.engine.load_entities([(src_work, src_sub, target_type) for src_work, src_sub in sources])
+        hybrids = SourceColumns(source_data, strategies).blend_many(weights)
+        
+        # 目标作品与全部混合实体在同一批次中提交
+        with self.engine.locks.lock(toas), self.storage.batch():
+            self.storage.create_work(toas)
+            for name, data in zip(names, hybrids):
+                self.storage.save_work_data(toas, name, target_type, data)
+        
+        elapsed = time.perf_counter() - started
+        rate = len(hybrids) / elapsed if elapsed > 0 else float('inf')
+        return f"Mixed {len(hybrids)} hybrids from {len(sources)} sources into '{toas}' ({rate:.0f} hybrids/sec)"
+    
+    def mix_many_proxy(self):
+        return OperationProxy(self.mix_many)
+    
     def fabricate(self, work_name: str, sub_name: str = "novies", **kwargs):
         """实例化操作 - 动态生成作品实例"""
         setting = kwargs.get('setting', '')
         
-        work_path = self.engine.create_work_structure(work_name)
-        
-        # 创建基本设置
-        data = {
-            "description": setting,
-            "created_via": "fabricate"
-        }
-        self.storage.save_work_data(work_name, sub_name, 'novies', data)
+        # 锁定作品，创建与写入之间不被其他进程打断
+        with self.engine.locks.lock(work_name):
+            work_path = self.engine.create_work_structure(work_name)
+            
+            # 创建基本设置
+            data = {
+                "description": setting,
+                "created_via": "fabricate"
+            }
+            self.storage.save_work_data(work_name, sub_name, 'novies', data)
         
         return f"Fabricated new work '{work_name}' with setting: {setting}"
     
@@ -328,18 +390,20 @@ class Operations:
         fate_change = kwargs.get('r', '')
         as_sub = kwargs.get('as_sub', f"{sub_name}_mirror")
         
-        # 加载源人物数据
-        source_data = self.engine.load_entity(work_name, source_persona, 'p')
-        if not source_data:
-            raise ValueError(f"Source persona {source_persona} does not exist in {work_name}")
-        
-        # 创建镜像数据（基于源数据修改）
-        mirror_data = source_data.copy()
-        mirror_data['fate_variant'] = fate_change
-        mirror_data['based_on'] = source_persona
-        mirror_data['created_via'] = 'mirror'
-        
-        self.storage.save_work_data(work_name, as_sub, 'm', mirror_data)
+        # 锁定作品，读取源人物与写入镜像之间不被其他进程打断
+        with self.engine.locks.lock(work_name):
+            # 加载源人物数据
+            source_data = self.engine.load_entity(work_name, source_persona, 'p')
+            if not source_data:
+                raise ValueError(f"Source persona {source_persona} does not exist in {work_name}")
+            
+            # 创建镜像数据（基于源数据修改）
+            mirror_data = source_data.copy()
+            mirror_data['fate_variant'] = fate_change
+            mirror_data['based_on'] = source_persona
+            mirror_data['created_via'] = 'mirror'
+            
+            self.storage.save_work_data(work_name, as_sub, 'm', mirror_data)
         
         return f"Created mirror {as_sub} of {source_persona} with fate change: {fate_change}"
     
@@ -354,30 +418,26 @@ class Operations:
         if not toas:
             raise ValueError("'toas' parameter is required for transmute operation")
         
-        # 获取源作品路径
-        source_path = self.engine.get_work_path(source_work)
-        if not source_path.exists():
-            raise ValueError(f"Source work {source_work} does not exist")
-        
-        # 创建新作品路径
-        target_path = self.engine.get_work_path(toas)
-        if target_path.exists():
-            raise ValueError(f"Namespace collision: {toas} already exists")
-        
-        # 复制整个作品结构
-        import shutil
-        shutil.copytree(source_path, target_path)
-        
-        # 添加血缘元数据
-        lineage_data = {
-            "original_source": source_work,
-            "transmutation_reason": rcd,
-            "transmutation_date": str(Path.home() / '.chenmo' / 'timestamp')  # 简化表示
-        }
-        
-        lineage_file = target_path / 'lineage.json'
-        with open(lineage_file, 'w', encoding='utf-8') as f:
-            json.dump(lineage_data, f, ensure_ascii=False, indent=2)
+        # 锁定源作品与目标作品，复制期间源作品不被修改
+        with self.engine.locks.lock(source_work, toas):
+            # 检查源作品与目标命名
+            if not self.engine.work_exists(source_work):
+                raise ValueError(f"Source work {source_work} does not exist")
+            
+            if self.engine.work_exists(toas):
+                raise ValueError(f"Namespace collision: {toas} already exists")
+            
+            # 复制整个作品结构
+            self.engine.copy_work(source_work, toas)
+            
+            # 添加血缘元数据
+            lineage_data = {
+                "original_source": source_work,
+                "transmutation_reason": rcd,
+                "transmutation_date": str(Path.home() / '.chenmo' / 'timestamp')  # 简化表示
+            }
+            
+            self.engine.save_work_file(toas, 'lineage.json', lineage_data)
         
         return f"Transmuted {source_work} to {toas} with lineage record: {rcd}"
     
@@ -390,104 +450,203 @@ class Operations:
         then_event = kwargs.get('then', '')
         outcome = kwargs.get('outcome', {})
         
-        # 检查条件是否满足（简化实现）
-        condition_met = True  # 在实际实现中，这里应该评估when_condition
-        if condition_met:
-            # 记录发生的事件
-            event_data = {
-                "event": then_event,
-                "outcome": outcome,
-                "triggered_by": f"{work_name}.{sub_name}",
-                "timestamp": "placeholder_timestamp"  # 实际应用中应使用真实时间戳
-            }
-            
-            # 保存事件到历史记录
-            events_dir = self.engine.get_work_path(work_name) / 'events'
-            events_dir.mkdir(exist_ok=True)
-            
-            import time
-            event_filename = f"event_{int(time.time())}_{sub_name.replace(' ', '_')}.json"
-            event_path = events_dir / event_filename
-            
-            with open(event_path, 'w', encoding='utf-8') as f:
-                json.dump(event_data, f, ensure_ascii=False, indent=2)
-            
-            return f"Executed event: {then_event} in {work_name}.{sub_name}"
-        else:
-            return f"Condition not met for event: {then_event}"
+        # 锁定作品，读取状态与追加事件之间不被其他进程打断
+        with self.engine.locks.lock(work_name):
+            # 未给出条件或条件已在调用方求值（布尔值）时直接使用，表达式字符串按作品当前事实求值
+            if when_condition is None:
+                condition_met = True
+            elif isinstance(when_condition, str):
+                condition_met = self._evaluate_condition(work_name, when_condition)
+            else:
+                condition_met = bool(when_condition)
+            if condition_met:
+                # 记录发生的事件
+                event_data = {
+                    "event": then_event,
+                    "outcome": outcome,
+                    "triggered_by": f"{work_name}.{sub_name}"
+                }
+                
+                # 追加到作品的事件日志（序号与时间戳由日志分配），越过快照间隔时补存状态快照
+                self.engine.event_log(work_name).append(event_data)
+                self.engine.snapshots(work_name).update()
+                
+                return f"Executed event: {then_event} in {work_name}.{sub_name}"
+            else:
+                return f"Condition not met for event: {then_event}"
     
     def run_proxy(self):
         return OperationProxy(self.run)
     
+    def simulate(self, work_name: str, sub_name: str = "novies", **kwargs):
+        """多步推演 - 按 when/then 规则连续推演，世界状态常驻内存，事件成批写入日志"""
+        steps = kwargs.get('steps', 100)
+        rules = kwargs.get('rules', None)
+        events = kwargs.get('events', None)
+        resume = kwargs.get('resume', False)
+        options = {
+            'flush_every': kwargs.get('flush_every', 256),
+            'checkpoint_every': kwargs.get('checkpoint_every', None),
+            'triggered_by': f"{work_name}.{sub_name}",
+        }
+        
+        from .simulation import Simulation
+        
+        if resume:
+            simulation = Simulation.resume(self.engine, work_name, rules, **options)
+        else:
+            simulation = Simulation(self.engine, work_name, rules, **options)
+        stats = simulation.run(steps, events)
+        
+        return (f"Simulated {stats['steps']} steps in {work_name}.{sub_name}: {stats['events']} events "
+                f"({stats['steps_per_sec']:.0f} steps/sec)")
+    
+    def simulate_proxy(self):
+        return OperationProxy(self.simulate)
+    
+    def branch(self, work_name: str, sub_name: str = "novies", **kwargs):
+        """分支推演 - 把作品快照分叉为多个假设分支并行推演，只保留选中的分支
+        
+        variants 为每个分支的 run 参数列表（when/then/outcome）；keep 为要保留的分支序号
+        或以分支为参数的判断函数，保留的分支以 toas（可含 {n}）命名并写入 lineage.json。
+        """
+        variants = kwargs.get('variants', [])
+        keep = kwargs.get('keep', None)
+        toas = kwargs.get('toas', f"{work_name}_branch_{{n}}")
+        rcd = kwargs.get('rcd', '')
+        workers = kwargs.get('workers', None)
+        
+        from .branching import WorkSnapshot, explore, keep_branch
+        
+        started = time.perf_counter()
+        snapshot = WorkSnapshot.capture(self.engine, work_name)
+        branches = explore(snapshot, variants, f"{work_name}.{sub_name}", workers)
+        elapsed = time.perf_counter() - started
+        
+        if callable(keep):
+            kept = [branch for branch in branches if keep(branch)]
+        else:
+            kept = [branches[index] for index in (keep or [])]
+        names = [keep_branch(self.engine, snapshot, branch, toas.format(n=branch.index), rcd) for branch in kept]
+        
+        rate = len(branches) / elapsed if elapsed > 0 else float('inf')
+        return (f"Explored {len(branches)} branches of {work_name} ({rate:.0f} branches/sec), "
+                f"kept {len(names)}: {', '.join(names) or 'none'}")
+    
+    def branch_proxy(self):
+        return OperationProxy(self.branch)
+    
+    def _evaluate_condition(self, work_name: str, when: str) -> bool:
+        """对作品的实体、累计状态与事件历史求值条件表达式"""
+        from .rules import compile_condition
+        
+        condition = compile_condition(when)
+        # 从最新的状态快照开始；其后的事件只在条件引用 state 或事件时才读取
+        world = self.engine.snapshots(work_name).world(
+            loader=lambda entity_type, name: self.engine.load_entity(work_name, name, entity_type)
+        )
+        return condition(world)
+    
+    def history(self, work_name: str, since: Optional[float] = None, until: Optional[float] = None,
+                triggered_by: Optional[str] = None, after_seq: int = 0) -> List[Dict[str, Any]]:
+        """查询作品的事件历史（按时间范围、触发实体或序号过滤）"""
+        return list(self.engine.event_log(work_name).scan(since, until, triggered_by, after_seq))
+    
     def inspect(self, work_name: str, sub_name: str = "novies", **kwargs):
-        """查看操作 - 返回指定实体的结构化元数据"""
+        """查看操作 - 返回指定实体的结构化元数据
+        
+        at 为事件序号（int）、时间戳（float）或 ISO 时间时，返回该时刻的实体：
+        实体数据叠加截至该时刻事件 outcome 中以实体名开头的状态。
+        """
         target_type = kwargs.get('target', 'novies')
+        at = kwargs.get('at', None)
         
         data = self.engine.load_entity(work_name, sub_name, target_type)
+        if at is not None:
+            from .merge import merge_json
+            
+            overlay = self.state_at(work_name, at)['state'].get(sub_name)
+            if isinstance(overlay, dict):
+                data = merge_json(data or {}, overlay)
         if data is None:
             return f"No data found for {work_name}.{sub_name} (type: {target_type})"
         
         return data
     
+    def state_at(self, work_name: str, at: Optional[Any] = None) -> Dict[str, Any]:
+        """作品在某一时刻（事件序号、时间戳或 ISO 时间，缺省为最新）的累计状态与事件计数"""
+        from .snapshots import parse_at
+        
+        if not self.engine.work_exists(work_name):
+            raise ValueError(f"Work {work_name} does not exist")
+        query = parse_at(at) if at is not None else {}
+        return self.engine.snapshots(work_name).state_at(**query)
+    
     def inspect_proxy(self):
         return OperationProxy(self.inspect)
     
-    def search(self, what: str, work_filter: str = "none", **kwargs):
-        """搜索操作 - 搜索官方与本地作品及实体"""
-        # 处理关键字参数
-        if work_filter == "none":
-            work_filter = None
-        elif work_filter == what:
-            # 这意味着是在使用DSL语法 s.what.what("keyword")
-            keyword = work_filter  # 实际的关键词
-            work_filter = None
+    def search(self, work_name: str, sub_name: str = "novies", *args, **kwargs):
+        """搜索操作 - 搜索官方与本地作品及实体
+        
+        支持的调用形式：
+        s("关键词")                       # 搜索全部作品
+        s.<作品名|none>.<类型|all>("关键词")
+        """
+        if args:
+            # DSL 形式：s.what.what("关键词")
+            keyword = args[0]
+            work_filter = None if work_name == 'none' else work_name
+            type_filter = None if sub_name in ('novies', 'all') else sub_name
         else:
-            keyword = what
+            keyword = work_name
+            work_filter = None
+            type_filter = None
+        
+        work_filter = kwargs.get('work_filter', work_filter)
+        type_filter = kwargs.get('type_filter', type_filter)
+        mode = kwargs.get('mode', 'name')
+        
+        if mode == 'content':
+            # 全文检索：返回按相关度排序的轻量结果，数据在访问 .data 时加载
+            return self.engine.search_content(
+                keyword, work_filter, type_filter,
+                limit=kwargs.get('limit', 20), offset=kwargs.get('offset', 0)
+            )
+        elif mode != 'name':
+            raise ValueError(f"Unsupported search mode: {mode}")
+        
+        if kwargs.get('stream', False):
+            # 流式结果：边扫描边产出，数据按需加载
+            return self.engine.iter_entities(keyword, work_filter, type_filter)
         
         # 搜索实体
-        results = self.engine.search_entities(keyword, work_filter)
+        results = self.engine.search_entities(keyword, work_filter, type_filter)
         
         return results
     
     def search_proxy(self):
         return OperationProxy(self.search)
     
-    def _create_mock_package(self, package_id: str, package_file: str):
-        """创建模拟包文件用于演示"""
-        import zipfile
-        import tempfile
+    def _create_mock_package(self, package_id: str, fileobj):
+        """创建模拟包（写入文件对象）用于演示"""
+        from .packaging import PackageWriter
         
-        # 创建临时目录
-        with tempfile.TemporaryDirectory() as temp_dir:
-            temp_path = Path(temp_dir)
-            
-            # 创建模拟作品结构
-            work_path = temp_path / package_id
-            work_path.mkdir()
-            
-            # 创建manifest.json
-            manifest = {
-                "name": package_id,
-                "version": "1.0",
-                "canonical_source": package_id
-            }
-            with open(work_path / 'manifest.json', 'w', encoding='utf-8') as f:
-                json.dump(manifest, f, ensure_ascii=False, indent=2)
-            
-            # 创建各个子目录
-            (work_path / 'novies').mkdir()
-            (work_path / 'cores').mkdir()
-            (work_path / 'personas').mkdir()
-            (work_path / 'tech').mkdir()
-            
-            # 创建一些示例文件
-            with open(work_path / 'novies' / 'intro.json', 'w', encoding='utf-8') as f:
-                json.dump({"description": f"Introductory content for {package_id}"}, f, ensure_ascii=False, indent=2)
-            
-            # 打包成.narr文件
-            with zipfile.ZipFile(package_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(work_path):
-                    for file in files:
-                        file_path = Path(root) / file
-                        arcname = file_path.relative_to(temp_path)
-                        zipf.write(file_path, arcname)
\ No newline at end of file
+        writer = PackageWriter(fileobj)
+        
+        # 创建manifest.json
+        manifest = {
+            "name": package_id,
+            "version": "1.0",
+            "canonical_source": package_id
+        }
+        writer.add_bytes('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+        
+        # 创建各个子目录
+        for entity_dir in ('novies', 'cores', 'personas', 'tech'):
+            writer.add_directory(entity_dir)
+        
+        # 创建一些示例文件
+        intro = {"description": f"Introductory content for {package_id}"}
+        writer.add_bytes('novies/intro.json', json.dumps(intro, ensure_ascii=False, indent=2).encode('utf-8'))
+        
+        writer.close()
@@ -0,0 +1,421 @@
+"""
+打包模块
+.narr 包（ZIP 格式）的流式读写：条目在进程池中并行压缩，直接写入/读取文件对象或套接字
+"""
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path, PurePosixPath
+from typing import Dict, Any, List, Optional, Iterator, Iterable, Tuple, Union
+
+
+# 压缩方式：名称 -> ZIP 方法号（zstd 为 APPNOTE 6.3.7 规定的 93）
+COMPRESSION_METHODS = {'stored': 0, 'deflated': 8, 'zstd': 93}
+DEFAULT_LEVELS = {'stored': 0, 'deflated': 6, 'zstd': 3}
+
+# 并行压缩时每个任务处理的条目数，以及少于多少个条目时不启用进程池
+CHUNK_SIZE = 256
+MIN_PARALLEL_ENTRIES = 512
+
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END_RECORD = struct.Struct('<IHHHHIIH')
+_ZIP64_END_RECORD = struct.Struct('<IQHHIIQQQQ')
+_ZIP64_LOCATOR = struct.Struct('<IIQI')
+_DATA_DESCRIPTOR = struct.Struct('<III')
+
+_LOCAL_SIG = 0x04034b50
+_CENTRAL_SIG = 0x02014b50
+_END_SIG = 0x06054b50
+_ZIP64_END_SIG = 0x06064b50
+_ZIP64_LOCATOR_SIG = 0x07064b50
+_DESCRIPTOR_SIG = 0x08074b50
+
+_UTF8_FLAG = 0x800
+_DESCRIPTOR_FLAG = 0x8
+_ZIP32_LIMIT = 0xFFFFFFFF
+_COUNT_LIMIT = 0xFFFF
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Please install zstandard: pip install zstandard")
+    return zstandard
+
+
+def _dos_datetime(mtime: float) -> Tuple[int, int]:
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), \
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+def _compress(data: bytes, compression: str, level: int) -> bytes:
+    if compression == 'stored':
+        return data
+    if compression == 'deflated':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush()
+    return _zstd().ZstdCompressor(level=level).compress(data)
+
+
+def _compress_entry(source: Union[str, bytes], compression: str, level: int) -> Tuple[int, int, bytes, float]:
+    """读取（路径）并压缩单个条目，返回 (crc32, 原始大小, 压缩数据, mtime)"""
+    if isinstance(source, bytes):
+        data, mtime = source, time.time()
+    else:
+        with open(source, 'rb') as f:
+            data = f.read()
+        mtime = os.stat(source).st_mtime
+    return zlib.crc32(data), len(data), _compress(data, compression, level), mtime
+
+
+def _compress_chunk(sources: List[Union[str, bytes]], compression: str, level: int) -> List[tuple]:
+    """进程池任务：压缩一组条目"""
+    return [_compress_entry(source, compression, level) for source in sources]
+
+
+class PackageWriter:
+    """流式 ZIP 写入器
+
+    每个条目在写出前已完成压缩，本地文件头即包含 CRC 与大小，因此只需顺序写入，
+    目标可以是不可 seek 的流（管道、套接字）。条目数或偏移超出 ZIP32 范围时
+    自动写出 ZIP64 结尾记录。
+    """
+
+    def __init__(self, fileobj, compression: str = 'deflated'):
+        if compression not in COMPRESSION_METHODS:
+            raise ValueError(f"Unknown compression: {compression}")
+        self.fileobj = fileobj
+        self.compression = compression
+        self.offset = 0
+        self.bytes_in = 0
+        self._central = []
+
+    def _write(self, data: bytes):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def add_directory(self, arcname: str, mtime: Optional[float] = None):
+        """写入目录条目（保留空目录）"""
+        arcname = arcname.rstrip('/') + '/'
+        self._add(arcname, 0, 0, 0, b'', mtime if mtime is not None else time.time(), external=(0o40755 << 16) | 0x10)
+
+    def add_compressed(self, arcname: str, crc: int, size: int, payload: bytes, mtime: float):
+        """写入已压缩的文件条目"""
+        self.bytes_in += size
+        self._add(arcname, COMPRESSION_METHODS[self.compression], crc, size, payload, mtime, external=0o100644 << 16)
+
+    def add_bytes(self, arcname: str, data: bytes, mtime: Optional[float] = None):
+        """压缩并写入内存中的文件条目"""
+        level = DEFAULT_LEVELS[self.compression]
+        crc, size, payload, default_mtime = _compress_entry(data, self.compression, level)
+        self.add_compressed(arcname, crc, size, payload, mtime if mtime is not None else default_mtime)
+
+    def _add(self, arcname: str, method: int, crc: int, size: int, payload: bytes, mtime: float, external: int):
+        if size >= _ZIP32_LIMIT or len(payload) >= _ZIP32_LIMIT:
+            raise ValueError(f"Package entry too large: {arcname}")
+        name = arcname.encode('utf-8')
+        dos_time, dos_date = _dos_datetime(mtime)
+        version = 63 if method == COMPRESSION_METHODS['zstd'] else 20
+        header_offset = self.offset
+        self._write(_LOCAL_HEADER.pack(
+            _LOCAL_SIG, version, _UTF8_FLAG, method, dos_time, dos_date, crc, len(payload), size, len(name), 0
+        ))
+        self._write(name)
+        self._write(payload)
+        self._central.append((name, version, method, dos_time, dos_date, crc, len(payload), size, external, header_offset))
+
+    def close(self):
+        """写出中央目录与结尾记录（不关闭底层文件对象）"""
+        central_offset = self.offset
+        for name, version, method, dos_time, dos_date, crc, csize, size, external, header_offset in self._central:
+            extra = b''
+            if header_offset >= _ZIP32_LIMIT:
+                extra = struct.pack('<HHQ', 0x0001, 8, header_offset)
+                header_offset = _ZIP32_LIMIT
+                version = max(version, 45)
+            self._write(_CENTRAL_HEADER.pack(
+                _CENTRAL_SIG, (3 << 8) | version, version, _UTF8_FLAG, method, dos_time, dos_date,
+                crc, csize, size, len(name), len(extra), 0, 0, 0, external, header_offset
+            ))
+            self._write(name)
+            self._write(extra)
+        central_size = self.offset - central_offset
+
+        count = len(self._central)
+        if count >= _COUNT_LIMIT or central_offset >= _ZIP32_LIMIT or central_size >= _ZIP32_LIMIT:
+            zip64_offset = self.offset
+            self._write(_ZIP64_END_RECORD.pack(
+                _ZIP64_END_SIG, _ZIP64_END_RECORD.size - 12, 45, 45, 0, 0, count, count, central_size, central_offset
+            ))
+            self._write(_ZIP64_LOCATOR.pack(_ZIP64_LOCATOR_SIG, 0, zip64_offset, 1))
+            count = min(count, _COUNT_LIMIT)
+            central_size = min(central_size, _ZIP32_LIMIT)
+            central_offset = min(central_offset, _ZIP32_LIMIT)
+        self._write(_END_RECORD.pack(_END_SIG, 0, 0, count, count, central_size, central_offset, 0))
+
+
+def write_package(fileobj, entries: Iterable[Tuple[str, Union[str, bytes, None]]], compression: str = 'deflated',
+                  workers: Optional[int] = None, level: Optional[int] = None) -> Dict[str, Any]:
+    """把条目流式写成 .narr 包
+
+    entries 为 (包内路径, 来源) 列表：来源为文件路径、内存中的 bytes，或 None 表示目录。
+    文件条目按 CHUNK_SIZE 分组交给进程池并行读取与压缩，按原顺序写出；
+    同时在途的分组数有上限，内存占用与包大小无关。返回条目数、字节数与吞吐量。
+    """
+    if compression == 'zstd':
+        _zstd()
+    level = DEFAULT_LEVELS.get(compression, 0) if level is None else level
+    workers = workers or os.cpu_count() or 1
+    entries = list(entries)
+    started = time.perf_counter()
+
+    writer = PackageWriter(fileobj, compression)
+    files = [(arcname, source) for arcname, source in entries if source is not None]
+    for arcname, source in entries:
+        if source is None:
+            writer.add_directory(arcname)
+
+    chunks = [files[start:start + CHUNK_SIZE] for start in range(0, len(files), CHUNK_SIZE)]
+    if workers <= 1 or compression == 'stored' or len(files) < MIN_PARALLEL_ENTRIES:
+        results = (_compress_chunk([source for _, source in chunk], compression, level) for chunk in chunks)
+        for chunk, compressed in zip(chunks, results):
+            for (arcname, _), entry in zip(chunk, compressed):
+                writer.add_compressed(arcname, *entry)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = []
+            next_chunk = 0
+            while next_chunk < len(chunks) or pending:
+                # 最多保持 2 * workers 个分组在途
+                while next_chunk < len(chunks) and len(pending) < 2 * workers:
+                    chunk = chunks[next_chunk]
+                    sources = [source for _, source in chunk]
+                    pending.append((chunk, executor.submit(_compress_chunk, sources, compression, level)))
+                    next_chunk += 1
+                chunk, future = pending.pop(0)
+                for (arcname, _), entry in zip(chunk, future.result()):
+                    writer.add_compressed(arcname, *entry)
+
+    writer.close()
+    elapsed = time.perf_counter() - started
+    return {
+        'entries': len(entries),
+        'bytes_in': writer.bytes_in,
+        'bytes_out': writer.offset,
+        'seconds': elapsed,
+        'mb_per_sec': writer.bytes_in / 1e6 / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def directory_entries(root: Union[str, Path]) -> List[Tuple[str, Optional[str]]]:
+    """目录树对应的包条目：包内路径相对于 root，目录条目在前"""
+    root = str(root)
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        rel = os.path.relpath(dirpath, root)
+        prefix = '' if rel == '.' else rel.replace(os.sep, '/') + '/'
+        if prefix:
+            entries.append((prefix, None))
+        for filename in sorted(filenames):
+            entries.append((prefix + filename, os.path.join(dirpath, filename)))
+    return entries
+
+
+class _StreamReader:
+    """只依赖 read(n) 的顺序读取器，支持把多读的数据退回"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self._buffer = b''
+
+    def read(self, size: int) -> bytes:
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        while len(data) < size:
+            chunk = self.fileobj.read(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def read_exact(self, size: int) -> bytes:
+        data = self.read(size)
+        if len(data) != size:
+            raise ValueError("Truncated package")
+        return data
+
+    def unread(self, data: bytes):
+        self._buffer = data + self._buffer
+
+
+def _decompressor(method: int):
+    if method == COMPRESSION_METHODS['deflated']:
+        return zlib.decompressobj(-15)
+    if method == COMPRESSION_METHODS['zstd']:
+        return _zstd().ZstdDecompressor().decompressobj()
+    raise ValueError(f"Unsupported compression method: {method}")
+
+
+def _decompress(payload: bytes, method: int) -> bytes:
+    if method == COMPRESSION_METHODS['stored']:
+        return payload
+    if method == COMPRESSION_METHODS['deflated']:
+        return zlib.decompress(payload, -15)
+    if method == COMPRESSION_METHODS['zstd']:
+        return _zstd().ZstdDecompressor().decompressobj().decompress(payload)
+    raise ValueError(f"Unsupported compression method: {method}")
+
+
+def _read_signature(reader: _StreamReader) -> int:
+    return struct.unpack('<I', reader.read_exact(4))[0]
+
+
+def _read_directory(reader: _StreamReader, signature: int) -> int:
+    """顺序读过中央目录与结尾记录，返回条目数（与结尾记录中的条目数不一致时报错）"""
+    count = 0
+    while signature == _CENTRAL_SIG:
+        fields = _CENTRAL_HEADER.unpack(struct.pack('<I', signature) + reader.read_exact(_CENTRAL_HEADER.size - 4))
+        # 跳过文件名、扩展字段与注释
+        reader.read_exact(fields[10] + fields[11] + fields[12])
+        count += 1
+        signature = _read_signature(reader)
+
+    total = None
+    if signature == _ZIP64_END_SIG:
+        record = _ZIP64_END_RECORD.unpack(struct.pack('<I', signature) + reader.read_exact(_ZIP64_END_RECORD.size - 4))
+        reader.read_exact(record[1] - (_ZIP64_END_RECORD.size - 12))
+        total = record[7]
+        if _read_signature(reader) != _ZIP64_LOCATOR_SIG:
+            raise ValueError("Invalid package: missing ZIP64 locator")
+        reader.read_exact(_ZIP64_LOCATOR.size - 4)
+        signature = _read_signature(reader)
+    if signature != _END_SIG:
+        raise ValueError("Invalid package: missing end of central directory")
+    record = _END_RECORD.unpack(struct.pack('<I', signature) + reader.read_exact(_END_RECORD.size - 4))
+    if total is None:
+        total = record[4]
+    if total != count:
+        raise ValueError("Invalid package: central directory entry count mismatch")
+    return count
+
+
+def iter_package(fileobj) -> Iterator[Tuple[str, bytes]]:
+    """顺序解析本地文件头，逐个产出 (包内路径, 内容)；目录条目的内容为 b''
+
+    中央目录在全部条目之后顺序读过，无需 seek，因此可直接从管道或套接字读取，无需先落盘。
+    流在中央目录之前结束时抛出 "Truncated package"，遇到无法识别的签名或中央目录的条目数
+    与已读条目数不一致时抛出 "Invalid package"，截断或损坏的包不会被当作完整的包导入。
+    """
+    reader = _StreamReader(fileobj)
+    entries = 0
+    while True:
+        signature = _read_signature(reader)
+        if signature != _LOCAL_SIG:
+            if signature not in (_CENTRAL_SIG, _ZIP64_END_SIG, _END_SIG):
+                raise ValueError("Invalid package: unrecognized signature")
+            if _read_directory(reader, signature) != entries:
+                raise ValueError("Invalid package: entry count mismatch")
+            return
+        fields = _LOCAL_HEADER.unpack(struct.pack('<I', signature) + reader.read_exact(_LOCAL_HEADER.size - 4))
+        _, _, flags, method, _, _, crc, csize, size, name_len, extra_len = fields
+        name_bytes = reader.read_exact(name_len)
+        name = name_bytes.decode('utf-8' if flags & _UTF8_FLAG else 'cp437')
+        extra = reader.read_exact(extra_len)
+        if csize == _ZIP32_LIMIT or size == _ZIP32_LIMIT:
+            size, csize = _zip64_sizes(extra, size, csize)
+
+        if flags & _DESCRIPTOR_FLAG and csize == 0:
+            # 大小写在数据之后（流式写入的第三方包），边解压边读取
+            if method == COMPRESSION_METHODS['stored']:
+                raise ValueError(f"Cannot stream stored entry without sizes: {name}")
+            data = _read_until_end(reader, _decompressor(method))
+            descriptor = reader.read_exact(4)
+            if struct.unpack('<I', descriptor)[0] != _DESCRIPTOR_SIG:
+                reader.unread(descriptor)
+            crc = _DATA_DESCRIPTOR.unpack(reader.read_exact(_DATA_DESCRIPTOR.size))[0]
+        else:
+            data = _decompress(reader.read_exact(csize), method)
+
+        if zlib.crc32(data) != crc:
+            raise ValueError(f"CRC mismatch in package entry: {name}")
+        entries += 1
+        yield name, data
+
+
+def _zip64_sizes(extra: bytes, size: int, csize: int) -> Tuple[int, int]:
+    position = 0
+    while position + 4 <= len(extra):
+        header_id, length = struct.unpack('<HH', extra[position:position + 4])
+        if header_id == 0x0001:
+            values = list(struct.unpack(f'<{length // 8}Q', extra[position + 4:position + 4 + length // 8 * 8]))
+            if size == _ZIP32_LIMIT:
+                size = values.pop(0)
+            if csize == _ZIP32_LIMIT:
+                csize = values.pop(0)
+            break
+        position += 4 + length
+    return size, csize
+
+
+def _read_until_end(reader: _StreamReader, decompressor) -> bytes:
+    parts = []
+    while not decompressor.eof:
+        chunk = reader.read(64 * 1024)
+        if not chunk:
+            raise ValueError("Truncated package")
+        parts.append(decompressor.decompress(chunk))
+    reader.unread(decompressor.unused_data)
+    return b''.join(parts)
+
+
+def _safe_relpath(name: str) -> Optional[PurePosixPath]:
+    """校验包内路径，拒绝绝对路径与 .. 等越出解压目录的路径（zip-slip）"""
+    path = PurePosixPath(name.replace('\\', '/'))
+    if path.is_absolute() or '..' in path.parts or (path.parts and ':' in path.parts[0]):
+        raise ValueError(f"Unsafe path in package: {name}")
+    return path if path.parts else None
+
+
+def extract_package(fileobj, dest_dir: Union[str, Path]) -> Path:
+    """流式解压包到 dest_dir，返回作品根目录
+
+    旧版包把全部条目放在单个顶层目录（作品名/）下；此时返回该目录，
+    使新旧两种布局都能直接导入。
+    """
+    dest_dir = Path(dest_dir)
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    for name, data in iter_package(fileobj):
+        relpath = _safe_relpath(name)
+        if relpath is None:
+            continue
+        target = dest_dir.joinpath(*relpath.parts)
+        if name.endswith('/'):
+            target.mkdir(parents=True, exist_ok=True)
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+
+    children = list(dest_dir.iterdir())
+    if not (dest_dir / 'manifest.json').exists() and len(children) == 1 and children[0].is_dir():
+        return children[0]
+    return dest_dir
+
+
+@contextmanager
+def open_package(package, mode: str):
+    """package 可以是路径或已打开的文件对象（后者不会被关闭）"""
+    if hasattr(package, 'read' if mode == 'rb' else 'write'):
+        yield package
+    else:
+        with open(package, mode) as f:
+            yield f
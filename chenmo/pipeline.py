@@ -0,0 +1,207 @@
+"""
+生成流水线模块
+world 模式的 LLM 生成 → validate_world_data 校验 → 批量写入存储：提示词按流读入并发生成，
+每个结果只解析校验一次，写入器把校验通过的实体成批提交，各阶段同时进行
+"""
+import asyncio
+import bisect
+import json
+import time
+from typing import Dict, Any, Iterable, List, Optional
+from .utils import validate_world_data
+
+
+# world 数据的 type 与存储实体类型的对应关系（作品级数据存入 novies）
+WORLD_ENTITY_TYPES = {'core': 'c', 'persona': 'p', 'tech': 't', 'work': 'novies'}
+
+
+class LatencyHistogram:
+    """对数分桶的延迟直方图（毫秒），内存占用与样本数无关"""
+
+    # 桶上界：从 0.1 ms 起按 2 倍增长（约到 100 s），最后一桶收纳更慢的样本
+    BOUNDS = [0.1 * 2 ** n for n in range(21)]
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        """记录一个样本（秒）"""
+        ms = seconds * 1000
+        self.buckets[bisect.bisect_left(self.BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, q: float) -> float:
+        """第 q 百分位的估计值（所在桶的上界，不超过最大样本）"""
+        if not self.count:
+            return 0.0
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if seen >= q / 100 * self.count:
+                return min(self.BOUNDS[index], self.max) if index < len(self.BOUNDS) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        """样本数、均值、百分位与非空桶计数"""
+        labels = [f"<={bound:g}ms" for bound in self.BOUNDS] + [f">{self.BOUNDS[-1]:g}ms"]
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p90_ms': self.percentile(90),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max,
+            'buckets': {label: n for label, n in zip(labels, self.buckets) if n},
+        }
+
+
+class WorldPipeline:
+    """把 world 模式的生成结果写入作品的流水线
+
+    prompts 可以是任意（包括无限的）迭代器：同时在途的生成请求不超过 concurrency；
+    校验通过的实体进入有界队列，写入器在后台线程中每次取出队列中已有的实体（至多 batch_size 个），
+    在一个批量会话中提交，写入期间生成继续进行。生成或校验失败、以及 merge 策略拒绝的实体
+    记入 failures，不影响其他实体。
+    """
+
+    def __init__(self, storage, llm, work_name: str, merge: str = "strict", batch_size: int = 64,
+                 concurrency: Optional[int] = None, cache: bool = True):
+        if llm.mode != 'world':
+            raise ValueError("WorldPipeline requires an LLMInterface in world mode")
+        self.storage = storage
+        self.llm = llm
+        self.work_name = work_name
+        self.merge = merge
+        self.batch_size = batch_size
+        self.concurrency = concurrency or llm.concurrency
+        self.cache = cache
+        self.stages = {stage: LatencyHistogram() for stage in ('generate', 'validate', 'save')}
+        self.failures = []
+        self.saved = 0
+        self.batches = 0
+
+    def run(self, prompts: Iterable[str]) -> Dict[str, Any]:
+        """arun 的同步入口"""
+        return asyncio.run(self.arun(prompts))
+
+    async def arun(self, prompts: Iterable[str]) -> Dict[str, Any]:
+        """处理全部提示词，返回吞吐量与各阶段延迟统计"""
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        queue = asyncio.Queue(maxsize=self.batch_size * 2)
+        writer = asyncio.ensure_future(self._write_loop(queue))
+        tasks = set()
+        count = 0
+        try:
+            for prompt in prompts:
+                # 在途请求达到上限时先等待，提示词流不会被一次性读完
+                await semaphore.acquire()
+                if writer.done():
+                    break
+                task = asyncio.ensure_future(self._produce(prompt, semaphore, queue))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                count += 1
+            # 写入器出错时不再等待被队列阻塞的生成任务，直接抛出其异常
+            generated = asyncio.gather(*tasks)
+            await asyncio.wait({generated, writer}, return_when=asyncio.FIRST_COMPLETED)
+            if writer.done():
+                writer.result()
+            await generated
+            await queue.put(None)
+            await writer
+        finally:
+            writer.cancel()
+            for task in tasks:
+                task.cancel()
+
+        elapsed = time.perf_counter() - started
+        return {
+            'prompts': count,
+            'entities': self.saved,
+            'failed': len(self.failures),
+            'batches': self.batches,
+            'seconds': elapsed,
+            'entities_per_sec': self.saved / elapsed if elapsed > 0 else float('inf'),
+            'stages': {stage: histogram.to_dict() for stage, histogram in self.stages.items()},
+            'failures': self.failures,
+        }
+
+    async def _produce(self, prompt: str, semaphore: asyncio.Semaphore, queue: asyncio.Queue):
+        try:
+            started = time.perf_counter()
+            try:
+                content = await self.llm.agenerate(prompt, cache=self.cache)
+            except Exception as e:
+                self.failures.append({'prompt': prompt, 'stage': 'generate', 'error': str(e)})
+                return
+            finally:
+                self.stages['generate'].record(time.perf_counter() - started)
+        finally:
+            semaphore.release()
+
+        started = time.perf_counter()
+        data, error = self._validate(content)
+        self.stages['validate'].record(time.perf_counter() - started)
+        if error:
+            self.failures.append({'prompt': prompt, 'stage': 'validate', 'error': error})
+            return
+        await queue.put((prompt, data))
+
+    def _validate(self, content: str):
+        """解析并校验一次，返回 (数据, 错误信息)"""
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError as e:
+            return None, f"Invalid JSON: {e.msg}"
+        if not isinstance(data, dict) or not validate_world_data(data):
+            return None, "Invalid world data"
+        if not isinstance(data['name'], str) or not data['name']:
+            return None, f"Invalid entity name: {data['name']!r}"
+        return data, None
+
+    async def _write_loop(self, queue: asyncio.Queue):
+        done = False
+        while not done:
+            # 取出一个后把队列中已有的一并带走：写入越慢，批次越大
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            if batch:
+                started = time.perf_counter()
+                await asyncio.get_running_loop().run_in_executor(None, self._write_batch, batch)
+                self.stages['save'].record(time.perf_counter() - started)
+
+    def _write_batch(self, batch: List[tuple]):
+        """在一个批量会话中提交一批实体（作品不存在时随第一批创建）"""
+        engine = self.storage.engine
+        with engine.locks.lock(self.work_name), self.storage.batch():
+            if not engine.work_exists(self.work_name):
+                self.storage.create_work(self.work_name)
+            for prompt, data in batch:
+                try:
+                    self.storage.save_work_data(self.work_name, data['name'], WORLD_ENTITY_TYPES[data['type']],
+                                                data, self.merge)
+                except ValueError as e:
+                    self.failures.append({'prompt': prompt, 'stage': 'save', 'error': str(e)})
+                    continue
+                self.saved += 1
+        self.batches += 1
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """流水线报告的文本摘要：吞吐量与各阶段延迟"""
+    lines = [f"Generated {report['entities']} entities from {report['prompts']} prompts in {report['seconds']:.2f}s "
+             f"({report['entities_per_sec']:.1f} entities/sec, {report['batches']} batches, {report['failed']} failed)"]
+    for stage, stats in report['stages'].items():
+        lines.append(f"  {stage:<8} n={stats['count']:<6} mean={stats['mean_ms']:.2f}ms p50={stats['p50_ms']:.2f}ms "
+                     f"p90={stats['p90_ms']:.2f}ms p99={stats['p99_ms']:.2f}ms max={stats['max_ms']:.2f}ms")
+    return '\n'.join(lines)
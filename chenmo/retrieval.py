@@ -0,0 +1,47 @@
+"""
+检索模块
+为生成请求挑选作品中相关的已有实体：复用全文检索的 BM25 索引（随实体写入增量更新），
+按与提示词的相关度取前 k 个内核、人物与科技实体，在 token 预算内拼成上下文
+"""
+import json
+from typing import Any, List, Optional
+from .llm_interface import estimate_tokens
+
+
+# 参与检索的实体类型（cores/、personas/、tech/ 目录）
+CONTEXT_TYPES = ('c', 'p', 't')
+TYPE_LABELS = {'c': 'core', 'p': 'persona', 't': 'tech'}
+
+CONTEXT_HEADER = "以下是作品 {work} 中与本次请求相关的已有设定，生成的内容须与之保持一致："
+
+
+class ContextRetriever:
+    """作品上下文检索器
+
+    retrieve() 返回与查询最相关的前 k 个实体；context() 按相关度依次加入实体的紧凑 JSON，
+    放不进 token_budget 的跳过，返回可直接作为系统消息的文本（没有相关实体时为空字符串）。
+    """
+
+    def __init__(self, engine, work_name: str, k: int = 5, token_budget: int = 1024):
+        self.engine = engine
+        self.work_name = work_name
+        self.k = k
+        self.token_budget = token_budget
+
+    def retrieve(self, query: str, k: Optional[int] = None) -> List[Any]:
+        """与查询最相关的前 k 个实体（轻量结果，数据按需加载）"""
+        return self.engine.search_content(query, work_filter=self.work_name, type_filter=CONTEXT_TYPES,
+                                          limit=k or self.k)
+
+    def context(self, query: str) -> str:
+        """token 预算内的相关实体上下文"""
+        header = CONTEXT_HEADER.format(work=self.work_name)
+        budget = self.token_budget - estimate_tokens(header)
+        lines = []
+        for hit in self.retrieve(query):
+            line = f"[{TYPE_LABELS[hit.type]}] {hit.name}: {json.dumps(hit.data, ensure_ascii=False, separators=(',', ':'))}"
+            cost = estimate_tokens(line)
+            if cost <= budget:
+                lines.append(line)
+                budget -= cost
+        return '\n'.join([header] + lines) if lines else ''
@@ -0,0 +1,413 @@
+"""
+规则模块
+run(when=...) 条件的表达式语言：条件只编译一次，规则按所依赖的事实建立索引，
+事实变化时只重新求值受影响的规则
+"""
+import ast
+import copy
+import operator
+import sys
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Callable, Iterable, Set, Tuple
+from .backends import ENTITY_TYPE_DIRS, entity_dir_name
+
+
+# 条件中可引用的实体类型前缀：p.spider.o2_level、c.pandora.axioms 等
+ENTITY_ROOTS = tuple(ENTITY_TYPE_DIRS)
+
+# 事实变化：(实体目录, 实体名)、('state', 累计状态键路径) 或 ('event', 事件名)
+Change = Tuple[str, str]
+
+_COMPARE = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne,
+    ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b, ast.NotIn: lambda a, b: a not in b,
+    ast.Is: operator.is_, ast.IsNot: operator.is_not,
+}
+_BINARY = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod,
+}
+_UNARY = {ast.Not: operator.not_, ast.USub: operator.neg, ast.UAdd: operator.pos}
+_BUILTINS = {'len': len, 'abs': abs, 'min': min, 'max': max}
+
+_MISSING = object()
+
+
+def apply_outcome(state: Dict[str, Any], outcome: Dict[str, Any]) -> List[str]:
+    """把事件的 outcome 叠加到累计状态上，返回发生变化的键路径
+
+    键以 . 表示嵌套（"spider.physiology"）；以 + / - 开头的字符串值表示向列表
+    加入 / 移除一项（"+native_respiration"），其余值直接覆盖。
+    """
+    changed = []
+    for key, value in outcome.items():
+        path = key.split('.')
+        node = state
+        for part in path[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                child = node[part] = {}
+            node = child
+        leaf = path[-1]
+        if isinstance(value, str) and len(value) > 1 and value[0] in '+-':
+            items = node.get(leaf)
+            items = [] if items is None else (list(items) if isinstance(items, list) else [items])
+            item = value[1:]
+            if value[0] == '+' and item not in items:
+                items.append(item)
+            elif value[0] == '-' and item in items:
+                items.remove(item)
+            value = items
+        if node.get(leaf, _MISSING) != value:
+            node[leaf] = value
+            changed.append(key)
+    return changed
+
+
+class WorldState:
+    """条件求值所依据的事实：作品中的实体、事件 outcome 的累计状态与已发生的事件
+
+    实体由 loader(类型, 名称) 按需加载并缓存；events 为可迭代的事件记录，
+    首次访问累计状态或事件计数时才读取。state 与 counts 为已知的起点
+    （如检查点中保存的状态），events 在其基础上叠加。
+    """
+
+    def __init__(self, loader: Optional[Callable[[str, str], Optional[Dict[str, Any]]]] = None,
+                 events: Optional[Iterable[Dict[str, Any]]] = None,
+                 state: Optional[Dict[str, Any]] = None, counts: Optional[Dict[str, int]] = None):
+        self._loader = loader
+        self._entities = {}
+        self._events = events
+        self._initial = (state, counts)
+        self._state = None
+        self._counts = None
+
+    def _replay(self):
+        state, counts = self._initial
+        self._state, self._counts = copy.deepcopy(state or {}), Counter(counts or {})
+        for record in self._events or ():
+            self.apply(record)
+
+    @property
+    def counts(self) -> Counter:
+        """各事件已发生的次数"""
+        if self._counts is None:
+            self._replay()
+        return self._counts
+
+    @property
+    def state(self) -> Dict[str, Any]:
+        """事件 outcome 叠加而成的累计状态"""
+        if self._state is None:
+            self._replay()
+        return self._state
+
+    def event_count(self, event: str) -> int:
+        """事件已发生的次数"""
+        if self._counts is None:
+            self._replay()
+        return self._counts[event]
+
+    def entity(self, entity_type: str, name: str) -> Optional[Dict[str, Any]]:
+        """实体数据（不存在时为 None）"""
+        key = (entity_dir_name(entity_type), name)
+        if key not in self._entities:
+            self._entities[key] = self._loader(entity_type, name) if self._loader else None
+        return self._entities[key]
+
+    def put_entity(self, entity_type: str, name: str, data: Optional[Dict[str, Any]]) -> List[Change]:
+        """更新实体事实，返回变化"""
+        key = (entity_dir_name(entity_type), name)
+        self._entities[key] = data
+        return [key]
+
+    def apply(self, record: Dict[str, Any]) -> List[Change]:
+        """应用一条事件记录（event 与 outcome），返回变化"""
+        if self._state is None:
+            # 先读完历史事件，再叠加新事件
+            self._replay()
+        changes = []
+        event = record.get('event')
+        if event:
+            self._counts[event] += 1
+            changes.append(('event', event))
+        changes.extend(('state', key) for key in apply_outcome(self._state, record.get('outcome') or {}))
+        return changes
+
+
+class Condition:
+    """编译后的条件：可对 WorldState 直接求值，deps 为条件依赖的事实"""
+
+    def __init__(self, source: str, evaluate: Callable[[WorldState], Any], deps: Set[Change]):
+        self.source = source
+        self._evaluate = evaluate
+        self.deps = frozenset(deps)
+
+    def __call__(self, world: WorldState) -> bool:
+        """求值；缺失字段为 None，与 None 比较等类型错误视为条件不成立"""
+        try:
+            return bool(self._evaluate(world))
+        except (TypeError, ZeroDivisionError):
+            return False
+
+    def __repr__(self):
+        return f"Condition({self.source!r})"
+
+
+def _lookup(value: Any, key: Any) -> Any:
+    if isinstance(value, dict):
+        return value.get(key)
+    if isinstance(value, (list, tuple, str)) and isinstance(key, int):
+        return value[key] if -len(value) <= key < len(value) else None
+    return None
+
+
+class _Compiler:
+    """把条件的 AST 编译为闭包，同时收集依赖的事实"""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.deps = set()
+
+    def error(self, node: ast.AST, message: str) -> ValueError:
+        return ValueError(f"Invalid condition {self.source!r}: {message}")
+
+    def compile(self, node: ast.AST) -> Callable[[WorldState], Any]:
+        if isinstance(node, ast.Constant):
+            value = node.value
+            return lambda world: value
+        if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            items = [self.compile(item) for item in node.elts]
+            build = {ast.List: list, ast.Tuple: tuple, ast.Set: set}[type(node)]
+            return lambda world: build(item(world) for item in items)
+        if isinstance(node, ast.BoolOp):
+            values = [self.compile(value) for value in node.values]
+            if isinstance(node.op, ast.And):
+                return lambda world: all(value(world) for value in values)
+            return lambda world: any(value(world) for value in values)
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY:
+            op, operand = _UNARY[type(node.op)], self.compile(node.operand)
+            return lambda world: op(operand(world))
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+            op, left, right = _BINARY[type(node.op)], self.compile(node.left), self.compile(node.right)
+            return lambda world: op(left(world), right(world))
+        if isinstance(node, ast.Compare):
+            return self._compare(node)
+        if isinstance(node, ast.Call):
+            return self._call(node)
+        if isinstance(node, (ast.Name, ast.Attribute, ast.Subscript)):
+            return self._path(node)
+        raise self.error(node, f"unsupported syntax {type(node).__name__}")
+
+    def _compare(self, node: ast.Compare) -> Callable[[WorldState], Any]:
+        left = self.compile(node.left)
+        steps = []
+        for op, comparator in zip(node.ops, node.comparators):
+            if type(op) not in _COMPARE:
+                raise self.error(node, f"unsupported operator {type(op).__name__}")
+            steps.append((_COMPARE[type(op)], self.compile(comparator)))
+
+        def compare(world):
+            value = left(world)
+            for op, right in steps:
+                other = right(world)
+                if not op(value, other):
+                    return False
+                value = other
+            return True
+        return compare
+
+    def _call(self, node: ast.Call) -> Callable[[WorldState], Any]:
+        if not isinstance(node.func, ast.Name) or node.keywords:
+            raise self.error(node, "only happened(), count(), len(), abs(), min() and max() can be called")
+        name = node.func.id
+        args = [self.compile(arg) for arg in node.args]
+        if name in ('happened', 'count'):
+            if len(node.args) != 1:
+                raise self.error(node, f"{name}() takes one event name")
+            event = node.args[0]
+            self.deps.add(('event', event.value if isinstance(event, ast.Constant) else '*'))
+            if name == 'happened':
+                return lambda world: world.event_count(args[0](world)) > 0
+            return lambda world: world.event_count(args[0](world))
+        if name in _BUILTINS:
+            function = _BUILTINS[name]
+            return lambda world: function(*(arg(world) for arg in args))
+        raise self.error(node, f"unknown function {name}()")
+
+    def _path(self, node: ast.AST) -> Callable[[WorldState], Any]:
+        # 把 a.b[c].d 拆成根名称与访问链
+        accessors = []
+        while not isinstance(node, ast.Name):
+            if isinstance(node, ast.Attribute):
+                accessors.append(('const', node.attr))
+                node = node.value
+            elif isinstance(node, ast.Subscript):
+                key = node.slice
+                if sys.version_info < (3, 9) and isinstance(key, ast.Index):
+                    # Python 3.8 的下标包在 ast.Index 中
+                    key = key.value
+                accessors.append(('const', key.value) if isinstance(key, ast.Constant) else ('expr', self.compile(key)))
+                node = node.value
+            else:
+                raise self.error(node, f"unsupported syntax {type(node).__name__}")
+        accessors.reverse()
+        root = node.id
+
+        if root == 'state':
+            # 依赖精确到键路径中开头的常量部分
+            prefix = []
+            for kind, key in accessors:
+                if kind != 'const':
+                    break
+                prefix.append(str(key))
+            self.deps.add(('state', '.'.join(prefix)))
+            base = lambda world: world.state
+        elif root in ENTITY_ROOTS:
+            if not accessors or accessors[0][0] != 'const':
+                raise self.error(node, f"{root} must be followed by an entity name")
+            entity_name = accessors.pop(0)[1]
+            self.deps.add((entity_dir_name(root), entity_name))
+            base = lambda world: world.entity(root, entity_name)
+        else:
+            raise self.error(node, f"unknown name {root}")
+
+        def resolve(world):
+            value = base(world)
+            for kind, key in accessors:
+                if value is None:
+                    return None
+                value = _lookup(value, key if kind == 'const' else key(world))
+            return value
+        return resolve
+
+
+@lru_cache(maxsize=4096)
+def compile_condition(source: str) -> Condition:
+    """编译条件表达式（相同表达式只编译一次）
+
+    可引用 p/c/m/t/novies.<实体名>.<字段>、state.<键路径>，可调用
+    happened("事件")、count("事件") 以及 len/abs/min/max。
+    """
+    try:
+        tree = ast.parse(source.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid condition {source!r}: {e.msg}")
+    compiler = _Compiler(source)
+    return Condition(source, compiler.compile(tree.body), compiler.deps)
+
+
+def _overlaps(path: str, changed: str) -> bool:
+    # 一方是另一方的前缀（或相同）时，变化可能影响依赖
+    if not path or path == changed:
+        return True
+    shorter, longer = sorted((path, changed), key=len)
+    return longer.startswith(shorter + '.')
+
+
+class Rule:
+    """一条 when/then 规则"""
+
+    __slots__ = ('name', 'condition', 'then', 'outcome')
+
+    def __init__(self, name: str, condition: Condition, then: str, outcome: Dict[str, Any]):
+        self.name = name
+        self.condition = condition
+        self.then = then
+        self.outcome = outcome
+
+    def to_event(self, triggered_by: str) -> Dict[str, Any]:
+        """规则触发时写入事件日志的记录"""
+        return {"event": self.then, "outcome": self.outcome, "triggered_by": triggered_by, "rule": self.name}
+
+
+class RuleEngine:
+    """按依赖索引的规则集
+
+    每条规则登记到其条件依赖的事实下（实体、状态键路径、事件名）。notify()
+    传入事实变化后只把受影响的规则标记为待求值，evaluate() 只重新求值这些规则，
+    并返回条件由不成立变为成立的规则（边沿触发，同一规则不会在条件持续成立时反复触发）。
+    """
+
+    def __init__(self):
+        self.rules = {}
+        self._order = {}
+        self._index = defaultdict(set)
+        self._state_index = defaultdict(list)
+        self._truth = {}
+        self._dirty = set()
+        self.evaluations = 0
+
+    def add(self, when: str, then: str, outcome: Optional[Dict[str, Any]] = None, name: Optional[str] = None) -> Rule:
+        """登记规则；新规则在下一次 evaluate() 时求值"""
+        name = name or f"rule_{len(self.rules)}"
+        if name in self.rules:
+            raise ValueError(f"Rule already exists: {name}")
+        rule = Rule(name, compile_condition(when), then, outcome or {})
+        self.rules[name] = rule
+        self._order[name] = len(self._order)
+        for kind, key in rule.condition.deps:
+            if kind == 'state':
+                self._state_index[key.split('.', 1)[0] if key else '*'].append((name, key))
+            else:
+                self._index[(kind, key)].add(name)
+        self._dirty.add(name)
+        return rule
+
+    def remove(self, name: str):
+        """移除规则"""
+        rule = self.rules.pop(name)
+        del self._order[name]
+        for kind, key in rule.condition.deps:
+            if kind == 'state':
+                bucket = self._state_index[key.split('.', 1)[0] if key else '*']
+                bucket[:] = [entry for entry in bucket if entry[0] != name]
+            else:
+                self._index[(kind, key)].discard(name)
+        self._truth.pop(name, None)
+        self._dirty.discard(name)
+
+    def affected(self, changes: Iterable[Change]) -> Set[str]:
+        """受这些事实变化影响的规则名"""
+        names = set()
+        for kind, key in changes:
+            if kind == 'state':
+                for bucket in (key.split('.', 1)[0], '*'):
+                    names.update(name for name, path in self._state_index.get(bucket, ()) if _overlaps(path, key))
+                continue
+            names.update(self._index.get((kind, key), ()))
+            if kind == 'event':
+                names.update(self._index.get(('event', '*'), ()))
+        return names
+
+    def notify(self, changes: Iterable[Change]):
+        """记录事实变化，把受影响的规则标记为待求值"""
+        self._dirty.update(self.affected(changes))
+
+    def truth(self) -> Dict[str, bool]:
+        """各规则最近一次求值的结果（用于检查点）"""
+        return dict(self._truth)
+
+    def restore(self, truth: Dict[str, bool]):
+        """恢复检查点中的求值结果，并把全部规则标记为待求值"""
+        self._truth = {name: value for name, value in truth.items() if name in self.rules}
+        self._dirty = set(self.rules)
+
+    @property
+    def pending(self) -> bool:
+        """是否有待求值的规则"""
+        return bool(self._dirty)
+
+    def evaluate(self, world: WorldState) -> List[Rule]:
+        """求值待求值的规则，返回新近成立的规则（按登记顺序）"""
+        fired = []
+        dirty, self._dirty = self._dirty, set()
+        for name in sorted(dirty, key=self._order.__getitem__):
+            self.evaluations += 1
+            truth = self.rules[name].condition(world)
+            if truth and not self._truth.get(name):
+                fired.append(self.rules[name])
+            self._truth[name] = truth
+        return fired
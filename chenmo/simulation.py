@@ -0,0 +1,145 @@
+"""
+推演模块
+多步推演：世界状态常驻内存，逐步叠加事件 outcome，事件按批写入日志，定期保存检查点
+"""
+import time
+from typing import Dict, Any, List, Optional, Iterable
+from .rules import RuleEngine, WorldState
+
+
+# 推演检查点（作品级元数据文件）
+CHECKPOINT_FILE = 'simulation.json'
+
+
+class Simulation:
+    """作品的多步推演
+
+    每一步先应用外部注入的事件，再触发条件新近成立的规则；事件立即叠加到内存中的
+    世界状态并通知规则引擎，写入日志则按 flush_every 条成批进行。
+    checkpoint_every 步保存一次检查点（累计状态、事件计数、规则求值结果与规则定义），
+    resume() 从检查点继续，并重放检查点之后已写入日志的事件。
+    """
+
+    def __init__(self, engine, work_name: str, rules: Optional[Iterable[Dict[str, Any]]] = None,
+                 flush_every: int = 256, checkpoint_every: Optional[int] = None,
+                 triggered_by: Optional[str] = None):
+        if not engine.work_exists(work_name):
+            raise ValueError(f"Work {work_name} does not exist")
+        self.engine = engine
+        self.work_name = work_name
+        self.flush_every = flush_every
+        self.checkpoint_every = checkpoint_every
+        self.triggered_by = triggered_by or f"{work_name}.simulation"
+        self.rules = RuleEngine()
+        for spec in rules or ():
+            self.add_rule(**spec)
+
+        self.steps = 0
+        self.events = 0
+        self.last_seq = self.log.last_seq()
+        self.world = engine.snapshots(work_name).world(loader=self._load_entity)
+        self._buffer = []
+
+    @property
+    def log(self):
+        return self.engine.event_log(self.work_name)
+
+    def _load_entity(self, entity_type: str, name: str) -> Optional[Dict[str, Any]]:
+        return self.engine.load_entity(self.work_name, name, entity_type)
+
+    def add_rule(self, when: str, then: str, outcome: Optional[Dict[str, Any]] = None, name: Optional[str] = None):
+        """登记 when/then 规则"""
+        return self.rules.add(when, then, outcome, name)
+
+    def step(self, events: Iterable[Dict[str, Any]] = ()) -> List[Dict[str, Any]]:
+        """推进一步，返回本步发生的事件"""
+        self.steps += 1
+        records = [self._emit(dict(event, triggered_by=event.get('triggered_by', self.triggered_by)))
+                   for event in events]
+        for rule in self.rules.evaluate(self.world):
+            records.append(self._emit(rule.to_event(self.triggered_by)))
+
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+        if self.checkpoint_every and self.steps % self.checkpoint_every == 0:
+            self.checkpoint()
+        return records
+
+    def run(self, steps: int, events: Optional[Dict[int, List[Dict[str, Any]]]] = None) -> Dict[str, Any]:
+        """最多推进 steps 步；events 为 {步序号: [事件]} 形式的外部事件
+
+        没有待求值的规则且后续没有外部事件时提前结束。结束时写入全部事件并保存检查点。
+        """
+        events = events or {}
+        started = time.perf_counter()
+        start_step, start_events = self.steps, self.events
+        last_scripted = max(events, default=0)
+        quiescent = False
+        for _ in range(steps):
+            if not self.rules.pending and self.steps >= last_scripted:
+                quiescent = True
+                break
+            self.step(events.get(self.steps + 1, ()))
+        self.checkpoint()
+        elapsed = time.perf_counter() - started
+
+        done = self.steps - start_step
+        return {
+            'steps': done,
+            'events': self.events - start_events,
+            'seconds': elapsed,
+            'steps_per_sec': done / elapsed if elapsed > 0 else float('inf'),
+            'quiescent': quiescent,
+        }
+
+    def _emit(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        record = dict(event, step=self.steps)
+        self.rules.notify(self.world.apply(record))
+        self._buffer.append(record)
+        self.events += 1
+        return record
+
+    def flush(self):
+        """把缓冲的事件一次写入日志"""
+        if not self._buffer:
+            return
+        records = self.log.append_many(self._buffer)
+        self.last_seq = records[-1]['seq']
+        self._buffer = []
+        self.engine.snapshots(self.work_name).update()
+
+    def checkpoint(self):
+        """写入缓冲事件并保存检查点"""
+        self.flush()
+        self.engine.save_work_file(self.work_name, CHECKPOINT_FILE, {
+            'step': self.steps,
+            'last_seq': self.last_seq,
+            'state': self.world.state,
+            'counts': dict(self.world.counts),
+            'truth': self.rules.truth(),
+            'triggered_by': self.triggered_by,
+            'rules': [
+                {'name': rule.name, 'when': rule.condition.source, 'then': rule.then, 'outcome': rule.outcome}
+                for rule in self.rules.rules.values()
+            ],
+        })
+
+    @classmethod
+    def resume(cls, engine, work_name: str, rules: Optional[Iterable[Dict[str, Any]]] = None,
+               **kwargs) -> 'Simulation':
+        """从检查点继续推演；未给出 rules 时使用检查点中保存的规则"""
+        checkpoint = engine.load_work_file(work_name, CHECKPOINT_FILE)
+        if checkpoint is None:
+            raise ValueError(f"No simulation checkpoint for {work_name}")
+        kwargs.setdefault('triggered_by', checkpoint['triggered_by'])
+        simulation = cls(engine, work_name, rules if rules is not None else checkpoint['rules'], **kwargs)
+
+        # 检查点之后已写入日志的事件
+        tail = list(simulation.log.scan(after_seq=checkpoint['last_seq']))
+        simulation.world = WorldState(loader=simulation._load_entity, events=tail,
+                                      state=checkpoint['state'], counts=checkpoint['counts'])
+        truth = dict(checkpoint['truth'])
+        truth.update((record['rule'], True) for record in tail if 'rule' in record)
+        simulation.rules.restore(truth)
+        simulation.steps = max([checkpoint['step']] + [record.get('step', 0) for record in tail])
+        return simulation
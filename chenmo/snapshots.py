@@ -0,0 +1,112 @@
+"""
+快照模块
+事件日志的物化状态快照：每隔固定条数保存一次累计状态，
+按序号或时间查询状态时从最近的快照开始，只重放其后的事件
+"""
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Union
+from .rules import WorldState
+from .utils import atomic_write_json
+
+
+# 快照目录（位于作品的 events/ 下）
+SNAPSHOT_DIR = 'snapshots'
+SNAPSHOT_PREFIX = 'state_'
+
+# 每隔多少条事件保存一次快照
+SNAPSHOT_INTERVAL = 1024
+
+
+def parse_at(at: Union[int, float, str]) -> Dict[str, Any]:
+    """把 at 解析为查询条件：整数为事件序号，浮点数为 Unix 时间戳，字符串为 ISO 时间"""
+    if isinstance(at, bool):
+        raise ValueError(f"Invalid time point: {at!r}")
+    if isinstance(at, int):
+        return {'seq': at}
+    if isinstance(at, float):
+        return {'ts': at}
+    if isinstance(at, str):
+        try:
+            return {'ts': datetime.fromisoformat(at).timestamp()}
+        except ValueError:
+            raise ValueError(f"Invalid time point: {at!r}")
+    raise ValueError(f"Invalid time point: {at!r}")
+
+
+class StateSnapshots:
+    """作品事件日志的状态快照
+
+    快照为 events/snapshots/state_<序号>.json，记录该序号处的累计状态、事件计数与时间戳。
+    state_at() 找到不晚于查询点的最近快照，借助分段索引直接定位到其后的事件重放，
+    并顺带补存途经的快照，因此查询代价只与快照间隔有关，与历史长度无关。
+    """
+
+    def __init__(self, event_log, interval: Optional[int] = None):
+        self.event_log = event_log
+        self.snapshot_dir = Path(event_log.events_dir) / SNAPSHOT_DIR
+        self.interval = interval or SNAPSHOT_INTERVAL
+
+    def _seqs(self) -> List[int]:
+        if not self.snapshot_dir.exists():
+            return []
+        return sorted(int(path.stem[len(SNAPSHOT_PREFIX):]) for path in self.snapshot_dir.glob(f'{SNAPSHOT_PREFIX}*.json'))
+
+    def _path(self, seq: int) -> Path:
+        return self.snapshot_dir / f'{SNAPSHOT_PREFIX}{seq:012d}.json'
+
+    def _load(self, seq: int) -> Dict[str, Any]:
+        with open(self._path(seq), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _nearest(self, seq: Optional[int] = None, ts: Optional[float] = None) -> Dict[str, Any]:
+        """不晚于查询点的最近快照（没有时为空状态）"""
+        seqs = self._seqs()
+        if seq is not None:
+            seqs = [snapshot_seq for snapshot_seq in seqs if snapshot_seq <= seq]
+        if ts is not None:
+            # 快照时间随序号单调，二分查找
+            low, high = 0, len(seqs)
+            while low < high:
+                middle = (low + high) // 2
+                if self._load(seqs[middle])['ts'] <= ts:
+                    low = middle + 1
+                else:
+                    high = middle
+            seqs = seqs[:low]
+        if not seqs:
+            return {'seq': 0, 'ts': None, 'state': {}, 'counts': {}}
+        return self._load(seqs[-1])
+
+    def state_at(self, seq: Optional[int] = None, ts: Optional[float] = None) -> Dict[str, Any]:
+        """第 seq 条事件之后（或 ts 时刻）的累计状态与事件计数，缺省为最新状态"""
+        base = self._nearest(seq, ts)
+        world = WorldState(state=base['state'], counts=base['counts'])
+        last_seq, last_ts = base['seq'], base['ts']
+        for record in self.event_log.scan(after_seq=last_seq, until=ts):
+            if seq is not None and record['seq'] > seq:
+                break
+            world.apply(record)
+            last_seq, last_ts = record['seq'], record['ts']
+            if last_seq % self.interval == 0 and not self._path(last_seq).exists():
+                self._save(last_seq, last_ts, world)
+        return {'seq': last_seq, 'ts': last_ts, 'state': world.state, 'counts': dict(world.counts)}
+
+    def _save(self, seq: int, ts: float, world: WorldState):
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        atomic_write_json(self._path(seq), {'seq': seq, 'ts': ts, 'state': world.state, 'counts': dict(world.counts)},
+                          fsync=False)
+
+    def update(self):
+        """日志越过快照间隔时补存快照（由写入事件的操作调用）"""
+        seqs = self._seqs()
+        latest = seqs[-1] if seqs else 0
+        if self.event_log.last_seq() // self.interval > latest // self.interval:
+            self.state_at()
+
+    def world(self, loader=None) -> WorldState:
+        """以最新快照为起点的 WorldState，其后的事件在首次访问状态时重放"""
+        base = self._nearest()
+        return WorldState(loader=loader, events=self.event_log.scan(after_seq=base['seq']),
+                          state=base['state'], counts=base['counts'])
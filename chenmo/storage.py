@@ -4,10 +4,74 @@
 """
 import json
 import os
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 import shutil
-import zipfile
+import tempfile
+import threading
+from .backends import entity_dir_name
+from .utils import data_version
+
+
+class BatchSession:
+    """批量写入会话
+    
+    会话期间的作品创建与实体写入只在内存中缓冲，正常退出时一次性提交，
+    出现异常则全部丢弃。嵌套会话并入最外层会话。会话只收纳开启它的线程中的写入。
+    """
+    
+    def __init__(self, storage: 'StorageManager'):
+        self.storage = storage
+        self.works = {}
+        self.entities = OrderedDict()
+        self._outer = None
+    
+    def __enter__(self):
+        if self.storage._batch is not None:
+            self._outer = self.storage._batch
+            return self._outer
+        self.storage._batch = self
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if self._outer is not None:
+            return False
+        self.storage._batch = None
+        if exc_type is None:
+            self.commit()
+        return False
+    
+    def create_work(self, work_name: str):
+        """登记新作品"""
+        engine = self.storage.engine
+        if work_name in self.works or engine.work_exists(work_name):
+            raise ValueError(f"Namespace collision: {work_name} already exists")
+        self.works[work_name] = engine.new_manifest(work_name)
+    
+    def put(self, work_name: str, sub_name: str, entity_type: str, data: Dict[str, Any]):
+        """缓冲一次实体写入"""
+        key = (work_name, entity_dir_name(entity_type), sub_name)
+        self.entities.pop(key, None)
+        self.entities[key] = (entity_type, data)
+    
+    def get(self, work_name: str, sub_name: str, entity_type: str) -> Optional[Dict[str, Any]]:
+        """读取会话中尚未提交的实体"""
+        entry = self.entities.get((work_name, entity_dir_name(entity_type), sub_name))
+        return entry[1] if entry else None
+    
+    def commit(self) -> List[Any]:
+        """一次性提交全部缓冲的写入"""
+        entities = [
+            (work_name, entity_type, sub_name, data)
+            for (work_name, _, sub_name), (entity_type, data) in self.entities.items()
+        ]
+        if not self.works and not entities:
+            return []
+        locations = self.storage.engine.save_batch(self.works, entities)
+        self.works = {}
+        self.entities = OrderedDict()
+        return locations
 
 
 class StorageManager:
@@ -15,57 +79,74 @@ class StorageManager:
     
     def __init__(self):
         self.engine = None  # 会在初始化时设置
+        self._local = threading.local()
+    
+    @property
+    def _batch(self) -> Optional[BatchSession]:
+        # 当前线程的批量会话：其他线程的写入不会被并入（或随之回滚）
+        return getattr(self._local, 'batch', None)
+    
+    @_batch.setter
+    def _batch(self, session: Optional[BatchSession]):
+        self._local.batch = session
     
     def initialize_with_engine(self, engine):
         """使用引擎初始化"""
         self.engine = engine
     
-    def save_work_data(self, work_name: str, sub_name: str, entity_type: str, data: Dict[str, Any], merge_strategy: str = "strict"):
-        """保存作品数据"""
+    def batch(self) -> BatchSession:
+        """批量写入会话：with storage.batch(): ... 退出时一次性提交，出错则全部回滚"""
         if not self.engine:
             from .core import ChenmoEngine
             self.engine = ChenmoEngine()
         
-        work_path = self.engine.get_work_path(work_name)
-        
-        # 确定保存目录
-        if entity_type == 'c':  # core
-            target_dir = work_path / 'cores'
-        elif entity_type == 'p':  # persona
-            target_dir = work_path / 'personas'
-        elif entity_type == 't':  # tech
-            target_dir = work_path / 'tech'
-        elif entity_type == 'novies':  # novies
-            target_dir = work_path / 'novies'
-        else:
-            target_dir = work_path / 'novies'  # 默认
-        
-        target_dir.mkdir(exist_ok=True)
-        
-        # 检查目标文件是否存在
-        file_path = target_dir / f"{sub_name}.json"
-        if file_path.exists() and merge_strategy != "overlay":
-            if merge_strategy == "strict":
-                raise ValueError(f"File exists: {file_path}")
-            elif merge_strategy == "patch":
-                # 加载现有数据并合并
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-                
-                # 递归合并字典
-                merged_data = self._recursive_merge(existing_data, data)
-                
-                # 保存合并后的数据
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(merged_data, f, ensure_ascii=False, indent=2)
-                
-                return file_path
+        return BatchSession(self)
+    
+    def create_work(self, work_name: str):
+        """创建作品（处于批量会话中时随会话一起提交）"""
+        if self._batch is not None:
+            self._batch.create_work(work_name)
+            return self.engine.get_work_path(work_name)
+        return self.engine.create_work_structure(work_name)
+    
+    def save_work_data(self, work_name: str, sub_name: str, entity_type: str, data: Dict[str, Any], merge_strategy: str = "strict",
+                       expected_version: Optional[str] = None):
+        """保存作品数据
         
-        # 直接保存数据
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        expected_version 为 engine.entity_version() 读到的版本号时启用乐观并发检查：
+        实体在此期间已被其他写入者修改则抛出 ValueError。
+        """
+        if not self.engine:
+            from .core import ChenmoEngine
+            self.engine = ChenmoEngine()
         
-        return file_path
+        # 持有作品锁完成“读取-合并-写入”，多进程并发 patch 不会丢失更新
+        with self.engine.locks.lock(work_name):
+            # 检查目标实体是否存在（包括批量会话中尚未提交的写入）
+            pending = self._batch.get(work_name, sub_name, entity_type) if self._batch is not None else None
+            
+            if expected_version is not None:
+                current = pending if pending is not None else self.engine.load_entity(work_name, sub_name, entity_type)
+                if data_version(current) != expected_version:
+                    raise ValueError(f"Version conflict: {work_name}.{sub_name} (type: {entity_type}) was modified concurrently")
+            
+            exists = pending is not None or self.engine.backend.exists(work_name, entity_type, sub_name)
+            if exists and merge_strategy != "overlay":
+                if merge_strategy == "strict":
+                    raise ValueError(f"File exists: {work_name}.{sub_name} (type: {entity_type})")
+                elif merge_strategy == "patch":
+                    # 加载现有数据并合并
+                    existing_data = pending if pending is not None else self.engine.load_entity(work_name, sub_name, entity_type)
+                    
+                    # 递归合并字典
+                    data = self._recursive_merge(existing_data, data)
+            
+            if self._batch is not None:
+                self._batch.put(work_name, sub_name, entity_type, data)
+                return self.engine.backend.location(work_name, entity_dir_name(entity_type), sub_name)
+            
+            # 直接保存数据（经由引擎写入，同步更新缓存与索引）
+            return self.engine.save_entity(work_name, sub_name, entity_type, data)
     
     def _recursive_merge(self, base: dict, update: dict) -> dict:
         """递归合并字典"""
@@ -87,46 +168,80 @@ class StorageManager:
         
         return self.engine.load_entity(work_name, sub_name, entity_type)
     
-    def export_work_as_package(self, work_name: str, package_path: str) -> bool:
-        """导出作品为包文件(.narr)"""
+    def export_work_as_package(self, work_name: str, package_path, compression: str = "deflated",
+                               workers: Optional[int] = None) -> bool:
+        """导出作品为包文件(.narr)
+        
+        package_path 可以是路径或可写的文件对象（管道、套接字）；compression 为
+        stored（最快）、deflated 或 zstd（需安装 zstandard），条目在进程池中并行压缩。
+        """
         if not self.engine:
             from .core import ChenmoEngine
             self.engine = ChenmoEngine()
         
-        work_path = self.engine.get_work_path(work_name)
-        if not work_path.exists():
+        if not self.engine.work_exists(work_name):
             return False
         
-        # 创建临时目录用于打包
-        with zipfile.ZipFile(package_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(work_path):
-                for file in files:
-                    file_path = Path(root) / file
-                    arcname = file_path.relative_to(work_path.parent)
-                    zipf.write(file_path, arcname)
+        from .packaging import write_package, directory_entries, open_package
+        
+        # 其他后端先导出为目录布局再打包
+        with tempfile.TemporaryDirectory() as temp_dir:
+            if self.engine.backend.name == 'file':
+                work_path = self.engine.get_work_path(work_name)
+            else:
+                work_path = Path(temp_dir) / work_name
+                self.engine.export_work(work_name, work_path)
+            
+            with self.engine.locks.lock(work_name), open_package(package_path, 'wb') as f:
+                write_package(f, directory_entries(work_path), compression=compression, workers=workers)
         
         return True
     
-    def import_package(self, package_path: str, work_name: str) -> bool:
-        """导入包文件(.narr)"""
+    def import_package(self, package_path, work_name: str) -> bool:
+        """导入包文件(.narr)，package_path 可以是路径或可读的文件对象"""
         if not self.engine:
             from .core import ChenmoEngine
             self.engine = ChenmoEngine()
         
-        work_path = self.engine.get_work_path(work_name)
-        
-        # 检查是否已存在
-        if work_path.exists():
-            raise ValueError(f"Namespace collision: {work_name} already exists")
+        from .packaging import extract_package, open_package
         
-        # 解压包文件
-        with zipfile.ZipFile(package_path, 'r') as zipf:
-            zipf.extractall(work_path)
+        with self.engine.locks.lock(work_name):
+            # 检查是否已存在
+            if self.engine.work_exists(work_name):
+                raise ValueError(f"Namespace collision: {work_name} already exists")
+            
+            if self.engine.backend.name == 'file':
+                # 直接解压到作品目录旁的暂存目录，完成后整体改名就位，无需再复制
+                work_path = self.engine.get_work_path(work_name)
+                work_path.parent.mkdir(parents=True, exist_ok=True)
+                staging = Path(tempfile.mkdtemp(prefix=f".{work_path.name}.", dir=str(work_path.parent)))
+                try:
+                    with open_package(package_path, 'rb') as f:
+                        root = extract_package(f, staging)
+                    self._check_package_root(root)
+                    os.rename(root, work_path)
+                finally:
+                    shutil.rmtree(staging, ignore_errors=True)
+                self.engine.reindex_work(work_name)
+            else:
+                # 解压包文件后交由存储后端导入
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    with open_package(package_path, 'rb') as f:
+                        root = extract_package(f, temp_dir)
+                    self._check_package_root(root)
+                    self.engine.import_work(work_name, root)
         
         return True
     
+    def _check_package_root(self, root: Path):
+        """解压结果必须是完整的作品（条目数已由 iter_package 对照中央目录校验）"""
+        if not (root / 'manifest.json').is_file():
+            raise ValueError("Invalid package: missing manifest.json")
+    
     def validate_package(self, package_path: str) -> bool:
         """验证包文件完整性"""
+        import zipfile
+        
         try:
             with zipfile.ZipFile(package_path, 'r') as zipf:
                 # 检查必要文件
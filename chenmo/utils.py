@@ -4,14 +4,88 @@
 """
 import json
 import os
+import sys
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterable, Optional, Sequence, Union
 
 
-def print_content(content: str, to: Optional[str] = None, format: str = "narrative", merge: str = "strict"):
+# 世界数据的必需字段与合法类型
+WORLD_FIELDS = ['type', 'name', 'metadata', 'data']
+WORLD_TYPES = ['work', 'persona', 'core', 'tech']
+
+
+def fsync_dir(path: Union[str, Path]):
+    """fsync 目录，使其中的重命名/新建操作持久化"""
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        # 部分平台/文件系统不支持对目录 fsync
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path: Union[str, Path], content: Union[str, bytes], fsync: bool = True, dir_fsync: bool = False):
+    """原子写入：写入同目录下的临时文件（可选 fsync）后 os.replace 到目标路径
+    
+    并发读取者要么看到旧内容，要么看到完整的新内容，不会读到写了一半的文件。
+    """
+    import tempfile
+    
+    path = Path(path)
+    data = content.encode('utf-8') if isinstance(content, str) else content
+    fd, temp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix='.tmp', dir=str(path.parent))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.chmod(temp_name, 0o644)
+        os.replace(temp_name, path)
+    except BaseException:
+        try:
+            os.unlink(temp_name)
+        except FileNotFoundError:
+            pass
+        raise
+    
+    if dir_fsync:
+        fsync_dir(path.parent)
+
+
+def atomic_write_json(path: Union[str, Path], data: Any, fsync: bool = True, dir_fsync: bool = False):
+    """以原子方式写入格式化的 JSON"""
+    atomic_write(path, json.dumps(data, ensure_ascii=False, indent=2), fsync=fsync, dir_fsync=dir_fsync)
+
+
+def data_version(data: Optional[Dict[str, Any]]) -> Optional[str]:
+    """实体内容的版本号：规范化 JSON 的 SHA-1 前 16 位（None 表示实体不存在）"""
+    if data is None:
+        return None
+    import hashlib
+    
+    text = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def print_content(content: Union[str, Iterable[str]], to: Optional[str] = None, format: str = "narrative",
+                  merge: str = "strict"):
     """
     智能输出与更新接口
+    
+    content 也可以是文本块的迭代器（如 LLMInterface.stream() 的增量）：叙事格式边生成边写出，
+    世界格式增量解析，校验错误在生成途中即抛出。
     """
+    if not isinstance(content, str):
+        content = _consume_stream(content, to, format)
+        if content is None:
+            return
+    
     if format == "narrative":
         # 叙事格式：直接输出文本
         if to is None:
@@ -19,8 +93,7 @@ def print_content(content: str, to: Optional[str] = None, format: str = "narrati
             print(content)
         else:
             # 输出到文件
-            with open(to, 'w', encoding='utf-8') as f:
-                f.write(content)
+            atomic_write(to, content)
             print(f"Narrative content written to {to}")
     elif format == "world":
         # 世界构建格式：解析JSON并写入结构化文件
@@ -69,13 +142,11 @@ def print_content(content: str, to: Optional[str] = None, format: str = "narrati
                                 # 递归合并
                                 merged_data = _recursive_merge(existing_data, parsed_data)
                                 
-                                with open(output_file, 'w', encoding='utf-8') as f:
-                                    json.dump(merged_data, f, ensure_ascii=False, indent=2)
+                                atomic_write_json(output_file, merged_data)
                             else:
                                 raise ValueError(f"Unknown merge strategy: {merge}")
                         else:
-                            with open(output_file, 'w', encoding='utf-8') as f:
-                                json.dump(parsed_data, f, ensure_ascii=False, indent=2)
+                            atomic_write_json(output_file, parsed_data)
                     
                     else:
                         # 对于其他类型，根据entity_type确定目录
@@ -104,13 +175,11 @@ def print_content(content: str, to: Optional[str] = None, format: str = "narrati
                                 # 递归合并
                                 merged_data = _recursive_merge(existing_data, parsed_data)
                                 
-                                with open(output_file, 'w', encoding='utf-8') as f:
-                                    json.dump(merged_data, f, ensure_ascii=False, indent=2)
+                                atomic_write_json(output_file, merged_data)
                             else:
                                 raise ValueError(f"Unknown merge strategy: {merge}")
                         else:
-                            with open(output_file, 'w', encoding='utf-8') as f:
-                                json.dump(parsed_data, f, ensure_ascii=False, indent=2)
+                            atomic_write_json(output_file, parsed_data)
                 
                 else:
                     # 如果目标是具体文件
@@ -125,13 +194,11 @@ def print_content(content: str, to: Optional[str] = None, format: str = "narrati
                             # 递归合并
                             merged_data = _recursive_merge(existing_data, parsed_data)
                             
-                            with open(target_path, 'w', encoding='utf-8') as f:
-                                json.dump(merged_data, f, ensure_ascii=False, indent=2)
+                            atomic_write_json(target_path, merged_data)
                         else:
                             raise ValueError(f"Unknown merge strategy: {merge}")
                     else:
-                        with open(target_path, 'w', encoding='utf-8') as f:
-                            json.dump(parsed_data, f, ensure_ascii=False, indent=2)
+                        atomic_write_json(target_path, parsed_data)
                 
                 print(f"World data written to {target_path}")
         
@@ -139,6 +206,151 @@ def print_content(content: str, to: Optional[str] = None, format: str = "narrati
             raise ValueError("Content is not valid JSON for world format")
 
 
+def _consume_stream(chunks: Iterable[str], to: Optional[str], format: str) -> Optional[str]:
+    """消费流式内容：叙事格式直接写出（返回 None），其他格式返回拼接后的完整文本"""
+    try:
+        if format == "narrative":
+            if to is None:
+                for chunk in chunks:
+                    sys.stdout.write(chunk)
+                    sys.stdout.flush()
+                sys.stdout.write('\n')
+            else:
+                _stream_to_file(chunks, to)
+                print(f"Narrative content written to {to}")
+            return None
+        elif format == "world":
+            parser = WorldStreamParser()
+            for chunk in chunks:
+                parser.feed(chunk)
+            parser.close(required=['type', 'name'])
+            return parser.json
+        return ''.join(chunks)
+    finally:
+        # 提前出错时关闭上游生成器，使其释放连接
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def _stream_to_file(chunks: Iterable[str], to: str):
+    """边生成边写入同目录下的临时文件，完整生成后 os.replace 到目标路径；中途出错时目标保持原样"""
+    import tempfile
+    
+    path = Path(to)
+    fd, temp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix='.tmp', dir=str(path.parent))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_name, 0o644)
+        os.replace(temp_name, path)
+    except BaseException:
+        try:
+            os.unlink(temp_name)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _world_field_error(key: str, value: Any) -> Optional[str]:
+    """世界数据单个顶层字段的校验错误（合法时为 None）"""
+    if key == 'type' and value not in WORLD_TYPES:
+        return f"Invalid world type: {value!r}"
+    if key == 'metadata' and not (isinstance(value, dict) and 'description' in value):
+        return "World metadata requires a 'description' field"
+    return None
+
+
+class WorldStreamParser:
+    """世界格式 JSON 的增量解析器
+    
+    逐块 feed() 模型输出，跳过第一个 '{' 之前的内容（如 markdown 代码块标记）；
+    每个顶层字段一结束就解析并校验，出错时立即抛出 ValueError，不必等待整个回复生成完毕。
+    close() 检查对象是否完整及必需字段，返回解析结果。
+    """
+    
+    def __init__(self):
+        self.text = ''
+        self.fields = {}
+        self._pos = 0
+        self._start = None
+        self._end = None
+        self._member = None
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+    
+    @property
+    def json(self) -> Optional[str]:
+        """完整的顶层对象文本（尚未结束时为 None）"""
+        return self.text[self._start:self._end] if self._end is not None else None
+    
+    def feed(self, chunk: str):
+        """追加一块输出并校验其中已结束的顶层字段"""
+        self.text += chunk
+        text = self.text
+        index = self._pos
+        while index < len(text) and self._end is None:
+            char = text[index]
+            if self._start is None:
+                if char == '{':
+                    self._start = index
+                    self._member = index + 1
+                    self._stack.append('{')
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._stack.append(char)
+            elif char in '}]':
+                if self._stack.pop() != ('{' if char == '}' else '['):
+                    raise ValueError(f"Invalid JSON in world output: unexpected {char!r} at offset {index - self._start}")
+                if not self._stack:
+                    self._member_done(index)
+                    self._end = index + 1
+            elif char == ',' and len(self._stack) == 1:
+                self._member_done(index)
+                self._member = index + 1
+            index += 1
+        self._pos = index
+    
+    def _member_done(self, index: int):
+        member = self.text[self._member:index]
+        if not member.strip():
+            return
+        try:
+            parsed = json.loads('{' + member + '}')
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON in world output: {e.msg} at offset {self._member - self._start}")
+        for key, value in parsed.items():
+            error = _world_field_error(key, value)
+            if error:
+                raise ValueError(error)
+            self.fields[key] = value
+    
+    def close(self, required: Sequence[str] = WORLD_FIELDS) -> Dict[str, Any]:
+        """结束解析：对象必须完整且包含 required 中的字段"""
+        if self._end is None:
+            raise ValueError("World output ended before the JSON object was complete")
+        try:
+            data = json.loads(self.json)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON in world output: {e.msg}")
+        missing = [field for field in required if field not in data]
+        if missing:
+            raise ValueError(f"World output is missing required fields: {', '.join(missing)}")
+        return data
+
+
 def _recursive_merge(base: dict, update: dict) -> dict:
     """递归合并字典"""
     result = base.copy()
@@ -154,33 +366,28 @@ def _recursive_merge(base: dict, update: dict) -> dict:
 
 def validate_world_data(data: Dict[str, Any]) -> bool:
     """验证世界数据格式"""
-    required_fields = ['type', 'name', 'metadata', 'data']
-    
-    for field in required_fields:
+    for field in WORLD_FIELDS:
         if field not in data:
             return False
     
-    # 验证type字段的值
-    valid_types = ['work', 'persona', 'core', 'tech']
-    if data['type'] not in valid_types:
-        return False
-    
-    # 验证metadata必须包含description
-    if 'description' not in data['metadata']:
-        return False
-    
-    return True
+    # 验证type字段的值，metadata必须包含description
+    return not any(_world_field_error(key, data[key]) for key in ('type', 'metadata'))
 
 
-def clean_temp_files():
-    """清理临时文件"""
-    home_dir = Path.home() / '.chenmo'
-    temps_dir = home_dir / 'temps'
+def clean_temp_files(engine=None) -> int:
+    """清理临时作品（temps.*），返回删除的作品数
     
-    if temps_dir.exists():
-        import shutil
-        shutil.rmtree(temps_dir)
-        temps_dir.mkdir(parents=True, exist_ok=True)
+    经由引擎逐个删除，适用于任一存储后端，并同步更新搜索索引与实体缓存。
+    """
+    if engine is None:
+        from . import engine
+    removed = 0
+    for work_name in engine.list_works():
+        if work_name.startswith('temps.'):
+            with engine.locks.lock(work_name):
+                engine.delete_work(work_name)
+            removed += 1
+    return removed
 
 
 def list_all_works():
@@ -5,12 +5,14 @@ setup(
     version="2.5.0",
     packages=find_packages(),
     install_requires=[
-        "requests>=2.25.1",
-        "pyyaml>=6.0",
         "jsonschema>=4.0.0",
         "openai>=1.0.0",
         "ollama>=0.1.0",
     ],
+    extras_require={
+        "numpy": ["numpy>=1.20"],
+        "zstd": ["zstandard>=0.15"],
+    },
     entry_points={
         'console_scripts': [
             'cm=chenmo.cli:main',
@@ -4,6 +4,7 @@
 """
 from chenmo import d, l, i, c, p, m, t, r, x, s, llm, print, frm, inport
 import json
+import pytest
 
 
 def test_basic_operations():
@@ -124,6 +125,1180 @@ def test_cli_commands():
         print(f"CLI 测试出错: {e}")
 
 
+def _isolated_ops(home_dir, backend='file'):
+    """在独立的主目录下创建引擎与操作接口"""
+    from chenmo.core import ChenmoEngine
+    from chenmo.operations import Operations
+    return Operations(ChenmoEngine(home_dir=home_dir, backend=backend))
+
+
+def test_search_index(tmp_path):
+    ops = _isolated_ops(tmp_path)
+    ops.register('neural_frontier', log_person=["Kai"])
+    ops.persona_extract('neural_frontier', 'kai_persona', traits=["rebel_hacker"])
+    
+    results = ops.engine.search_entities('kai')
+    assert [(item['work'], item['name'], item['type']) for item in results] == [
+        ('neural_frontier', 'kai', 'p'), ('neural_frontier', 'kai_persona', 'p')
+    ]
+    assert ops.engine.index.lookup_token('hacker')[0]['name'] == 'kai_persona'
+    
+    # 查询由索引直接返回，不再打开实体文件
+    (ops.engine.works_dir / 'neural_frontier' / 'personas' / 'kai.json').unlink()
+    assert ops.engine.search_entities('kai', type_filter='p')[0]['data'] == {"description": "Kai"}
+    
+    # transmute 之后派生作品同样可搜索
+    ops.transmute('neural_frontier', toas='neural_frontier_2')
+    assert {item['work'] for item in ops.engine.search_entities('kai_persona')} == {
+        'neural_frontier', 'neural_frontier_2'
+    }
+
+
+def test_clean_temp_works(tmp_path):
+    from chenmo.utils import clean_temp_files
+    
+    # 两种后端下都经由引擎删除临时作品，搜索索引与缓存随之更新
+    for backend in ('file', 'sqlite'):
+        ops = _isolated_ops(tmp_path / backend, backend=backend)
+        ops.register('temps.cyber_noir', log_person=["Deckard"])
+        ops.register('blade_runner', log_person=["Deckard"])
+        assert ops.inspect('temps.cyber_noir', 'deckard', target='p') == {"description": "Deckard"}
+        assert clean_temp_files(ops.engine) == 1
+        assert [hit['work'] for hit in ops.engine.search_entities('deckard')] == ['blade_runner']
+        assert ops.engine.list_works() == ['blade_runner']
+        assert ops.engine.load_entity('temps.cyber_noir', 'deckard', 'p') is None
+
+
+def test_content_search(tmp_path):
+    ops = _isolated_ops(tmp_path)
+    ops.register('avatar', log_thing=["exo_pack"])
+    ops.persona_extract('avatar', 'spider', traits=["human_orphan", "潘多拉呼吸能力"])
+    ops.persona_extract('avatar', 'eywa', traits=["planetary_consciousness"], constraints=["protects_pandora"])
+    ops.core_extract('avatar', 'biosphere', axioms=["eywa_links_all_life", "呼吸需要面具"])
+    
+    hits = ops.search('呼吸能力', mode='content')
+    assert hits[0].name == 'spider'
+    assert hits[0].score >= hits[-1].score
+    assert 'traits' in hits[0].data
+    
+    hits = ops.search('avatar', 'c', 'eywa', mode='content')
+    assert [hit.name for hit in hits] == ['biosphere']
+    
+    page_one = ops.search('pandora eywa life', mode='content', limit=1)
+    page_two = ops.search('pandora eywa life', mode='content', limit=1, offset=1)
+    assert len(page_one) == len(page_two) == 1
+    assert page_one[0].name != page_two[0].name
+
+
+def test_iter_entities_streams_lazily(tmp_path):
+    ops = _isolated_ops(tmp_path)
+    ops.register('neural_frontier', log_person=["Kai", "Dr. Aris Thorne"])
+    
+    # 索引尚未构建时直接遍历目录
+    stream = ops.engine.iter_entities('kai', use_index=False)
+    first = next(stream)
+    assert (first.work, first.name, first.type) == ('neural_frontier', 'kai', 'p')
+    assert first._data is None
+    assert first.data == {"description": "Kai"}
+    
+    ops.engine.rebuild_index()
+    hits = list(ops.search('neural_frontier', 'p', 'dr.', stream=True))
+    assert [hit.name for hit in hits] == ['dr._aris_thorne']
+    assert hits[0]['data'] == {"description": "Dr. Aris Thorne"}
+
+
+def test_sqlite_backend(tmp_path):
+    from chenmo.backends import FileBackend, migrate_works
+    
+    ops = _isolated_ops(tmp_path, backend='sqlite')
+    ops.register('neural_frontier', log_works="Neural Frontier", log_person=["Kai"])
+    ops.persona_extract('neural_frontier', 'kai_persona', traits=["rebel_hacker"])
+    ops.mirror('neural_frontier', mp='kai_persona', r="redeemed", as_sub='kai_redeemed')
+    ops.transmute('neural_frontier', toas='neural_frontier_2', rcd="fork")
+    
+    # 实体只存在于数据库中，不产生逐实体文件
+    assert list((tmp_path / 'works').iterdir()) == []
+    assert ops.inspect('neural_frontier_2', 'kai_redeemed', target='m')['fate_variant'] == "redeemed"
+    assert ops.engine.load_work_file('neural_frontier_2', 'lineage.json')['original_source'] == 'neural_frontier'
+    assert [item['name'] for item in ops.search('neural_frontier_2', 'p', 'kai')] == [
+        'kai', 'kai_persona', 'kai_redeemed'
+    ]
+    
+    # 缓存版本戳是数据库中作品的写入计数器：与线程各自的连接无关，其他连接写入后各线程都能发现
+    import threading
+    from chenmo.backends import SQLiteBackend
+    def in_thread(function):
+        result = []
+        thread = threading.Thread(target=lambda: result.append(function()))
+        thread.start()
+        thread.join()
+        return result[0]
+    inspect_kai = lambda: ops.inspect('neural_frontier', 'kai_persona', target='p')['traits']
+    in_thread(lambda: ops.storage.save_work_data('neural_frontier', 'kai_persona', 'p', {"traits": ["rebel_hacker"]},
+                                                 merge_strategy='overlay'))
+    other = SQLiteBackend(ops.engine, ops.engine.backend.db_path)
+    other.save('neural_frontier', 'p', 'kai_persona', {"traits": ["corporate_agent"]})
+    other.close()
+    assert in_thread(inspect_kai) == ["corporate_agent"]
+    assert inspect_kai() == ["corporate_agent"]
+    ops.storage.save_work_data('neural_frontier', 'kai_persona', 'p', {"traits": ["rebel_hacker"]}, merge_strategy='overlay')
+    
+    # 导出为目录布局后可被默认后端直接使用
+    ops.engine.export_work('neural_frontier', tmp_path / 'exported')
+    assert json.loads((tmp_path / 'exported' / 'personas' / 'kai.json').read_text(encoding='utf-8')) == {
+        "description": "Kai"
+    }
+    file_ops = _isolated_ops(tmp_path / 'file_home')
+    migrate_works(ops.engine.backend, file_ops.engine.backend, ['neural_frontier'])
+    assert file_ops.inspect('neural_frontier', 'kai_persona', target='p')['traits'] == ["rebel_hacker"]
+    assert isinstance(file_ops.engine.backend, FileBackend)
+    
+    # .narr 包可在两种后端之间往返
+    package = str(tmp_path / 'nf.narr')
+    assert ops.storage.export_work_as_package('neural_frontier', package)
+    file_ops.storage.import_package(package, 'nf_from_package')
+    assert file_ops.engine.work_exists('nf_from_package')
+    
+    # 同一主目录内 file → sqlite → file 往返：带事件日志的作品不会命名冲突，也不残留旧的实体文件
+    from chenmo.backends import create_backend
+    home = tmp_path / 'shared_home'
+    ops = _isolated_ops(home)
+    ops.register('avatar', log_person=["Neytiri"])
+    ops.run('avatar', 'neytiri', then="first_hunt")
+    ops.engine.close_event_log('avatar')
+    sqlite_backend = create_backend(ops.engine, 'sqlite')
+    assert migrate_works(ops.engine.backend, sqlite_backend, ['avatar']) == ['avatar']
+    assert sorted(path.name for path in (home / 'works' / 'avatar').iterdir()) == ['events']
+    assert sqlite_backend.load('avatar', 'p', 'neytiri') == {"description": "Neytiri"}
+    sqlite_backend.save('avatar', 'p', 'neytiri', {"description": "Neytiri of the Omaticaya"})
+    migrate_works(sqlite_backend, ops.engine.backend, ['avatar'])
+    assert not sqlite_backend.work_exists('avatar')
+    sqlite_backend.close()
+    assert ops.inspect('avatar', 'neytiri', target='p') == {"description": "Neytiri of the Omaticaya"}
+    assert [record['event'] for record in ops.history('avatar')] == ["first_hunt"]
+
+
+def test_entity_cache(tmp_path, monkeypatch):
+    import builtins
+    import os
+    import time
+    
+    ops = _isolated_ops(tmp_path)
+    ops.register('neural_frontier')
+    ops.engine.cache.maxsize = 2
+    ops.persona_extract('neural_frontier', 'kai', traits=["rebel_hacker"])
+    
+    # 写入后直接命中缓存，反复查看不再打开文件
+    opened = []
+    real_open = builtins.open
+    monkeypatch.setattr(builtins, 'open', lambda *a, **kw: opened.append(a[0]) or real_open(*a, **kw))
+    for _ in range(5):
+        assert ops.inspect('neural_frontier', 'kai', target='p')['traits'] == ["rebel_hacker"]
+    monkeypatch.setattr(builtins, 'open', real_open)
+    assert opened == []
+    assert ops.engine.cache.stats()['hits'] == 5
+    
+    # 返回的是副本，修改不会污染缓存
+    ops.inspect('neural_frontier', 'kai', target='p')['traits'].append("mutated")
+    assert ops.inspect('neural_frontier', 'kai', target='p')['traits'] == ["rebel_hacker"]
+    
+    # 外部修改文件后按 mtime/大小失效
+    kai_file = tmp_path / 'works' / 'neural_frontier' / 'personas' / 'kai.json'
+    kai_file.write_text(json.dumps({"traits": ["edited"]}), encoding='utf-8')
+    os.utime(kai_file, ns=(time.time_ns(), time.time_ns() + 1000))
+    assert ops.inspect('neural_frontier', 'kai', target='p')['traits'] == ["edited"]
+    
+    ops.persona_extract('neural_frontier', 'aris', traits=[])
+    ops.persona_extract('neural_frontier', 'voss', traits=[])
+    assert ops.engine.cache.stats()['evictions'] == 1
+
+
+def test_event_log(tmp_path):
+    from chenmo.eventlog import EventLog
+    
+    ops = _isolated_ops(tmp_path)
+    ops.register('avatar')
+    for index in range(3):
+        ops.run('avatar', 'spider', then=f"breath_{index}", outcome={"step": index})
+    ops.run('avatar', 'eywa', then="eywa_wakes")
+    
+    # 同一秒内的多次事件不再互相覆盖
+    history = ops.history('avatar')
+    assert [record['seq'] for record in history] == [1, 2, 3, 4]
+    assert [record['event'] for record in ops.history('avatar', triggered_by='avatar.eywa')] == ["eywa_wakes"]
+    
+    # 小分段轮转后，按序号与时间范围读取仍然正确，并可在重新打开后继续编号
+    log = EventLog(tmp_path / 'log', max_segment_bytes=200, sync_every=4)
+    records = [log.append({"event": f"e{index}", "triggered_by": f"w.{index % 2}"}) for index in range(20)]
+    log.close()
+    assert len(list((tmp_path / 'log').glob('segment_*.jsonl'))) > 1
+    reopened = EventLog(tmp_path / 'log')
+    assert reopened.append({"event": "after"})['seq'] == 21
+    assert [r['seq'] for r in reopened.scan(after_seq=18)] == [19, 20, 21]
+    assert [r['seq'] for r in reopened.scan(since=records[10]['ts'], triggered_by='w.1')][0] >= 11
+    assert len(list(reopened.scan(triggered_by='w.0'))) == 10
+    
+    # 旧版逐事件文件在首次打开日志时导入，时间取自文件名
+    legacy_events = tmp_path / 'works' / 'avatar' / 'events'
+    (legacy_events / 'event_1700000000_spider.json').write_text(
+        json.dumps({"event": "old_breath", "outcome": {"step": -1}, "triggered_by": "avatar.spider",
+                    "timestamp": "placeholder_timestamp"}), encoding='utf-8')
+    ops.engine.close_event_log('avatar')
+    ops.register('legacy')
+    (tmp_path / 'works' / 'legacy' / 'events').mkdir()
+    (tmp_path / 'works' / 'legacy' / 'events' / 'event_1700000000_spider.json').write_text(
+        json.dumps({"event": "old_breath", "outcome": {"spider.o2_level": 0.05}, "triggered_by": "legacy.spider",
+                    "timestamp": "placeholder_timestamp"}), encoding='utf-8')
+    assert [(r['seq'], r['event'], r['ts']) for r in ops.history('legacy')] == [(1, "old_breath", 1700000000.0)]
+    assert not list((tmp_path / 'works' / 'legacy' / 'events').glob('event_*.json'))
+    assert ops.state_at('legacy')['state'] == {"spider": {"o2_level": 0.05}}
+    
+    # 从另一作品更新：来源的事件重新编号后追加，两边的历史都保留；重复更新不会重复追加
+    ops.register('pandora')
+    ops.run('pandora', 'jake', then="b0")
+    before = [record['event'] for record in ops.history('avatar')]
+    assert before[-1] == "old_breath" and len(before) == 5
+    source = str(tmp_path / 'works' / 'pandora')
+    assert "1 events merged" in ops.update('avatar', **{'from': source, 'merge': 'overlay'})
+    assert "events merged" not in ops.update('avatar', **{'from': source, 'merge': 'overlay'})
+    history = ops.history('avatar')
+    assert [record['event'] for record in history] == before + ["b0"]
+    assert [record['seq'] for record in history] == [1, 2, 3, 4, 5, 6]
+    assert history[-1]['merged_from']['seq'] == 1
+
+
+def test_batch_writes(tmp_path):
+    ops = _isolated_ops(tmp_path)
+    persons = [f"citizen {index}" for index in range(50)]
+    ops.register('megacity', log_works="Megacity", log_person=persons)
+    assert len(list((tmp_path / 'works' / 'megacity' / 'personas').iterdir())) == 50
+    assert [item['name'] for item in ops.search('megacity', 'p', 'citizen_49')] == ['citizen_49']
+    
+    # 重复的人物名在提交前即失败，不会留下半注册的作品
+    try:
+        ops.register('broken', log_person=["Kai", "kai"])
+    except ValueError:
+        pass
+    assert not ops.engine.work_exists('broken')
+    
+    # 会话中的异常使整批写入全部丢弃
+    try:
+        with ops.batch():
+            ops.core_extract('megacity', 'laws', axioms=["curfew"])
+            raise RuntimeError("abort")
+    except RuntimeError:
+        pass
+    assert ops.inspect('megacity', 'laws', target='c').startswith("No data found")
+    
+    with ops.batch():
+        ops.core_extract('megacity', 'laws', axioms=["curfew"])
+        ops.persona_extract('megacity', 'mayor', traits=["corrupt"])
+        assert not (tmp_path / 'works' / 'megacity' / 'cores' / 'laws.json').exists()
+    assert ops.inspect('megacity', 'mayor', target='p')['traits'] == ["corrupt"]
+    assert not list((tmp_path / 'journal').iterdir())
+    
+    # 落盘文件持久化之前崩溃：日志保留，下次启动重放
+    backend = ops.engine.backend
+    sync = backend._sync_journal_targets
+    def crash(journal):
+        raise SystemExit("crash before the applied files are durable")
+    backend._sync_journal_targets = crash
+    try:
+        with ops.batch():
+            ops.core_extract('megacity', 'tax', axioms=["levy"])
+    except SystemExit:
+        pass
+    backend._sync_journal_targets = sync
+    assert len(list((tmp_path / 'journal').iterdir())) == 1
+    (tmp_path / 'works' / 'megacity' / 'cores' / 'tax.json').unlink()
+    backend.recover()
+    assert ops.inspect('megacity', 'tax', target='c')['axioms'] == ["levy"]
+    assert not list((tmp_path / 'journal').iterdir())
+
+
+def test_atomic_writes(tmp_path):
+    import threading
+    from chenmo.utils import atomic_write_json
+    
+    target = tmp_path / 'entity.json'
+    atomic_write_json(target, {"traits": []})
+    stop = threading.Event()
+    
+    def writer():
+        size = 0
+        while not stop.is_set():
+            size = size % 500 + 1
+            atomic_write_json(target, {"traits": ["t"] * size}, fsync=False)
+    
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        # 并发读取者只会看到完整的 JSON
+        for _ in range(300):
+            assert isinstance(json.loads(target.read_text(encoding='utf-8'))['traits'], list)
+    finally:
+        stop.set()
+        thread.join()
+    assert [path.name for path in tmp_path.iterdir()] == ['entity.json']
+
+
+def _concurrent_writer(home_dir, worker, count):
+    ops = _isolated_ops(home_dir)
+    for i in range(count):
+        ops.storage.save_work_data('shared', 'laws', 'c', {f"w{worker}_{i}": i}, merge_strategy='patch')
+        ops.run('shared', 'laws', then=f"w{worker}_{i}")
+
+
+def test_concurrent_writers(tmp_path):
+    import multiprocessing
+    
+    ops = _isolated_ops(tmp_path)
+    ops.register('shared')
+    ops.core_extract('shared', 'laws', axioms=["entropy"])
+    
+    # 多个进程同时 patch 同一实体并追加事件，既不丢失更新也不产生重复序号
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_concurrent_writer, args=(str(tmp_path), w, 15)) for w in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    
+    laws = ops.engine.load_entity('shared', 'laws', 'c')
+    assert len([key for key in laws if key.startswith('w')]) == 60
+    assert [event['seq'] for event in ops.history('shared')] == list(range(1, 61))
+    
+    # 乐观并发：版本号过期的写入被拒绝
+    version = ops.engine.entity_version('shared', 'laws', 'c')
+    ops.storage.save_work_data('shared', 'laws', 'c', {"axioms": ["order"]}, merge_strategy='patch', expected_version=version)
+    with pytest.raises(ValueError, match="Version conflict"):
+        ops.storage.save_work_data('shared', 'laws', 'c', {"axioms": []}, merge_strategy='patch', expected_version=version)
+    
+    # 作品目录以原子 mkdir 创建，重名时报命名冲突
+    with pytest.raises(ValueError, match="Namespace collision"):
+        ops.engine.create_work_structure('shared')
+
+
+def test_package_pipeline(tmp_path, monkeypatch):
+    import io
+    import zipfile
+    from chenmo import packaging
+    
+    ops = _isolated_ops(tmp_path)
+    ops.register('avatar', log_person=["Jake Sully", "Neytiri"], log_thing=["exo_pack"])
+    ops.core_extract('avatar', 'biosphere', axioms=["eywa_links_all_life"])
+    
+    # 条目少时也走进程池，并以流（无临时文件）往返
+    monkeypatch.setattr(packaging, 'MIN_PARALLEL_ENTRIES', 0)
+    monkeypatch.setattr(packaging, 'CHUNK_SIZE', 2)
+    for compression in ['stored', 'deflated']:
+        stream = io.BytesIO()
+        assert ops.storage.export_work_as_package('avatar', stream, compression=compression, workers=2)
+        stream.seek(0)
+        ops.storage.import_package(stream, f'avatar_{compression}')
+        assert ops.inspect(f'avatar_{compression}', 'biosphere', target='c')['axioms'] == ["eywa_links_all_life"]
+        assert ops.engine.search_entities('neytiri', work_filter=f'avatar_{compression}')
+    
+    # zstd 为可选依赖
+    try:
+        import zstandard
+    except ImportError:
+        with pytest.raises(ImportError, match="pip install zstandard"):
+            ops.storage.export_work_as_package('avatar', io.BytesIO(), compression='zstd')
+    else:
+        stream = io.BytesIO()
+        ops.storage.export_work_as_package('avatar', stream, compression='zstd')
+        stream.seek(0)
+        ops.storage.import_package(stream, 'avatar_zstd')
+        assert ops.inspect('avatar_zstd', 'biosphere', target='c')['axioms'] == ["eywa_links_all_life"]
+    
+    # 标准 ZIP 工具可读，validate_package 通过
+    package = tmp_path / 'avatar.narr'
+    ops.storage.export_work_as_package('avatar', str(package))
+    assert zipfile.ZipFile(package).read('personas/jake_sully.json')
+    assert ops.storage.validate_package(str(package))
+    
+    # 旧版包（条目位于 作品名/ 之下）仍可导入
+    legacy = tmp_path / 'legacy.narr'
+    with zipfile.ZipFile(legacy, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        zipf.writestr('old/manifest.json', json.dumps({"name": "old"}))
+        zipf.writestr('old/personas/kai.json', json.dumps({"description": "Kai"}))
+    ops.storage.import_package(str(legacy), 'old')
+    assert ops.inspect('old', 'kai', target='p') == {"description": "Kai"}
+    
+    # 越出解压目录的路径被拒绝
+    evil = io.BytesIO()
+    writer = packaging.PackageWriter(evil)
+    writer.add_bytes('../escape.json', b'{}')
+    writer.close()
+    evil.seek(0)
+    with pytest.raises(ValueError, match="Unsafe path"):
+        ops.storage.import_package(evil, 'evil')
+    assert not (tmp_path / 'works' / 'escape.json').exists() and not ops.engine.work_exists('evil')
+    
+    # 远程部署直接从内存流导入
+    ops.deploy('demo', doad='demo_pkg')
+    assert ops.inspect('demo', 'intro')['description'] == "Introductory content for demo_pkg"
+
+
+def test_batch_is_per_thread(tmp_path):
+    import threading
+    
+    ops = _isolated_ops(tmp_path)
+    ops.register('a', log_works="A")
+    ops.register('b', log_works="B")
+    opened, written = threading.Event(), threading.Event()
+    
+    def rolled_back():
+        with pytest.raises(RuntimeError):
+            with ops.storage.batch():
+                ops.storage.save_work_data('a', 'doomed', 'c', {"axioms": []})
+                opened.set()
+                written.wait(5)
+                raise RuntimeError("roll back")
+    
+    thread = threading.Thread(target=rolled_back)
+    thread.start()
+    opened.wait(5)
+    # 另一个线程的批量会话进行中，本线程的写入立即生效，且不随其回滚
+    ops.core_extract('b', 'unrelated', axioms=["kept"])
+    assert ops.engine.load_entity('b', 'unrelated', 'c')['axioms'] == ["kept"]
+    written.set()
+    thread.join()
+    
+    assert ops.engine.load_entity('b', 'unrelated', 'c')['axioms'] == ["kept"]
+    assert ops.engine.load_entity('a', 'doomed', 'c') is None
+
+def test_package_rejects_bad_input(tmp_path):
+    import io
+    import struct
+    
+    ops = _isolated_ops(tmp_path)
+    ops.register('avatar', log_person=["Jake Sully"], log_thing=["deck"])
+    stream = io.BytesIO()
+    ops.storage.export_work_as_package('avatar', stream, compression='stored')
+    package = stream.getvalue()
+    
+    # 非 ZIP 数据与空流
+    for data, message in [(b"this is not a zip", "Invalid package"), (b"", "Truncated package")]:
+        with pytest.raises(ValueError, match=message):
+            ops.storage.import_package(io.BytesIO(data), 'garbage')
+        assert not ops.engine.work_exists('garbage')
+    
+    # 恰好在条目边界（中央目录之前）截断，以及在条目中间截断
+    central_offset = struct.unpack('<I', package[-6:-2])[0]
+    for cut in [central_offset, central_offset - 5, central_offset + 10]:
+        with pytest.raises(ValueError, match="Truncated package"):
+            ops.storage.import_package(io.BytesIO(package[:cut]), 'partial')
+        assert not ops.engine.work_exists('partial')
+    
+    # 中央目录的条目数与实际条目不符
+    central = package[central_offset:]
+    first_entry_end = package.index(b'PK\x03\x04', 4)
+    with pytest.raises(ValueError, match="entry count mismatch"):
+        ops.storage.import_package(io.BytesIO(package[first_entry_end:central_offset] + central), 'mismatch')
+    
+    # 缺少 manifest.json 的完整 ZIP
+    from chenmo.packaging import PackageWriter
+    bare = io.BytesIO()
+    writer = PackageWriter(bare)
+    writer.add_bytes('personas/kai.json', b'{}')
+    writer.close()
+    bare.seek(0)
+    with pytest.raises(ValueError, match="missing manifest.json"):
+        ops.storage.import_package(bare, 'bare')
+    assert not ops.engine.work_exists('bare')
+
+
+def test_object_store(tmp_path):
+    import os
+    
+    ops = _isolated_ops(tmp_path)
+    ops.register('neural_frontier', log_person=["Kai"])
+    ops.persona_extract('neural_frontier', 'kai_persona', traits=["rebel_hacker"])
+    ops.run('neural_frontier', then="awakening")
+    works = tmp_path / 'works'
+    
+    # 转义只建立链接，不复制内容；源作品的文件不与对象共享，仍可写
+    import stat
+    ops.transmute('neural_frontier', toas='nf_fork', rcd="fork")
+    source = works / 'neural_frontier' / 'personas' / 'kai_persona.json'
+    fork = works / 'nf_fork' / 'personas' / 'kai_persona.json'
+    digest = ops.engine.objects.load_manifest(works / 'nf_fork')['objects']['personas/kai_persona.json']
+    assert os.stat(fork).st_ino == os.stat(ops.engine.objects.blob_path(digest)).st_ino
+    assert os.stat(source).st_ino != os.stat(fork).st_ino
+    assert os.stat(source).st_mode & stat.S_IWUSR
+    assert not os.stat(fork).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    assert ops.engine.objects.load_manifest(works / 'nf_fork')['source'] == 'neural_frontier'
+    
+    # 写时复制：修改派生作品不影响源作品，事件日志追加前断开共享
+    ops.storage.save_work_data('nf_fork', 'kai_persona', 'p', {"traits": ["corporate_agent"]}, merge_strategy='overlay')
+    ops.run('nf_fork', then="betrayal")
+    assert ops.inspect('neural_frontier', 'kai_persona', target='p')['traits'] == ["rebel_hacker"]
+    assert [event['event'] for event in ops.history('neural_frontier')] == ["awakening"]
+    assert [event['event'] for event in ops.history('nf_fork')] == ["awakening", "betrayal"]
+    
+    # 源作品可原地编辑：派生作品与对象不受影响，下次登记按文件状态发现改动
+    with open(source, 'w', encoding='utf-8') as f:
+        json.dump({"traits": ["edited_in_place"]}, f)
+    assert ops.engine.objects.blob_path(digest).exists()
+    fork_copy = works / 'nf_fork_2'
+    ops.transmute('neural_frontier', toas='nf_fork_2', rcd="fork")
+    assert json.loads((fork_copy / 'personas' / 'kai_persona.json').read_text(encoding='utf-8'))['traits'] == ["edited_in_place"]
+    assert ops.engine.objects.load_manifest(works / 'neural_frontier')['objects']['personas/kai_persona.json'] != digest
+    ops.engine.delete_work('nf_fork_2')
+    
+    # 从本地作品部署同样按链接克隆；外部目录导入时与已有对象去重
+    ops.deploy('nf_copy', **{'from': str(works / 'neural_frontier')})
+    assert os.stat(works / 'nf_copy' / 'personas' / 'kai.json').st_ino == os.stat(works / 'nf_fork' / 'personas' / 'kai.json').st_ino
+    ops.engine.export_work('neural_frontier', tmp_path / 'exported')
+    ops.deploy('nf_imported', **{'from': str(tmp_path / 'exported')})
+    assert os.stat(works / 'nf_imported' / 'personas' / 'kai.json').st_ino == os.stat(works / 'nf_copy' / 'personas' / 'kai.json').st_ino
+    
+    # 删除全部引用后对象可被回收
+    for work_name in ['neural_frontier', 'nf_fork', 'nf_copy', 'nf_imported']:
+        ops.engine.delete_work(work_name)
+    assert ops.engine.objects.gc()['removed'] > 0
+    assert ops.engine.objects.stats()['objects'] == 0
+
+
+def test_incremental_merge(tmp_path):
+    import os
+    
+    ops = _isolated_ops(tmp_path)
+    ops.register('avatar', log_person=["Jake Sully", "Neytiri"])
+    ops.core_extract('avatar', 'biosphere', axioms=["eywa_links_all_life"], constraints=["no_unobtanium"])
+    work = tmp_path / 'works' / 'avatar'
+    source = tmp_path / 'source'
+    ops.engine.export_work('avatar', source)
+    os.utime(source / 'personas' / 'neytiri.json', ns=(1, 1))
+    (source / 'personas' / 'quaritch.json').write_text(json.dumps({"description": "Quaritch"}), encoding='utf-8')
+    (source / 'cores' / 'biosphere.json').write_text(json.dumps({"axioms": ["tree_of_souls"]}), encoding='utf-8')
+    
+    # 严格模式：存在冲突时一个文件也不写
+    with pytest.raises(ValueError, match="cores/biosphere.json"):
+        ops.update('avatar', **{'from': str(source), 'merge': 'strict'})
+    assert not (work / 'personas' / 'quaritch.json').exists()
+    
+    # patch：JSON 逐字段合并；未变化的文件（即使 mtime 不同）不会被重写
+    inode = os.stat(work / 'personas' / 'neytiri.json').st_ino
+    result = ops.update('avatar', **{'from': str(source), 'merge': 'patch'})
+    assert "1 added, 1 modified" in result and "0 conflicted" in result
+    assert os.stat(work / 'personas' / 'neytiri.json').st_ino == inode
+    assert ops.inspect('avatar', 'biosphere', target='c')['axioms'] == ["tree_of_souls"]
+    assert ops.inspect('avatar', 'biosphere', target='c')['constraints'] == ["no_unobtanium"]
+    assert ops.engine.search_entities('quaritch')
+    
+    # 再次合并时全部未变
+    assert "0 added, 0 modified" in ops.update('avatar', **{'from': str(source), 'merge': 'patch'})
+
+
+def test_merge_plan(tmp_path):
+    ops = _isolated_ops(tmp_path)
+    ops.register('avatar', log_person=["Neytiri"], log_thing=["exo_pack"])
+    ops.core_extract('avatar', 'biosphere', axioms=["eywa_links_all_life"], constraints=["no_unobtanium"])
+    work = tmp_path / 'works' / 'avatar'
+    source = tmp_path / 'source'
+    ops.engine.export_work('avatar', source)
+    (source / 'cores' / 'biosphere.json').write_text(json.dumps({"axioms": ["tree_of_souls"]}), encoding='utf-8')
+    (source / 'tech' / 'exo_pack.json').write_text(json.dumps({"description": "Exo pack v2"}), encoding='utf-8')
+    (source / 'tech' / 'amp_suit.json').write_text(json.dumps({"description": "AMP suit"}), encoding='utf-8')
+    before = sorted(path.name for path in work.rglob('*'))
+    
+    # 预演：列出文件级与键级冲突及写入量，不改动作品
+    plan = ops.update('avatar', **{'from': str(source), 'merge': 'strict', 'dry_run': True})
+    assert [(entry['path'], entry['keys']) for entry in plan.conflicts] == [
+        ('cores/biosphere.json', ['axioms']), ('tech/exo_pack.json', ['description'])
+    ]
+    assert plan.summary()['added'] == ['tech/amp_suit.json'] and plan.bytes_to_write > 0
+    assert sorted(path.name for path in work.rglob('*')) == before
+    
+    # 交互式：逐个冲突由回调决定
+    choices = {'cores/biosphere.json': 'patch', 'tech/exo_pack.json': 'ours'}
+    ops.update('avatar', **{'from': str(source), 'merge': 'interactive', 'resolve': lambda entry: choices[entry['path']]})
+    assert ops.inspect('avatar', 'biosphere', target='c')['constraints'] == ["no_unobtanium"]
+    assert ops.inspect('avatar', 'biosphere', target='c')['axioms'] == ["tree_of_souls"]
+    assert ops.inspect('avatar', 'exo_pack', target='t') == {"description": "exo_pack"}
+    assert ops.inspect('avatar', 'amp_suit', target='t') == {"description": "AMP suit"}
+    
+    # 分支合并：来源作品与新作品一次按序加锁，导入时不再嵌套加锁
+    calls = []
+    lock = ops.engine.locks.lock
+    def record(*names):
+        calls.append(names)
+        return lock(*names)
+    ops.engine.locks.lock = record
+    result = ops.update('avatar', **{'from': str(source), 'lo': str(work), 'toas': 'avatar_branch', 'merge': 'overlay'})
+    ops.engine.locks.lock = lock
+    assert result.startswith("Merged") and calls[0] == ('avatar_branch', 'avatar')
+    assert not [names for names in calls[1:] if 'avatar' in names]
+    assert ops.inspect('avatar_branch', 'amp_suit', target='t') == {"description": "AMP suit"}
+
+
+def test_vectorized_mix(tmp_path, monkeypatch):
+    from chenmo import mixing
+    
+    ops = _isolated_ops(tmp_path)
+    ops.register('pandora')
+    ops.storage.save_work_data('pandora', 'navi', 'c', {
+        "gravity": 0.5, "traits": ["tall", "blue"], "physics": {"magnetism": 1.0, "flux": "high"}, "tone": "spiritual"
+    })
+    ops.storage.save_work_data('pandora', 'human', 'c', {
+        "gravity": 1.0, "traits": ["short", "blue"], "physics": {"magnetism": 0.0}, "tone": "industrial"
+    })
+    expected = {
+        "gravity": 0.875,
+        "traits": ["blue", "short", "tall"],
+        "physics": {"magnetism": 0.25, "flux": "high"},
+        "tone": "industrial",
+    }
+    
+    ops.mix('pandora', sources=[('pandora', 'navi'), ('pandora', 'human')], weights=[1, 3], toas='hybrid')
+    result = ops.inspect('hybrid', 'mixed_result', target='c')
+    assert result == expected
+    
+    # 无 NumPy 时的纯 Python 实现结果一致；可按字段指定策略
+    monkeypatch.setattr(mixing, 'np', None)
+    sources = ops.engine.load_entities([('pandora', 'navi', 'c'), ('pandora', 'human', 'c')])
+    assert mixing.mix_entities(sources, [0.25, 0.75]) == expected
+    assert mixing.mix_entities(sources, [0.25, 0.75], strategies={'traits': 'vote'})['traits'] == ["short", "blue"]
+    
+    # 数百个源一次融合
+    many = [{"power": float(n), "traits": [f"t{n % 3}"]} for n in range(300)]
+    blended = mixing.mix_entities(many, [1.0] * 300)
+    assert blended["power"] == pytest.approx(149.5) and blended["traits"] == ["t0", "t1", "t2"]
+
+
+
+def test_mix_many(tmp_path):
+    ops = _isolated_ops(tmp_path)
+    ops.register('pandora')
+    ops.storage.save_work_data('pandora', 'navi', 'p', {"height": 3.0, "traits": ["tall"]})
+    ops.storage.save_work_data('pandora', 'human', 'p', {"height": 1.0, "traits": ["short"]})
+    sources = [('pandora', 'navi'), ('pandora', 'human')]
+    
+    result = ops.mix_many('pandora', sources=sources, weights=[[1, 0], [1, 1], [1, 3]],
+                          target_type='p', toas='hybrids')
+    assert "Mixed 3 hybrids from 2 sources into 'hybrids'" in result and "hybrids/sec" in result
+    assert ops.inspect('hybrids', 'hybrid_0', target='p') == {"height": 3.0, "traits": ["tall"]}
+    assert ops.inspect('hybrids', 'hybrid_1', target='p')["height"] == 2.0
+    # 与逐个 x(...) 的结果一致
+    ops.mix('pandora', sources=sources, weights=[1, 3], target_type='p', toas='single')
+    assert ops.inspect('hybrids', 'hybrid_2', target='p') == ops.inspect('single', 'mixed_result', target='p')
+    
+    # 权重行与源数量不符时整批不写入
+    with pytest.raises(ValueError):
+        ops.mix_many('pandora', sources=sources, weights=[[1, 1], [1]], target_type='p', toas='broken')
+    assert not ops.engine.work_exists('broken')
+
+
+
+def test_rule_engine(tmp_path):
+    from chenmo.rules import RuleEngine, WorldState, compile_condition
+    
+    ops = _isolated_ops(tmp_path)
+    ops.register('avatar', log_person=["Spider"])
+    ops.storage.save_work_data('avatar', 'spider', 'p', {"o2_level": 0.05, "traits": ["orphan"]}, merge_strategy="overlay")
+    
+    # run(when=...) 按作品当前事实求值
+    assert ops.run('avatar', 'spider', when="p.spider.o2_level > 0.1", then="suffocates").startswith("Condition not met")
+    assert ops.run('avatar', 'spider', when="p.spider.o2_level < 0.1 and 'orphan' in p.spider.traits",
+                   then="eywa_intervenes", outcome={"spider.physiology": "+native_respiration"}).startswith("Executed")
+    assert ops.run('avatar', 'spider', when="happened('eywa_intervenes') and 'native_respiration' in state.spider.physiology",
+                   then="spider_breathes").startswith("Executed")
+    assert ops.run('avatar', 'spider', when="p.nobody.level > 1", then="never").startswith("Condition not met")
+    # 下标访问（Python 3.8 的 ast.Index 包装同样支持）
+    assert ops.run('avatar', 'spider', when="p.spider.traits[0] == 'orphan' and p['spider']['o2_level'] < 0.1",
+                   then="spider_remembers").startswith("Executed")
+    with pytest.raises(ValueError):
+        compile_condition("__import__('os').system('true')")
+    
+    # 只重新求值依赖于变化事实的规则
+    rules = RuleEngine()
+    for n in range(1000):
+        rules.add(f"state.counter_{n} >= 1", then=f"reached_{n}", name=f"r{n}")
+    rules.add("count('tick') >= 2", then="two_ticks", name="ticks")
+    world = WorldState()
+    assert rules.evaluate(world) == [] and rules.evaluations == 1001
+    
+    rules.notify(world.apply({"event": "tick", "outcome": {"counter_7": 1}}))
+    assert [rule.name for rule in rules.evaluate(world)] == ["r7"] and rules.evaluations == 1003
+    rules.notify(world.apply({"event": "tick", "outcome": {"counter_7": 2}}))
+    assert [rule.name for rule in rules.evaluate(world)] == ["ticks"] and rules.evaluations == 1005
+
+
+
+def test_simulation(tmp_path):
+    from chenmo.simulation import Simulation
+    
+    ops = _isolated_ops(tmp_path)
+    ops.register('avatar', log_person=["Spider"])
+    ops.storage.save_work_data('avatar', 'spider', 'p', {"o2_level": 0.05}, merge_strategy="overlay")
+    rules = [
+        {"name": "eywa", "when": "p.spider.o2_level < 0.1", "then": "eywa_intervenes",
+         "outcome": {"spider.physiology": "+native_respiration"}},
+        {"name": "breathe", "when": "'native_respiration' in state.spider.physiology", "then": "spider_breathes",
+         "outcome": {"world_state": "hybrid_acknowledged"}},
+        {"name": "tick", "when": "count('tick') % 2 == 1", "then": "odd_tick"},
+    ]
+    
+    # 规则逐步级联，没有可求值的规则后提前结束
+    result = ops.simulate('avatar', 'spider', steps=100, rules=rules, flush_every=1000,
+                          events={3: [{"event": "tick"}]})
+    assert result.startswith("Simulated 3 steps in avatar.spider: 4 events") and "steps/sec" in result
+    events = ops.history('avatar')
+    assert [(e['step'], e['event']) for e in events] == [
+        (1, 'eywa_intervenes'), (2, 'spider_breathes'), (3, 'tick'), (3, 'odd_tick')
+    ]
+    
+    # 从检查点继续：状态与规则来自检查点，已触发的规则不会重复触发
+    simulation = Simulation.resume(ops.engine, 'avatar')
+    assert simulation.steps == 3 and simulation.world.state["world_state"] == "hybrid_acknowledged"
+    stats = simulation.run(10, events={4: [{"event": "tick"}], 5: [{"event": "tick"}]})
+    assert stats['steps'] == 2 and [e['event'] for e in ops.history('avatar', after_seq=4)] == ['tick', 'tick', 'odd_tick']
+
+
+
+def test_branching(tmp_path):
+    from chenmo import branching
+    
+    ops = _isolated_ops(tmp_path)
+    ops.register('avatar', log_person=["Spider"])
+    ops.storage.save_work_data('avatar', 'spider', 'p', {"o2_level": 0.05}, merge_strategy="overlay")
+    ops.run('avatar', 'spider', then="arrival", outcome={"spider.location": "pandora"})
+    
+    variants = [
+        [{"when": f"p.spider.o2_level < {n / 100}", "then": "eywa_intervenes", "outcome": {"spider.fate": f"fate_{n}"}},
+         {"when": "happened('eywa_intervenes') and state.spider.location == 'pandora'", "then": "spider_breathes"}]
+        for n in range(20)
+    ]
+    result = ops.branch('avatar', 'spider', variants=variants, workers=2,
+                        keep=lambda branch: branch.index in (3, 10), toas='avatar_fate_{n}', rcd="what-if")
+    assert result.startswith("Explored 20 branches of avatar") and result.endswith("kept 2: avatar_fate_3, avatar_fate_10")
+    
+    # 保留的分支：源作品历史 + 分支事件，附带血缘；源作品不受影响
+    assert [e['event'] for e in ops.history('avatar_fate_10')] == ['arrival', 'eywa_intervenes', 'spider_breathes']
+    assert [e['event'] for e in ops.history('avatar_fate_3')] == ['arrival']
+    lineage = ops.engine.load_work_file('avatar_fate_10', 'lineage.json')
+    assert lineage["original_source"] == 'avatar' and lineage["branch"] == 10 and lineage["forked_at_seq"] == 1
+    assert [e['event'] for e in ops.history('avatar')] == ['arrival']
+    assert not ops.engine.work_exists('avatar_fate_4')
+    
+    # 进程池与当前进程中的推演结果一致
+    snapshot = branching.WorkSnapshot.capture(ops.engine, 'avatar')
+    parallel = branching.explore(snapshot, variants, 'avatar.spider', workers=2)
+    serial = branching.explore(snapshot, variants, 'avatar.spider', workers=1)
+    assert [(b.events, b.state) for b in parallel] == [(b.events, b.state) for b in serial]
+    assert parallel[10].state["spider"] == {"location": "pandora", "fate": "fate_10"}
+    
+    # 源作品在分叉后发生变化时拒绝保留
+    ops.run('avatar', 'spider', then="later_event")
+    with pytest.raises(ValueError):
+        branching.keep_branch(ops.engine, snapshot, parallel[10], 'avatar_stale')
+
+
+
+def test_state_snapshots(tmp_path, monkeypatch):
+    from chenmo import snapshots
+    
+    monkeypatch.setattr(snapshots, 'SNAPSHOT_INTERVAL', 10)
+    ops = _isolated_ops(tmp_path)
+    ops.register('avatar', log_person=["Spider"])
+    ops.storage.save_work_data('avatar', 'spider', 'p', {"o2_level": 0.05}, merge_strategy="overlay")
+    for n in range(1, 36):
+        ops.run('avatar', 'spider', then=f"day_{n}", outcome={"spider.day": n, "spider.o2_level": n / 100})
+    times = [event['ts'] for event in ops.history('avatar')]
+    
+    # 写入事件时每隔 10 条物化一次状态
+    snapshot_dir = ops.engine.get_work_path('avatar') / 'events' / 'snapshots'
+    assert sorted(path.name for path in snapshot_dir.iterdir()) == [
+        'state_000000000010.json', 'state_000000000020.json', 'state_000000000030.json'
+    ]
+    
+    # 查询从最近的快照开始，只重放其后的事件
+    replayed = []
+    scan = ops.engine.event_log('avatar').scan
+    monkeypatch.setattr(ops.engine.event_log('avatar'), 'scan',
+                        lambda *args, **kwargs: (replayed.append(e) or e for e in scan(*args, **kwargs)))
+    state = ops.state_at('avatar', at=25)
+    assert state['seq'] == 25 and state['state']['spider']['day'] == 25 and state['counts']['day_21'] == 1
+    assert [e['seq'] for e in replayed] == [21, 22, 23, 24, 25, 26]
+    assert ops.state_at('avatar', at=times[16])['seq'] == 17
+    
+    # 时间点查看：实体数据叠加该时刻的状态
+    assert ops.inspect('avatar', 'spider', target='p', at=7) == {"o2_level": 0.07, "day": 7}
+    assert ops.inspect('avatar', 'spider', target='p') == {"o2_level": 0.05}
+    assert ops.run('avatar', 'spider', when="state.spider.day == 35", then="done").startswith("Executed")
+
+
+
+def test_lazy_import(tmp_path):
+    import os
+    import subprocess
+    import sys
+    
+    # import chenmo 不创建 ~/.chenmo，也不加载引擎与未使用的依赖；首次使用时才创建引擎
+    probe = (
+        "import sys, pathlib, chenmo, chenmo.cli\n"
+        "home = pathlib.Path.home() / '.chenmo'\n"
+        "assert not home.exists()\n"
+        "assert not {'requests', 'yaml', 'asyncio', 'chenmo.llm_interface'} & set(sys.modules)\n"
+        "from chenmo import l, i\n"
+        "assert chenmo._ops is None\n"
+        "l.lazy_work.novies(log_works='created on first use')\n"
+        "assert home.exists() and i.lazy_work.novies() == {'description': 'created on first use'}\n"
+        "assert chenmo.get_storage().engine is chenmo.engine\n"
+    )
+    env = dict(os.environ, HOME=str(tmp_path))
+    subprocess.run([sys.executable, '-c', probe], env=env, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    
+    # chenmo.storage 始终是子模块，访问它不会创建引擎；全局存储管理器由 get_storage() 提供
+    probe = (
+        "import pathlib, types, chenmo\n"
+        "from chenmo import storage\n"
+        "import chenmo.storage as submodule\n"
+        "assert isinstance(storage, types.ModuleType) and storage is submodule is chenmo.storage\n"
+        "assert chenmo._ops is None and not (pathlib.Path.home() / '.chenmo').exists()\n"
+        "assert isinstance(chenmo.get_storage(), storage.StorageManager)\n"
+    )
+    env = dict(os.environ, HOME=str(tmp_path / 'fresh_home'))
+    subprocess.run([sys.executable, '-c', probe], env=env, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+
+class _StandInLLMServer:
+    """模拟 OpenAI（/v1/chat/completions）与 Ollama（/api/chat）对话接口的本地 HTTP 服务
+    
+    回复内容为 reply(<最后一条消息>)，缺省为 "echo: <最后一条消息>"；fail_first 个请求返回 429，
+    delay 为每个请求的处理时间。流式请求按 chunk_size 个字符分块返回，块间间隔 chunk_delay。
+    """
+    
+    def __init__(self, delay=0.0, fail_first=0, chunk_size=8, chunk_delay=0.0):
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        
+        self.delay = delay
+        self.fail_first = fail_first
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.reply = lambda message: "echo: " + message
+        self.chunks_sent = 0
+        self.last_messages = None
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        lock = threading.Lock()
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+            
+            def do_POST(self):
+                import time
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with lock:
+                    server.requests += 1
+                    server.last_messages = body['messages']
+                    failing = server.requests <= server.fail_first
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                time.sleep(server.delay)
+                with lock:
+                    server.in_flight -= 1
+                content = server.reply(body['messages'][-1]['content'])
+                if not failing and body.get('stream'):
+                    return self._stream(body, content)
+                if failing:
+                    status, payload = 429, {"error": {"message": "rate limited", "type": "rate_limit"}}
+                elif self.path.endswith('/chat/completions'):
+                    status, payload = 200, {
+                        "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": body['model'],
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": content}}],
+                    }
+                else:
+                    status, payload = 200, {"model": body['model'], "created_at": "2026-01-01T00:00:00Z",
+                                            "message": {"role": "assistant", "content": content}, "done": True}
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def _stream(self, body, content):
+                # OpenAI 为 SSE（data: ...），Ollama 为逐行 JSON；HTTP/1.0 下以关闭连接结束响应
+                import time
+                openai_style = self.path.endswith('/chat/completions')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream' if openai_style else 'application/x-ndjson')
+                self.end_headers()
+                pieces = [content[n:n + server.chunk_size] for n in range(0, len(content), server.chunk_size)]
+                try:
+                    for piece in pieces + [None]:
+                        if openai_style:
+                            chunk = {"id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0,
+                                     "model": body['model'],
+                                     "choices": [{"index": 0, "delta": {"content": piece} if piece else {},
+                                                  "finish_reason": None if piece else "stop"}]}
+                            line = f"data: {json.dumps(chunk)}\n\n"
+                        else:
+                            line = json.dumps({"model": body['model'], "created_at": "2026-01-01T00:00:00Z",
+                                               "message": {"role": "assistant", "content": piece or ""},
+                                               "done": piece is None}) + "\n"
+                        self.wfile.write(line.encode('utf-8'))
+                        self.wfile.flush()
+                        server.chunks_sent += 1
+                        time.sleep(server.chunk_delay)
+                    if openai_style:
+                        self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+        
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+    
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def test_async_generate_many():
+    import time
+    from chenmo.llm_interface import LLMInterface
+    
+    server = _StandInLLMServer(delay=0.05, fail_first=3)
+    try:
+        # 并发受限、429 自动重试、结果按输入顺序返回
+        openai_llm = LLMInterface(type='openai', apiurl=server.url + '/v1', apikey='test',
+                                  concurrency=4, backoff_base=0.01, cache=False)
+        prompts = [f"persona {n}" for n in range(20)]
+        assert openai_llm.generate_many(prompts) == [f"echo: {prompt}" for prompt in prompts]
+        assert server.max_in_flight <= 4 and server.requests == 23
+        
+        ollama_llm = LLMInterface(type='ollama', apiurl=server.url, concurrency=8, cache=False)
+        assert ollama_llm.generate_many(["a", "b"]) == ["echo: a", "echo: b"]
+        assert ollama_llm.generate("c") == "echo: c"
+        
+        # 令牌桶限速：每分钟 600 个请求（每秒 10 个，突发 10 个）
+        limited = LLMInterface(type='openai', apiurl=server.url + '/v1', apikey='test',
+                               concurrency=50, requests_per_minute=600, cache=False)
+        server.delay = 0
+        started = time.perf_counter()
+        limited.generate_many([str(n) for n in range(15)])
+        assert time.perf_counter() - started >= 0.4
+        
+        # 重试次数用尽后抛出原始错误
+        server.fail_first = server.requests + 10
+        with pytest.raises(Exception):
+            LLMInterface(type='openai', apiurl=server.url + '/v1', apikey='test',
+                         max_retries=1, backoff_base=0.01, cache=False).generate_many(["x"])
+    finally:
+        server.close()
+
+
+def test_llm_response_cache(tmp_path):
+    """测试 LLM 响应缓存：重复请求不调用模型，按 TTL 与大小淘汰，可逐次关闭"""
+    from chenmo.llm_interface import LLMInterface
+    from chenmo.llm_cache import ResponseCache
+    
+    server = _StandInLLMServer()
+    try:
+        path = tmp_path / 'llm_cache.db'
+        prompts = [f"core {n}" for n in range(10)]
+        first = LLMInterface(type='openai', apiurl=server.url + '/v1', apikey='test', cache_path=path)
+        assert first.generate_many(prompts) == [f"echo: {prompt}" for prompt in prompts]
+        assert server.requests == 10
+        
+        # 新实例（相当于重新执行流程）共享磁盘缓存：零请求
+        rerun = LLMInterface(type='openai', apiurl=server.url + '/v1', apikey='test', cache_path=path)
+        assert rerun.generate_many(prompts) == [f"echo: {prompt}" for prompt in prompts]
+        assert rerun.generate("core 0") == "echo: core 0"
+        assert server.requests == 10
+        assert rerun.cache_stats()['hit_rate'] == 1.0 and rerun.cache_stats()['entries'] == 10
+        
+        # 键包含模型、模式与温度；逐次关闭缓存时总是请求
+        LLMInterface(type='openai', apiurl=server.url + '/v1', apikey='test', cache_path=path,
+                     temperature=0).generate("core 0")
+        rerun.generate("core 0", cache=False)
+        assert server.requests == 12
+    finally:
+        server.close()
+    
+    # 过期与按最久未访问淘汰
+    cache = ResponseCache(tmp_path / 'small.db', ttl=60, max_bytes=10)
+    cache.put('a', '12345')
+    cache.put('b', '12345')
+    assert cache.get('a') == '12345'
+    cache.put('c', '12345')
+    assert cache.get('b') is None and cache.get('a') == '12345' and cache.get('c') == '12345'
+    cache.ttl = 0
+    assert cache.get('a') is None
+    assert cache.stats()['evictions'] == 2
+
+
+def test_llm_streaming(tmp_path, capsys):
+    """测试流式生成：增量输出、流式写入文件与 world 模式的提前校验"""
+    from chenmo.llm_interface import LLMInterface
+    from chenmo.utils import print_content
+    
+    server = _StandInLLMServer(chunk_size=4)
+    try:
+        for llm_type, url in (('openai', server.url + '/v1'), ('ollama', server.url)):
+            gen = LLMInterface(type=llm_type, apiurl=url, apikey='test', cache_path=tmp_path / 'cache.db')
+            deltas = list(gen.stream("a long narrative"))
+            assert len(deltas) > 1 and ''.join(deltas) == "echo: a long narrative"
+        
+        # 流式结果写入缓存，再次请求一次产出
+        requests = server.requests
+        assert list(gen.stream("a long narrative")) == ["echo: a long narrative"]
+        assert server.requests == requests
+        
+        print_content(gen.stream("to stdout", cache=False))
+        assert capsys.readouterr().out.startswith("echo: to stdout\n")
+        target = tmp_path / 'story.txt'
+        print_content(gen.stream("to file", cache=False), to=str(target))
+        assert target.read_text(encoding='utf-8') == "echo: to file"
+        
+        # 生成中途出错时目标文件保持原内容，不留下临时文件
+        def broken():
+            yield "partial"
+            raise ConnectionError("stream dropped")
+        with pytest.raises(ConnectionError):
+            print_content(broken(), to=str(target))
+        assert target.read_text(encoding='utf-8') == "echo: to file"
+        assert [path.name for path in tmp_path.iterdir() if path.name.startswith('.story')] == []
+        
+        # world 模式：type 非法时在第一个字段结束后即报错，不等整个回复
+        server.reply = lambda message: message
+        server.chunk_delay = 0.01
+        world = LLMInterface(type='openai', apiurl=server.url + '/v1', apikey='test', mode='world', cache=False)
+        bad = json.dumps({"type": "planet", "name": "pandora", "metadata": {"description": "x" * 400}, "data": {}})
+        sent = server.chunks_sent
+        with pytest.raises(ValueError, match="Invalid world type"):
+            for _ in world.stream(bad):
+                pass
+        assert server.chunks_sent - sent < len(bad) // 4
+        
+        good = {"type": "core", "name": "gaia", "metadata": {"description": "行星意识"}, "data": {"laws": []}}
+        fenced = "```json\n" + json.dumps(good, ensure_ascii=False) + "\n```"
+        print_content(world.stream(fenced), to=str(tmp_path / 'gaia.json'), format="world")
+        assert json.loads((tmp_path / 'gaia.json').read_text(encoding='utf-8')) == good
+    finally:
+        server.close()
+
+
+def test_world_pipeline(tmp_path):
+    """测试生成流水线：并发生成、校验一次、成批写入，并报告吞吐量与各阶段延迟"""
+    from chenmo.llm_interface import LLMInterface
+    from chenmo.pipeline import WorldPipeline
+    
+    ops = _isolated_ops(tmp_path, backend='file')
+    server = _StandInLLMServer(delay=0.01)
+    
+    def reply(prompt):
+        entity_type, name = prompt.split()
+        if entity_type == 'broken':
+            return '{"type": "core", "name": '
+        return json.dumps({"type": entity_type, "name": name,
+                           "metadata": {"description": f"{name} of pandora"}, "data": {"rank": len(name)}})
+    
+    server.reply = reply
+    try:
+        gen = LLMInterface(type='openai', apiurl=server.url + '/v1', apikey='test', mode='world',
+                           cache_path=tmp_path / 'cache.db')
+        prompts = [f"persona kai_{n}" for n in range(40)] + ["core gaia", "tech loom", "broken x", "planet p",
+                                                            "persona kai_0"]
+        pipeline = WorldPipeline(ops.storage, gen, 'pandora', batch_size=8, concurrency=6)
+        report = pipeline.run(iter(prompts))
+    finally:
+        server.close()
+    
+    assert report['prompts'] == 45 and report['entities'] == 42 and report['failed'] == 3
+    assert sorted(failure['stage'] for failure in report['failures']) == ['save', 'validate', 'validate']
+    assert 1 <= report['batches'] <= 42 and report['entities_per_sec'] > 0
+    assert report['stages']['generate']['count'] == 45 and report['stages']['validate']['count'] == 45
+    assert report['stages']['save']['count'] == report['batches']
+    assert report['stages']['generate']['p50_ms'] >= 10
+    
+    assert ops.engine.load_entity('pandora', 'kai_7', 'p')['metadata']['description'] == "kai_7 of pandora"
+    assert ops.engine.load_entity('pandora', 'gaia', 'c')['data'] == {"rank": 4}
+    assert ops.engine.load_entity('pandora', 'loom', 't') is not None
+    assert [hit.name for hit in ops.search("gaia", mode='content')] == ['gaia']
+
+
+def test_cli_generate(tmp_path):
+    """测试 cm generate：从提示词文件经流水线写入作品"""
+    import os
+    import subprocess
+    import sys
+    
+    server = _StandInLLMServer()
+    server.reply = lambda prompt: json.dumps({"type": "persona", "name": prompt,
+                                              "metadata": {"description": f"{prompt} of pandora"}, "data": {}})
+    prompts = tmp_path / 'prompts.txt'
+    prompts.write_text("kai\nneytiri\n\njake\n", encoding='utf-8')
+    env = dict(os.environ, HOME=str(tmp_path), OPENAI_API_KEY='test', CHENMO_LLM_CACHE='0')
+    try:
+        result = subprocess.run([sys.executable, '-m', 'chenmo.cli', 'generate', 'pandora', '--prompts', str(prompts),
+                                 '--apiurl', server.url + '/v1'],
+                                env=env, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    finally:
+        server.close()
+    
+    assert result.returncode == 0, result.stderr
+    assert "Generated 3 entities from 3 prompts" in result.stdout
+    personas = tmp_path / '.chenmo' / 'works' / 'pandora' / 'personas'
+    assert sorted(path.stem for path in personas.glob('*.json')) == ['jake', 'kai', 'neytiri']
+
+
+def test_context_retrieval(tmp_path):
+    """测试上下文检索：按相关度注入作品实体，遵守 token 预算，随写入增量更新"""
+    from chenmo.llm_interface import LLMInterface
+    from chenmo.retrieval import ContextRetriever
+    
+    ops = _isolated_ops(tmp_path, backend='file')
+    ops.register('avatar', log_works="潘多拉星球")
+    ops.persona_extract('avatar', 'jake', traits=["marine", "avatar_driver"])
+    ops.persona_extract('avatar', 'neytiri', traits=["omaticaya_hunter", "bow"])
+    ops.core_extract('avatar', 'eywa_network', axioms=["eywa_links_all_life", "tree_of_souls"])
+    ops.register('other', log_person=["eywa_clone"])
+    
+    retriever = ContextRetriever(ops.engine, 'avatar', k=2, token_budget=1024)
+    assert [hit.name for hit in retriever.retrieve("a hunter who hears eywa")] == ['neytiri', 'eywa_network']
+    context = retriever.context("a hunter who hears eywa")
+    assert '[persona] neytiri' in context and '[core] eywa_network' in context and 'jake' not in context
+    
+    # 预算只够一个实体时只注入最相关的那个
+    limited = ContextRetriever(ops.engine, 'avatar', k=2, token_budget=70).context("hunter eywa")
+    assert '[persona] neytiri' in limited and '[core]' not in limited
+    assert ContextRetriever(ops.engine, 'avatar').context("unrelated words") == ''
+    
+    # 新写入的实体立即可检索
+    ops.storage.save_work_data('avatar', 'amp_suit', 't', {"description": "armored hunter exoskeleton"})
+    assert 'amp_suit' in [hit.name for hit in retriever.retrieve("exoskeleton")]
+    
+    server = _StandInLLMServer()
+    try:
+        gen = LLMInterface(type='openai', apiurl=server.url + '/v1', apikey='test', cache_path=tmp_path / 'cache.db',
+                           retriever=retriever)
+        assert gen.generate("a new hunter ally") == "echo: a new hunter ally"
+        system = [message['content'] for message in server.last_messages if message['role'] == 'system']
+        assert len(system) == 1 and '[persona] neytiri' in system[0]
+        
+        # 上下文是缓存键的一部分：相关实体变化后重新请求
+        gen.generate("a new hunter ally")
+        assert server.requests == 1
+        ops.storage.save_work_data('avatar', 'neytiri', 'p', {"traits": ["na'vi hunter", "bow"]}, "overlay")
+        gen.generate("a new hunter ally")
+        assert server.requests == 2
+    finally:
+        server.close()
+
+
 if __name__ == "__main__":
     test_basic_operations()
     test_cli_commands()
\ No newline at end of file